@@ -0,0 +1,383 @@
+import hmac
+import io
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+
+from flask import Blueprint, Response, abort, current_app, jsonify, request, stream_with_context
+from sqlalchemy import func
+from werkzeug.exceptions import HTTPException
+
+from setup import db
+from models import Venue, Artist, Show, Genre, genre_members, stats_link
+import queries
+import importer
+import pool
+import routing
+import exporter
+import booking
+import geo
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Rows fetched per round trip when streaming a collection, and rows
+# serialized per chunk written to the client.
+STREAM_BATCH_SIZE = 1000
+
+
+#----------------------------------------------------------------------------#
+# Projections.
+#----------------------------------------------------------------------------#
+# The columns each resource exposes. Only the ones named in ?fields= are
+# selected, so a client asking for ids and names never loads the rest.
+
+def _upcoming_count(model):
+    # Entities without shows have no statistics row.
+    table, fk = stats_link(model)
+    return func.coalesce(db.session.query(table.c.upcoming_shows_count).
+                         filter(fk == model.id).
+                         correlate(model).
+                         as_scalar(), 0)
+
+
+def venue_fields():
+    return OrderedDict([
+        ('id', Venue.id),
+        ('name', Venue.name),
+        ('city', Venue.city),
+        ('state', Venue.state),
+        ('address', Venue.address),
+        ('latitude', Venue.latitude),
+        ('longitude', Venue.longitude),
+        ('phone', Venue.phone),
+        ('genres', queries.genre_names(Venue)),
+        ('website', Venue.website),
+        ('image_link', Venue.image_link),
+        ('facebook_link', Venue.facebook_link),
+        ('seeking_talent', Venue.seeking_talent),
+        ('seeking_description', Venue.seeking_description),
+        ('num_upcoming_shows', _upcoming_count(Venue)),
+    ])
+
+
+def artist_fields():
+    return OrderedDict([
+        ('id', Artist.id),
+        ('name', Artist.name),
+        ('city', Artist.city),
+        ('state', Artist.state),
+        ('phone', Artist.phone),
+        ('genres', queries.genre_names(Artist)),
+        ('website', Artist.website),
+        ('image_link', Artist.image_link),
+        ('facebook_link', Artist.facebook_link),
+        ('seeking_venue', Artist.seeking_venue),
+        ('seeking_description', Artist.seeking_description),
+        ('num_upcoming_shows', _upcoming_count(Artist)),
+    ])
+
+
+def show_fields():
+    return OrderedDict([
+        ('id', Show.id),
+        ('start_time', Show.start_time),
+        ('duration_minutes', Show.duration_minutes),
+        ('artist_id', Show.artist_id),
+        ('artist_name', Artist.name),
+        ('artist_image_link', Artist.image_link),
+        ('venue_id', Show.venue_id),
+        ('venue_name', Venue.name),
+    ])
+
+
+def _select(fields):
+    # The requested subset of `fields`, in request order; all by default.
+    names = request.args.get('fields')
+    if not names:
+        return fields
+    selected = OrderedDict()
+    for name in names.split(','):
+        name = name.strip()
+        if name not in fields:
+            abort(400, 'Unknown field: %s' % name)
+        selected[name] = fields[name]
+    return selected
+
+
+#----------------------------------------------------------------------------#
+# Serialization.
+#----------------------------------------------------------------------------#
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def dumps(value):
+    return json.dumps(value, default=_default)
+
+
+def _record(names, row):
+    record = OrderedDict(zip(names, row))
+    if 'genres' in record:
+        record['genres'] = queries.split_genres(record['genres'])
+    return record
+
+
+def _wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson'
+
+
+def _chunks(rows, names, ndjson):
+    # Serializes rows as they arrive from the cursor, STREAM_BATCH_SIZE at a
+    # time, so memory stays bounded by one batch whatever the result size.
+    batch = []
+    first = True
+    if not ndjson:
+        yield '['
+    for row in rows:
+        record = dumps(_record(names, row))
+        if ndjson:
+            batch.append(record + '\n')
+        else:
+            batch.append(record if first else ',' + record)
+            first = False
+        if len(batch) >= STREAM_BATCH_SIZE:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+    if not ndjson:
+        yield ']\n'
+
+
+def stream(query, fields):
+    # `query` selects the columns of `fields` in order.
+    ndjson = _wants_ndjson()
+    rows = query.execution_options(stream_results=True).yield_per(STREAM_BATCH_SIZE)
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(_chunks(rows, list(fields), ndjson)), mimetype=mimetype)
+
+
+#----------------------------------------------------------------------------#
+# Resources.
+#----------------------------------------------------------------------------#
+
+def _genre_filter(query, model):
+    genre = request.args.get('genre')
+    if genre is not None:
+        query = query.filter(model.id.in_(genre_members(model, genre)))
+    return query
+
+
+@api.route('/genres')
+@routing.replica
+def genres():
+    return jsonify([name for name, in db.session.query(Genre.name).order_by(Genre.name)])
+
+
+@api.route('/venues')
+@routing.replica
+def venues():
+    # All venues, or those tagged with ?genre=.
+    fields = _select(venue_fields())
+    query = db.session.query(*fields.values()).select_from(Venue)
+    return stream(_genre_filter(query, Venue).order_by(Venue.id), fields)
+
+
+def _datetime_arg(name):
+    try:
+        return datetime.fromisoformat(request.args[name])
+    except KeyError:
+        abort(400, 'Missing %s' % name)
+    except ValueError:
+        abort(400, 'Invalid %s: expected an ISO 8601 date and time' % name)
+
+
+@api.route('/venues/free')
+@routing.replica
+def free_venues():
+    # Venues in ?city= (and ?state=) with nothing booked between ?start=
+    # and ?end=, e.g. ?city=San+Francisco&start=2026-10-23T20:00&end=2026-10-23T23:00
+    city = request.args.get('city')
+    if not city:
+        abort(400, 'Missing city')
+    start, end = _datetime_arg('start'), _datetime_arg('end')
+    if end <= start:
+        abort(400, 'end must be after start')
+    venues = booking.free_venues(city, start, end, state=request.args.get('state'))
+    return jsonify({
+        'city': city,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'count': len(venues),
+        'data': [OrderedDict(zip(('id', 'name', 'address', 'state'), venue)) for venue in venues],
+    })
+
+
+def _float_arg(name, low, high, default=None):
+    value = request.args.get(name, default, type=float)
+    if value is None:
+        abort(400, 'Missing or invalid %s' % name)
+    if not low <= value <= high:
+        abort(400, '%s must be between %s and %s' % (name, low, high))
+    return value
+
+
+def _limit():
+    return min(max(request.args.get('limit', 50, type=int), 1), current_app.config['GEO_MAX_RESULTS'])
+
+
+@api.route('/venues/near')
+@routing.replica
+def venues_near():
+    # Venues within ?radius= km (10 by default) of ?lat=&lon=, nearest
+    # first, e.g. ?lat=37.7749&lon=-122.4194&radius=5
+    latitude, longitude = _float_arg('lat', -90, 90), _float_arg('lon', -180, 180)
+    radius = _float_arg('radius', 0, current_app.config['GEO_MAX_RADIUS_KM'], default=10.0)
+    venues = geo.near(latitude, longitude, radius, _limit())
+    return jsonify({
+        'lat': latitude,
+        'lon': longitude,
+        'radius_km': radius,
+        'count': len(venues),
+        'data': venues,
+    })
+
+
+@api.route('/venues/within')
+@routing.replica
+def venues_within():
+    # Venues inside the box ?south=&west=&north=&east=, by name. A box with
+    # west greater than east crosses the antimeridian.
+    south, north = _float_arg('south', -90, 90), _float_arg('north', -90, 90)
+    west, east = _float_arg('west', -180, 180), _float_arg('east', -180, 180)
+    if north < south:
+        abort(400, 'north must not be below south')
+    venues = geo.within(south, west, north, east, _limit())
+    return jsonify({
+        'box': [south, west, north, east],
+        'count': len(venues),
+        'data': venues,
+    })
+
+
+@api.route('/venues/<int:venue_id>')
+@routing.replica
+def venue(venue_id):
+    fields = _select(venue_fields())
+    row = db.session.query(*fields.values()).filter(Venue.id == venue_id).first_or_404()
+    data = _record(fields, row)
+    data.update(queries.show_timeline(Venue, venue_id, time_format=None))
+    return Response(dumps(data), mimetype='application/json')
+
+
+@api.route('/artists')
+@routing.replica
+def artists():
+    # All artists, or those tagged with ?genre=.
+    fields = _select(artist_fields())
+    query = db.session.query(*fields.values()).select_from(Artist)
+    return stream(_genre_filter(query, Artist).order_by(Artist.id), fields)
+
+
+@api.route('/artists/<int:artist_id>')
+@routing.replica
+def artist(artist_id):
+    fields = _select(artist_fields())
+    row = db.session.query(*fields.values()).filter(Artist.id == artist_id).first_or_404()
+    data = _record(fields, row)
+    data.update(queries.show_timeline(Artist, artist_id, time_format=None))
+    return Response(dumps(data), mimetype='application/json')
+
+
+@api.route('/shows')
+@routing.replica
+def shows():
+    # Upcoming shows unless ?all=1, in start time order.
+    fields = _select(show_fields())
+    query = db.session.query(*fields.values()).\
+        select_from(Show).\
+        join(Artist, Artist.id == Show.artist_id).\
+        join(Venue, Venue.id == Show.venue_id).\
+        filter(Show.start_time.isnot(None))
+    if not request.args.get('all', 0, type=int):
+        query = query.filter(Show.start_time >= datetime.now())
+    return stream(query.order_by(Show.start_time, Show.id), fields)
+
+
+@api.route('/search/venues')
+@routing.replica
+def search_venues():
+    page = request.args.get('page', 1, type=int)
+    return jsonify(queries.search(Venue, request.args.get('q', ''), page=page,
+                                  genre=request.args.get('genre')))
+
+
+@api.route('/search/artists')
+@routing.replica
+def search_artists():
+    page = request.args.get('page', 1, type=int)
+    return jsonify(queries.search(Artist, request.args.get('q', ''), page=page,
+                                  genre=request.args.get('genre')))
+
+
+@api.route('/import/<kind>', methods=['POST'])
+def import_records(kind):
+    # Streams a CSV (text/csv) or NDJSON (application/x-ndjson) body into
+    # the table and returns the import report. Only served with a matching
+    # IMPORT_API_TOKEN.
+    token = current_app.config['IMPORT_API_TOKEN']
+    if not token or kind not in importer.IMPORTERS:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                               ('Bearer %s' % token).encode('utf-8')):
+        abort(401)
+    format = request.args.get('format')
+    if format is None:
+        format = 'ndjson' if request.mimetype in ('application/x-ndjson', 'application/json') else 'csv'
+    if format not in importer.READERS:
+        abort(400, 'Unknown format: %s' % format)
+    batch_size = request.args.get('batch_size', importer.IMPORT_BATCH_SIZE, type=int)
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    report = importer.run(kind, stream, format=format, batch_size=max(batch_size, 1))
+    return jsonify(report.as_dict())
+
+
+@api.route('/export/<kind>')
+@routing.replica
+def export(kind):
+    # The whole table as ?format=csv (default), ndjson or columns, streamed
+    # from a server-side cursor.
+    if kind not in exporter.EXPORTS:
+        abort(404)
+    format = request.args.get('format', 'csv')
+    if format not in exporter.WRITERS:
+        abort(400, 'Unknown format: %s' % format)
+    batch_size = request.args.get('batch_size', exporter.EXPORT_BATCH_SIZE, type=int)
+    chunks = exporter.run(kind, format=format, batch_size=max(batch_size, 1))
+    response = Response(stream_with_context(chunks), mimetype=exporter.WRITERS[format][1])
+    extension = 'csv' if format == 'csv' else 'ndjson'
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (kind, extension)
+    return response
+
+
+@api.route('/metrics/pool')
+def pool_metrics():
+    # Connection pool usage of the process that serves the request.
+    data = pool.status(db.engine.pool)
+    data['profile'] = current_app.config.get('DB_PROFILE')
+    return jsonify(data)
+
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+@api.errorhandler(HTTPException)
+def http_error(error):
+    response = jsonify({'error': error.name, 'message': error.description})
+    response.status_code = error.code
+    return response
@@ -3,14 +3,13 @@
 #----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
-import babel
 from flask_migrate import Migrate
 from flask import (
     Flask,
     render_template,
     request,
     Response,
+    abort,
     flash,
     redirect,
     url_for
@@ -23,7 +22,23 @@ from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from setup import app, db
-from models import Venue, Artist, Show
+from models import Venue, Artist, Show, genre_members
+import queries
+import cache
+import conditional
+import routing
+import sqltrace
+from api import api
+import importer
+import exporter
+import stats
+import templating
+import formatting
+import booking
+import geo
+import jobs
+import deletes
+import matching
 
 # TODO: connect to a local postgresql database
 
@@ -33,21 +48,11 @@ from models import Venue, Artist, Show
 
 migrate = Migrate(app, db)
 moment = Moment(app)
+app.register_blueprint(api)
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
-
-
-def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format)
-
-
-app.jinja_env.filters['datetime'] = format_datetime
+# The `datetime` filter is registered by formatting.py.
 
 #----------------------------------------------------------------------------#
 # Controllers.
@@ -63,69 +68,42 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@routing.replica
+@sqltrace.budget(8)
+@conditional.etag(conditional.venues_listing)
+@cache.cached
 def venues():
-    # TODO: replace with real venues data.
-    #       num_shows should be aggregated based on number of upcoming shows per venue.
-    areas = Venue.query.with_entities(Venue.city.distinct(), Venue.state)
-    data = list()
-    for city, state in areas:
-        data.append({
-            "city": city,
-            "state": state,
-            "venues": Venue.query.filter_by(city=city, state=state)
-        })
-    return render_template('pages/venues.html', areas=data)
+    cache.tag('venues')
+    cache.expire_at(queries.next_show_time())
+    genre = request.args.get('genre')
+    data = queries.venues_by_area(genre=genre)
+    return render_template('pages/venues.html', areas=data, genres=genres_choices(), genre=genre)
 
 
 @app.route('/venues/search', methods=['POST'])
+@routing.replica
+@sqltrace.budget(8)
 def search_venues():
-    # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-    # seach for Hop should return "The Musical Hop".
-    # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-    key = request.form['search_term']
-    venues = Venue.query.filter(Venue.name.ilike('%' + key + '%'))
-    venues = venues.order_by(Venue.name).all()
-    count = 0
-    data = list()
-    for venue in venues:
-        count = count + 1
-        upcoming_shows = venue.shows.filter(Show.start_time > datetime.now())
-        data.append({
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": upcoming_shows.count(),
-        })
-
-    response = {
-        "count": count,
-        "data": data
-    }
-    return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+    key = request.form.get('search_term', '')
+    page = request.form.get('page', 1, type=int)
+    genre = request.form.get('genre') or None
+    response = queries.search(Venue, key, page=page, genre=genre)
+    return render_template('pages/search_venues.html', results=response, search_term=key, genre=genre)
 
 
 @app.route('/venues/<int:venue_id>')
+@routing.replica
+@sqltrace.budget(8)
+@conditional.etag(conditional.venue)
+@cache.cached
 def show_venue(venue_id):
     # shows the venue page with the given venue_id
     # TODO: replace with real venue data from the venues table, using venue_id
     venue = Venue.query.filter_by(id=venue_id).first_or_404()
-    past_shows = db.session.query(Artist, Show).join(Show).join(Venue).\
-        filter(
-            Show.venue_id == venue_id,
-            Show.artist_id == Artist.id,
-            Show.start_time < datetime.now()
-    ).\
-        all()
-    upcoming_shows = db.session.query(Artist, Show).join(Show).join(Venue).\
-        filter(
-            Show.venue_id == venue_id,
-            Show.artist_id == Artist.id,
-            Show.start_time > datetime.now()
-    ).\
-        all()
     data = {
         "id": venue.id,
         "name": venue.name,
-        "genres": venue.genres,
+        "genres": list(venue.genres),
         "address": venue.address,
         "city": venue.city,
         "state": venue.state,
@@ -134,22 +112,14 @@ def show_venue(venue_id):
         "facebook_link": venue.facebook_link,
         "seeking_talent": venue.seeking_talent,
         "seeking_description": venue.seeking_description,
-        "image_link": venue.image_link,
-        "past_shows": [{
-            "artist_id": artist.id,
-            "artist_name": artist.name,
-            "artist_image_link": artist.image_link,
-            "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-        } for artist, show in past_shows],
-        "upcoming_shows": [{
-            "artist_id": artist.id,
-            "artist_name": artist.name,
-            "artist_image_link": artist.image_link,
-            "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-        } for artist, show in upcoming_shows],
-        "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows)
+        "image_link": venue.image_link
     }
+    data.update(queries.show_timeline(Venue, venue_id))
+    data['suggested_artists'] = matching.suggestions(Venue, venue_id)
+    cache.tag('venue:%d' % venue_id, 'matches', *['artist:%d' % show['artist_id']
+                                                  for show in data['past_shows'] + data['upcoming_shows'] +
+                                                  data['suggested_artists']])
+    cache.expire_at(data['next_show_time'])
     return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
@@ -216,12 +186,16 @@ def create_venue_submission():
 def delete_venue(venue_id):
     # TODO: Complete this endpoint for taking a venue_id, and using
     # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+    # The venue is only marked deleted (see deletes.py), so it can be restored.
     venue = Venue.query.get_or_404(venue_id)
+    name = venue.name
     try:
-        db.session.delete(venue)
+        deletes.soft_delete(venue)
         db.session.commit()
+        flash('Venue %s was deleted.' % name)
     except:
         db.session.rollback()
+        flash('An error occurred. Venue %s could not be deleted.' % name)
     finally:
         db.session.close()
     # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
@@ -229,6 +203,22 @@ def delete_venue(venue_id):
     return render_template('pages/home.html')
 
 
+@app.route('/venues/<int:venue_id>/restore', methods=['GET'])
+def restore_venue(venue_id):
+    venue = Venue.query.execution_options(include_deleted=True).get_or_404(venue_id)
+    name = venue.name
+    try:
+        deletes.restore(venue)
+        db.session.commit()
+        flash('Venue %s was restored.' % name)
+    except:
+        db.session.rollback()
+        flash('An error occurred. Venue %s could not be restored.' % name)
+    finally:
+        db.session.close()
+    return redirect(url_for('show_venue', venue_id=venue_id))
+
+
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
     form = VenueForm()
@@ -283,70 +273,50 @@ def edit_venue_submission(venue_id):
 
 
 @app.route('/artists')
+@routing.replica
+@sqltrace.budget(4)
+@conditional.etag(conditional.artists_listing)
+@cache.cached
 def artists():
+    cache.tag('artists')
     # TODO: replace with real data returned from querying the database
     artists = Artist.query.with_entities(Artist.id, Artist.name)
+    genre = request.args.get('genre')
+    if genre is not None:
+        artists = artists.filter(Artist.id.in_(genre_members(Artist, genre)))
     data = list()
     for artist in artists:
         data.append({
             "id": artist.id,
             "name": artist.name
         })
-    return render_template('pages/artists.html', artists=data)
+    return render_template('pages/artists.html', artists=data, genres=genres_choices(), genre=genre)
 
 
 @app.route('/artists/search', methods=['POST'])
+@routing.replica
+@sqltrace.budget(8)
 def search_artists():
-    # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-    # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-    # search for "band" should return "The Wild Sax Band".
-    key = request.form['search_term']
-    artists = Artist.query.filter(Artist.name.ilike('%' + key + '%'))
-    artists = artists.order_by(Artist.name).all()
-    count = 0
-    data = list()
-    for artist in artists:
-        count = count + 1
-        upcoming_shows = artist.shows.filter(Show.start_time > datetime.now())
-        data.append({
-            "id": artist.id,
-            "name": artist.name,
-            "num_upcoming_shows": upcoming_shows.count(),
-        })
-
-    response = {
-        "count": count,
-        "data": data
-    }
-    return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+    key = request.form.get('search_term', '')
+    page = request.form.get('page', 1, type=int)
+    genre = request.form.get('genre') or None
+    response = queries.search(Artist, key, page=page, genre=genre)
+    return render_template('pages/search_artists.html', results=response, search_term=key, genre=genre)
 
 
 @app.route('/artists/<int:artist_id>')
+@routing.replica
+@sqltrace.budget(8)
+@conditional.etag(conditional.artist)
+@cache.cached
 def show_artist(artist_id):
     # shows the venue page with the given venue_id
     # TODO: replace with real venue data from the venues table, using venue_id
     artist = Artist.query.filter_by(id=artist_id).first_or_404()
-
-    past_shows = db.session.query(Artist, Show).join(Show).join(Venue).\
-        filter(
-        Show.venue_id == Venue.id,
-        Show.artist_id == artist_id,
-        Show.start_time < datetime.now()
-    ).\
-        all()
-
-    upcoming_shows = db.session.query(Artist, Show).join(Show).join(Venue).\
-        filter(
-        Show.venue_id == Venue.id,
-        Show.artist_id == artist_id,
-        Show.start_time > datetime.now()
-    ).\
-        all()
-
     data = {
         "id": artist.id,
         "name": artist.name,
-        "genres": artist.genres,
+        "genres": list(artist.genres),
         "city": artist.city,
         "state": artist.state,
         "phone": artist.phone,
@@ -354,22 +324,14 @@ def show_artist(artist_id):
         "facebook_link": artist.facebook_link,
         "seeking_venue": artist.seeking_venue,
         "seeking_description": artist.seeking_description,
-        "image_link": artist.image_link,
-        'past_shows': [{
-            "venue_id": venue.id,
-            "venue_name": venue.name,
-            "venue_image_link": venue.image_link,
-            "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-        } for venue, show in past_shows],
-        "upcoming_shows": [{
-            "venue_id": venue.id,
-            "venue_name": venue.name,
-            "venue_image_link": venue.image_link,
-            "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M")
-        } for venue, show in upcoming_shows],
-        "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows)
+        "image_link": artist.image_link
     }
+    data.update(queries.show_timeline(Artist, artist_id))
+    data['suggested_venues'] = matching.suggestions(Artist, artist_id)
+    cache.tag('artist:%d' % artist_id, 'matches', *['venue:%d' % show['venue_id']
+                                                    for show in data['past_shows'] + data['upcoming_shows'] +
+                                                    data['suggested_venues']])
+    cache.expire_at(data['next_show_time'])
     return render_template('pages/show_artist.html', artist=data)
 
 #  Update
@@ -380,12 +342,16 @@ def show_artist(artist_id):
 def delete_artist(artist_id):
     # TODO: Complete this endpoint for taking a venue_id, and using
     # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+    # The artist is only marked deleted (see deletes.py), so it can be restored.
     artist = Artist.query.get_or_404(artist_id)
+    name = artist.name
     try:
-        db.session.delete(artist)
+        deletes.soft_delete(artist)
         db.session.commit()
+        flash('Artist %s was deleted.' % name)
     except:
         db.session.rollback()
+        flash('An error occurred. Artist %s could not be deleted.' % name)
     finally:
         db.session.close()
     # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
@@ -393,6 +359,22 @@ def delete_artist(artist_id):
     return render_template('pages/home.html')
 
 
+@app.route('/artists/<int:artist_id>/restore', methods=['GET'])
+def restore_artist(artist_id):
+    artist = Artist.query.execution_options(include_deleted=True).get_or_404(artist_id)
+    name = artist.name
+    try:
+        deletes.restore(artist)
+        db.session.commit()
+        flash('Artist %s was restored.' % name)
+    except:
+        db.session.rollback()
+        flash('An error occurred. Artist %s could not be restored.' % name)
+    finally:
+        db.session.close()
+    return redirect(url_for('show_artist', artist_id=artist_id))
+
+
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
     form = ArtistForm()
@@ -510,14 +492,26 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@routing.replica
+@sqltrace.budget(8)
+@conditional.etag(conditional.shows_listing)
+@cache.cached
 def shows():
-    # displays list of shows at /shows
-    # TODO: replace with real venues data.
-    #       num_shows should be aggregated based on number of upcoming shows per venue.
-    shows = Show.query.all()
-    for show in shows:
-        show.start_time = str(show.start_time)
-    return render_template('pages/shows.html', shows=shows)
+    # displays list of shows at /shows, upcoming only unless ?all=1
+    after = request.args.get('after')
+    if after:
+        try:
+            after = queries.decode_cursor(after)
+        except ValueError:
+            abort(400)
+    upcoming_only = not request.args.get('all', 0, type=int)
+    feed = queries.shows_feed(after=after, upcoming_only=upcoming_only)
+    cache.tag('shows')
+    if upcoming_only and feed['shows']:
+        cache.expire_at(feed['shows'][0].start_time)
+    start_times = formatting.format_many([show.start_time for show in feed['shows']], 'medium')
+    return render_template('pages/shows.html', shows=feed['shows'], start_times=start_times,
+                           next=feed['next'], upcoming_only=upcoming_only)
 
 
 @app.route('/shows/create')
@@ -531,8 +525,10 @@ def save_show(data):
     artist_id = data.get('artist_id')
     venue_id = data.get('venue_id')
     start_time = data.get('start_time')
+    duration_minutes = data.get('duration_minutes')
 
-    show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
+    show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time,
+                duration_minutes=duration_minutes)
 
     return show
 
@@ -541,12 +537,21 @@ def save_show(data):
 def create_show_submission():
     # called to create new shows in the db, upon submitting new show listing form
     # TODO: insert form data as a new Show record in the db, instead
-    data = request.form
-    show = save_show(data)
+    form = ShowForm(request.form, meta={'csrf': False})
+    if not form.validate():
+        message = []
+        for field, err in form.errors.items():
+            message.append(field + ' ' + '|'.join(err))
+        flash('Errors ' + str(message))
+        return render_template('pages/home.html')
+    show = save_show(form.data)
     try:
         db.session.add(show)
         db.session.commit()
         flash('Show was successfully listed!')
+    except booking.DoubleBooked as e:
+        db.session.rollback()
+        flash('Show could not be listed: %s.' % e)
     except:
         db.session.rollback()
         flash('An error occurred. Show could not be listed.')
@@ -0,0 +1,57 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+
+import pool
+import templating
+from app import app
+
+
+def threads(config=app.config, environ=os.environ):
+    # One thread per pooled connection by default: a request never waits
+    # for a connection once it has a thread, and requests beyond that wait
+    # on the event loop, which holds thousands of idle sockets cheaply.
+    if environ.get('ASGI_THREADS'):
+        return int(environ['ASGI_THREADS'])
+    values = pool.settings(config.get('DB_PROFILE', 'web'), environ)
+    return values['pool_size'] + max(values['max_overflow'], 0)
+
+
+class ThreadedApplication(object):
+    # Serves a WSGI app over ASGI. The event loop accepts connections and
+    # reads requests; each request then runs the unchanged Flask views on a
+    # thread from a bounded pool. SQLAlchemy 1.3 and Flask 1.1 have no
+    # async engine or async views, so the blocking work stays on threads.
+
+    def __init__(self, wsgi_app, max_workers):
+        self.application = WsgiToAsgi(wsgi_app)
+        self.max_workers = max_workers
+        self.loop = None
+
+    def _install_executor(self):
+        # asgiref runs sync code on the loop's default executor.
+        loop = asyncio.get_event_loop()
+        if loop is not self.loop:
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=self.max_workers))
+            self.loop = loop
+
+    async def __call__(self, scope, receive, send):
+        self._install_executor()
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    if app.config['TEMPLATE_WARM_UP']:
+                        await asyncio.get_event_loop().run_in_executor(None, templating.warm_up)
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        await self.application(scope, receive, send)
+
+
+# uvicorn asgi:application --workers 4
+# gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+application = ThreadedApplication(app, threads())
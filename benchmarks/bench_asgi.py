@@ -0,0 +1,171 @@
+"""Compare WSGI (gunicorn sync workers) and ASGI (uvicorn) throughput.
+
+    python -m benchmarks.bench_asgi --connections 500 --workers 4
+
+Seeds the database, starts each server on it in turn and keeps
+--connections keep-alive connections busy with the read-heavy pages for
+--duration seconds. The servers read DATABASE_URL, so they see the same
+database as the seeding; needs gunicorn and uvicorn installed.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.common import DEFAULT_DATABASE, load_app, report, seed
+from benchmarks.load import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'wsgi': lambda port, workers: ['gunicorn', 'app:app', '--workers', str(workers),
+                                   '--bind', '127.0.0.1:%d' % port, '--backlog', '2048'],
+    'asgi': lambda port, workers: ['uvicorn', 'asgi:application', '--workers', str(workers),
+                                   '--port', str(port), '--backlog', '2048', '--log-level', 'warning'],
+}
+
+
+def requests(rnd, venues, artists):
+    # The read-heavy routes, with ids and terms spread out so the page
+    # cache does not answer most of them.
+    while True:
+        pick = rnd.random()
+        if pick < 0.1:
+            yield 'GET', '/venues', None
+        elif pick < 0.2:
+            yield 'GET', '/artists', None
+        elif pick < 0.3:
+            yield 'GET', '/shows', None
+        elif pick < 0.6:
+            yield 'GET', '/venues/%d' % rnd.randint(1, venues), None
+        elif pick < 0.9:
+            yield 'GET', '/artists/%d' % rnd.randint(1, artists), None
+        else:
+            yield 'POST', '/venues/search', 'search_term=Venue+%d' % rnd.randint(1, 999)
+
+
+async def fetch(port, connection, method, path, body):
+    # One request over `connection` (reader, writer), reconnecting when the
+    # server closed it. Returns the status and the connection to reuse.
+    if connection is None:
+        connection = await asyncio.open_connection('127.0.0.1', port)
+    reader, writer = connection
+    head = '%s %s HTTP/1.1\r\nHost: 127.0.0.1\r\n' % (method, path)
+    if body:
+        head += 'Content-Type: application/x-www-form-urlencoded\r\nContent-Length: %d\r\n' % len(body)
+    writer.write((head + '\r\n' + (body or '')).encode())
+    status = int((await reader.readline()).split()[1])
+    length, close = None, False
+    while True:
+        line = (await reader.readline()).strip().lower()
+        if not line:
+            break
+        if line.startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+        elif line == b'connection: close':
+            close = True
+    if length is None:
+        await reader.read()
+        close = True
+    else:
+        await reader.readexactly(length)
+    if close:
+        writer.close()
+        connection = None
+    return status, connection
+
+
+async def drive(port, connections, duration, venues, artists, timeout):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def client(number):
+        nonlocal errors
+        connection = None
+        for method, path, body in requests(random.Random(number), venues, artists):
+            if time.perf_counter() >= deadline:
+                break
+            start = time.perf_counter()
+            try:
+                status, connection = await asyncio.wait_for(fetch(port, connection, method, path, body), timeout)
+            except (asyncio.TimeoutError, OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                status, connection = 599, None
+            if status >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+        if connection is not None:
+            connection[1].close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client(number) for number in range(connections)])
+    return sorted(latencies), errors, time.perf_counter() - started
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited with status %d' % process.returncode)
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start on port %d' % port)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--venues', type=int, default=2000)
+    parser.add_argument('--artists', type=int, default=2000)
+    parser.add_argument('--shows', type=int, default=50000)
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4, help='server processes')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per server')
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds before a request counts as failed')
+    parser.add_argument('--servers', default='wsgi,asgi')
+    args = parser.parse_args()
+
+    app, db = load_app(args.database)
+    with app.app_context():
+        seed(db, venues=args.venues, artists=args.artists, shows=args.shows)
+
+    env = dict(os.environ, DATABASE_URL=args.database)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    bin = os.path.dirname(sys.executable)
+    results = {}
+    for name in args.servers.split(','):
+        port = free_port()
+        command = SERVERS[name](port, args.workers)
+        process = subprocess.Popen([os.path.join(bin, command[0])] + command[1:], cwd=ROOT, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(port, process)
+            latencies, errors, elapsed = asyncio.run(drive(
+                port, args.connections, args.duration, args.venues, args.artists, args.timeout))
+        finally:
+            process.terminate()
+            process.wait()
+        results['%s requests/s' % name] = '%.1f' % (len(latencies) / elapsed)
+        for p in (50, 95, 99):
+            results['%s p%d ms' % (name, p)] = '%.1f' % (percentile(latencies, p) * 1000)
+        results['%s failed' % name] = errors
+
+    report('%d connections, %d workers, %.0fs per server' % (args.connections, args.workers, args.duration),
+           results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Measure time to first byte per route in a freshly forked worker.
+
+    python -m benchmarks.bench_cold_start
+
+The app is imported once, like a gunicorn master with --preload, and for
+every route and mode a child is forked that serves the route twice: the
+first response pays for whatever the worker has not loaded yet, the second
+shows the steady state. Modes:
+
+    cold       templates parsed and compiled on first use
+    bytecode   templates loaded from a filled bytecode cache
+    warm       templating.warm_up() ran before the first request
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import DEFAULT_DATABASE, load_app, seed
+
+ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/venues', None),
+    ('GET', '/artists', None),
+    ('GET', '/shows', None),
+    ('GET', '/venues/1', None),
+    ('GET', '/artists/1', None),
+    ('POST', '/venues/search', {'search_term': 'Venue 1'}),
+    ('GET', '/venues/create', None),
+    ('GET', '/artists/1/edit', None),
+    ('GET', '/shows/create', None),
+]
+
+MODES = ('cold', 'bytecode', 'warm')
+
+
+def first_byte(client, method, path, data):
+    # The test client hands back the response once the view returned, which
+    # for these buffered pages is when the first byte would go out.
+    start = time.perf_counter()
+    client.open(path, method=method, data=data).close()
+    return time.perf_counter() - start
+
+
+def in_child(function):
+    # Runs `function` in a forked child and returns its JSON result.
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        try:
+            os.write(write, json.dumps(function()).encode())
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        output = f.read()
+    os.waitpid(pid, 0)
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=10000)
+    args = parser.parse_args()
+
+    app, db = load_app(args.database)
+    import templating
+    app.config['PAGE_CACHE_ENABLED'] = False
+    with app.app_context():
+        seed(db, venues=args.venues, artists=args.artists, shows=args.shows)
+        db.engine.dispose()
+    directory = tempfile.mkdtemp(prefix='fyyur-jinja-')
+
+    def serve(mode, method, path, data):
+        warm_up = templating.warm_up() if mode == 'warm' else 0.0
+        client = app.test_client()
+        return [warm_up, first_byte(client, method, path, data), first_byte(client, method, path, data)]
+
+    try:
+        results = {}
+        for mode in MODES:
+            # The parent stays cold: only children render anything.
+            app.jinja_env.cache.clear()
+            if mode == 'cold':
+                app.jinja_env.bytecode_cache = None
+            else:
+                templating.use_bytecode_cache(directory)
+                in_child(templating.compile_templates)
+            results[mode] = {path: in_child(lambda: serve(mode, method, path, data))
+                             for method, path, data in ROUTES}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print('time to first byte after fork, ms (first request / second request)')
+    print('  %-18s' % 'route' + ''.join('%20s' % mode for mode in MODES))
+    for method, path, data in ROUTES:
+        print('  %-18s' % path + ''.join('%11.1f / %6.1f' % (results[mode][path][1] * 1000, results[mode][path][2] * 1000)
+                                         for mode in MODES))
+    warm_up = [results['warm'][path][0] for method, path, data in ROUTES]
+    print('  warm-up itself: %.0f ms per worker' % (sum(warm_up) / len(warm_up) * 1000))
+
+
+if __name__ == '__main__':
+    main()
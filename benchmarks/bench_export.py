@@ -0,0 +1,52 @@
+"""Measure export throughput and peak memory per format.
+
+    python -m benchmarks.bench_export --shows 1000000
+
+Peak memory is what tracemalloc sees while the shows table is exported;
+it should stay roughly the same whatever --shows is, since only one batch
+is held at a time. Pass a PostgreSQL --database to exercise named cursors.
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.common import DEFAULT_DATABASE, load_app, report, seed
+
+
+def consume(chunks):
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--shows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    app, db = load_app(args.database)
+    import exporter
+    with app.app_context():
+        seed(db, venues=1000, artists=1000, shows=args.shows)
+        results = {}
+        for format in sorted(exporter.WRITERS):
+            start = time.perf_counter()
+            size = consume(exporter.run('shows', format=format, batch_size=args.batch_size))
+            elapsed = time.perf_counter() - start
+            results['%-8s rows/s' % format] = '%.0f' % (args.shows / elapsed)
+            results['%-8s MB/s' % format] = '%.1f' % (size / elapsed / 1e6)
+
+            tracemalloc.start()
+            consume(exporter.run('shows', format=format, batch_size=args.batch_size))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results['%-8s peak MB' % format] = '%.1f' % (peak / 1e6)
+
+    report('export of %d shows, batches of %d' % (args.shows, args.batch_size), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Compare ways of formatting show times for the shows page.
+
+    python -m benchmarks.bench_formatting --values 10000
+
+Formats --values start times spread hourly over --days days with the
+legacy filter (a string parsed back by dateutil, then babel), babel on
+datetimes, formatting.format_datetime and formatting.format_many, and
+checks that all of them produce the same text.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+
+def legacy(values, pattern):
+    return [babel.dates.format_datetime(dateutil.parser.parse(str(value)), pattern) for value in values]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--values', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--format', default='medium')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from setup import app
+    import formatting
+    rnd = random.Random(42)
+    start = datetime(2026, 1, 1, 18)
+    values = [start + timedelta(hours=rnd.randrange(args.days * 24)) for _ in range(args.values)]
+    pattern = formatting.FORMATS.get(args.format, args.format)
+
+    candidates = [
+        ('dateutil + babel (legacy)', lambda: legacy(values, pattern)),
+        ('babel.format_datetime', lambda: [babel.dates.format_datetime(value, pattern) for value in values]),
+        ('formatting.format_datetime', lambda: [formatting.format_datetime(value, args.format) for value in values]),
+        ('formatting.format_many', lambda: formatting.format_many(values, args.format)),
+    ]
+    with app.app_context():
+        expected = None
+        baseline = None
+        print('%d values, format %r' % (args.values, pattern))
+        for name, run in candidates:
+            best = None
+            for _ in range(args.repeat):
+                began = time.perf_counter()
+                output = run()
+                elapsed = time.perf_counter() - began
+                best = elapsed if best is None else min(best, elapsed)
+            if expected is None:
+                expected, baseline = output, best
+            elif output != expected:
+                print('%s produced different text' % name)
+                sys.exit(1)
+            print('  %-28s %8.1f ms %8.2f us/value %6.1fx' % (
+                name, best * 1000, best / args.values * 1e6, baseline / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Compare nearby-venue searches with and without the geohash index.
+
+    python -m benchmarks.bench_geo --venues 1000000
+
+Places --venues venues around --cities random city centres in the
+continental US, then runs --queries radius searches near those centres
+through geo.near (geohash ranges, then the exact distance) and through a
+latitude/longitude range scan, checking both find the same venues and
+that geo.near with --limit returns the nearest of them, and times
+geo.within on the same boxes.
+"""
+import argparse
+import math
+import random
+import time
+from datetime import datetime
+
+from benchmarks.common import DEFAULT_DATABASE, load_app, report, timed
+from benchmarks.load import percentile
+
+
+def scan_near(latitude, longitude, radius_km):
+    # The same search without the geohash index.
+    from setup import db
+    from models import Venue
+    import geo
+    south, west, north, east = geo.bounding_box(latitude, longitude, radius_km)
+    rows = db.session.query(Venue.id, Venue.latitude, Venue.longitude).\
+        filter(Venue.latitude.between(south, north), Venue.longitude.between(west, east))
+    distances = {id: geo.distance(latitude, longitude, lat, lon) for id, lat, lon in rows}
+    return {id: km for id, km in distances.items() if km <= radius_km}
+
+
+def seed_venues(db, venues, cities, seed):
+    from models import Venue, venue_stats
+    import geo
+    rnd = random.Random(seed)
+    centres = [(rnd.uniform(25.0, 49.0), rnd.uniform(-124.0, -67.0)) for _ in range(cities)]
+    rows = []
+    for i in range(venues):
+        city = rnd.randrange(cities)
+        latitude, longitude = centres[city]
+        # Within about 20 km of the centre, denser towards it.
+        angle, reach = rnd.uniform(0, 2 * math.pi), rnd.random() ** 2 * 0.2
+        latitude += reach * math.sin(angle)
+        longitude += reach * math.cos(angle) / math.cos(math.radians(latitude))
+        rows.append({
+            'name': 'Venue %d' % i, 'city': 'City %d' % city, 'state': 'ST',
+            'latitude': latitude, 'longitude': longitude, 'geohash': geo.encode(latitude, longitude),
+        })
+        if len(rows) == 10000:
+            db.session.execute(Venue.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Venue.__table__.insert(), rows)
+    now = datetime.utcnow()
+    stats = [{'venue_id': id, 'upcoming_shows_count': rnd.randrange(1, 20), 'past_shows_count': 0, 'updated_at': now}
+             for id in rnd.sample(range(1, venues + 1), venues // 10)]
+    for i in range(0, len(stats), 10000):
+        db.session.execute(venue_stats.insert(), stats[i:i + 10000])
+    db.session.commit()
+    return centres
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--venues', type=int, default=1000000)
+    parser.add_argument('--cities', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--radius', type=float, default=5.0)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    app, db = load_app(args.database)
+    import geo
+    results = {}
+    with app.app_context():
+        with timed(results, 'seed'):
+            centres = seed_venues(db, args.venues, args.cities, args.seed)
+
+        rnd = random.Random(args.seed + 1)
+        points = []
+        for _ in range(args.queries):
+            latitude, longitude = rnd.choice(centres)
+            points.append((latitude + rnd.uniform(-0.05, 0.05), longitude + rnd.uniform(-0.05, 0.05)))
+
+        timings = {'geohash near': [], 'geohash near (limit)': [], 'range scan near': [], 'geohash within': []}
+        found = []
+        for latitude, longitude in points:
+            start = time.perf_counter()
+            venues = geo.near(latitude, longitude, args.radius, args.venues)
+            timings['geohash near'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            expected = scan_near(latitude, longitude, args.radius)
+            timings['range scan near'].append(time.perf_counter() - start)
+            if {venue['id'] for venue in venues} != set(expected):
+                raise SystemExit('geo.near and the range scan disagree at %r' % ((latitude, longitude),))
+            start = time.perf_counter()
+            nearest = geo.near(latitude, longitude, args.radius, args.limit)
+            timings['geohash near (limit)'].append(time.perf_counter() - start)
+            if [venue['id'] for venue in nearest] != sorted(expected, key=lambda id: (expected[id], id))[:args.limit]:
+                raise SystemExit('geo.near misses nearer venues at %r' % ((latitude, longitude),))
+            found.append(len(venues))
+            start = time.perf_counter()
+            geo.within(*geo.bounding_box(latitude, longitude, args.radius), limit=args.limit)
+            timings['geohash within'].append(time.perf_counter() - start)
+
+        for name, values in timings.items():
+            values.sort()
+            results['%s p50' % name] = percentile(values, 50)
+            results['%s p95' % name] = percentile(values, 95)
+        results['venues found (mean)'] = '%.1f' % (sum(found) / float(len(found)))
+
+    report('%d venue searches within %g km among %d venues' % (args.queries, args.radius, args.venues), results)
+
+
+if __name__ == '__main__':
+    main()
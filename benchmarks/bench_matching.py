@@ -0,0 +1,169 @@
+"""Time the match precomputation and check it against a plain Python scorer.
+
+    python -m benchmarks.bench_matching --venues 20000 --artists 20000
+
+Seeds venues, artists and shows (about 30% of each seeking), then times a
+full `matching.rebuild`, scores --sample entities of each side against
+every candidate in plain Python, checking their stored lists hold the same
+scores, and times the refresh jobs after an edit of one venue and after a
+show, checking they leave the tables as a rebuild would.
+"""
+import argparse
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from benchmarks.common import DEFAULT_DATABASE, load_app, report, seed, timed
+
+
+def _unit(weights):
+    norm = math.sqrt(sum(value * value for value in weights.values()))
+    return {key: value / norm for key, value in weights.items()} if norm else {}
+
+
+def load(db):
+    # Everything the Python scorer needs, as dicts and sets.
+    from models import Venue, Artist, Show, genre_link
+    import matching
+    data = {}
+    for model in (Venue, Artist):
+        table, fk = genre_link(model)
+        genres = defaultdict(set)
+        for id, genre_id in db.session.execute(db.select([fk, table.c.genre_id])):
+            genres[id].add(genre_id)
+        rows = db.session.query(model.id, model.city, model.state, getattr(model, matching.SEEKING[model]))
+        data[model] = {row[0]: {'place': matching._place(row[2], row[1]), 'seeking': bool(row[3]),
+                                'genres': _unit({genre: 1.0 for genre in genres[row[0]]}), 'history': {}}
+                       for row in rows}
+    together = defaultdict(int)
+    show = Show.__table__
+    for venue_id, artist_id in db.session.execute(db.select([show.c.venue_id, show.c.artist_id])):
+        together[venue_id, artist_id] += 1
+    for (venue_id, artist_id), count in together.items():
+        for model, own, other, other_model in ((Venue, venue_id, artist_id, Artist), (Artist, artist_id, venue_id, Venue)):
+            history = data[model][own]['history']
+            for genre, weight in data[other_model][other]['genres'].items():
+                history[genre] = history.get(genre, 0.0) + count * weight
+    for model in (Venue, Artist):
+        for entity in data[model].values():
+            entity['history'] = _unit(entity['history'])
+    return data, together
+
+
+def python_scores(data, together, model, owner_id):
+    # Scores of one entity against every candidate, one pair at a time.
+    from models import Venue, Artist
+    import matching
+    weights = matching.WEIGHTS
+    other = Artist if model is Venue else Venue
+    owner = data[model][owner_id]
+    scores = {}
+    for id, candidate in data[other].items():
+        if not candidate['seeking']:
+            continue
+        score = sum(weight * (weights['genres'] * owner['genres'].get(genre, 0.0) +
+                              weights['history'] * owner['history'].get(genre, 0.0))
+                    for genre, weight in candidate['genres'].items())
+        (own_state, own_city), (state, city) = owner['place'], candidate['place']
+        if city and own_city == city and own_state == state:
+            score += weights['place']
+        elif state and own_state == state:
+            score += weights['place'] * 0.5
+        pair = (owner_id, id) if model is Venue else (id, owner_id)
+        score += weights['together'] * min(together.get(pair, 0), matching.TOGETHER_CAP) / float(matching.TOGETHER_CAP)
+        if score > 0:
+            scores[id] = score
+    return scores
+
+
+def stored(db, model):
+    from models import match_link
+    table, owner_fk, candidate_fk = match_link(model)
+    lists = defaultdict(list)
+    for owner, candidate, score in db.session.execute(
+            db.select([owner_fk, candidate_fk, table.c.score]).order_by(owner_fk, table.c.rank)):
+        lists[owner].append((candidate, score))
+    return lists
+
+
+def refresh(db, results, name):
+    # Times the queued refresh job, checking it leaves the tables as a
+    # rebuild would.
+    from models import Venue, Artist
+    import jobs
+    import matching
+    with timed(results, name):
+        jobs.work(once=True)
+    lists = stored(db, Venue), stored(db, Artist)
+    matching.rebuild(db.session.connection())
+    db.session.commit()
+    if (stored(db, Venue), stored(db, Artist)) != lists:
+        raise SystemExit('The %s disagrees with a rebuild' % name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--venues', type=int, default=20000)
+    parser.add_argument('--artists', type=int, default=20000)
+    parser.add_argument('--cities', type=int, default=500)
+    parser.add_argument('--shows', type=int, default=100000)
+    parser.add_argument('--sample', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    app, db = load_app(args.database)
+    from models import Venue, Artist, Show
+    import matching
+    results = {}
+    with app.app_context():
+        with timed(results, 'seed'):
+            seed(db, venues=args.venues, cities=args.cities, artists=args.artists, shows=args.shows, seed=args.seed)
+        with timed(results, 'rebuild'):
+            matching.rebuild(db.session.connection())
+            db.session.commit()
+
+        data, together = load(db)
+        rnd = random.Random(args.seed)
+        k = app.config['MATCH_TOP_K']
+        python_time = numpy_time = 0.0
+        features = matching.Features()
+        for model in (Venue, Artist):
+            lists = stored(db, model)
+            seeking = [id for id, entity in data[model].items() if entity['seeking']]
+            for owner_id in rnd.sample(seeking, min(args.sample, len(seeking))):
+                start = time.perf_counter()
+                scores = python_scores(data, together, model, owner_id)
+                python_time += time.perf_counter() - start
+                start = time.perf_counter()
+                features.scores(model, features.sides[model].rows([owner_id]), features.candidates(model))
+                numpy_time += time.perf_counter() - start
+                expected = sorted(scores.values(), reverse=True)[:k]
+                found = lists.get(owner_id, [])
+                if len(found) != len(expected) or \
+                        any(abs(score - value) > 1e-5 for (id, score), value in zip(found, expected)) or \
+                        any(abs(scores[id] - score) > 1e-5 for id, score in found):
+                    raise SystemExit('%s %d: stored %r, expected scores %r' % (model.__name__, owner_id, found, expected))
+        samples = 2 * args.sample
+        results['python scoring per entity'] = python_time / samples
+        results['numpy scoring per entity'] = numpy_time / samples
+
+        venue = Venue.query.filter_by(seeking_talent=True).first()
+        venue.city, venue.genres = 'City 1', ['Jazz', 'Blues', 'Soul']
+        venue_id = venue.id
+        db.session.commit()
+        refresh(db, results, 'refresh job after an edit')
+
+        artist = Artist.query.filter_by(seeking_venue=True).first()
+        db.session.add(Show(venue_id=venue_id, artist_id=artist.id, start_time=datetime(2100, 1, 1)))
+        db.session.commit()
+        refresh(db, results, 'refresh job after a show')
+        results['entities checked'] = str(samples)
+
+    report('Matches of %d venues and %d artists (top %d)' % (args.venues, args.artists, k), results)
+
+
+if __name__ == '__main__':
+    main()
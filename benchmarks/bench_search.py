@@ -0,0 +1,60 @@
+"""Compare ILIKE scans with the search backend.
+
+    python -m benchmarks.bench_search --rows 100000
+
+On SQLite this measures the in-process n-gram index; pass a PostgreSQL
+--database (after `flask db upgrade`) to measure the tsvector/pg_trgm path.
+"""
+import argparse
+import time
+
+from benchmarks.common import DEFAULT_DATABASE, load_app, report, seed, timed
+
+TERMS = ['a', 'venue 12', 'city 7', 'jazz', 'rock', '99999', 'venu 4']
+
+
+def ilike_search(model, term, limit=20):
+    from setup import db
+    from sqlalchemy import func
+    return db.session.query(model.id, func.count().over()).\
+        filter(model.name.ilike('%' + term + '%')).\
+        order_by(model.name).\
+        limit(limit).\
+        all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app, db = load_app(args.database)
+    import search
+    from models import Venue
+    with app.app_context():
+        seed(db, venues=args.rows, cities=max(args.rows // 20, 1),
+             artists=1000, shows=10000)
+        backend = search.backend()
+        results = {'backend': type(backend).__name__}
+        if isinstance(backend, search.NgramSearchBackend):
+            with timed(results, 'n-gram index build'):
+                backend.index(Venue)
+
+        for term in TERMS:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                ilike_search(Venue, term)
+            results['ilike  %-12r' % term] = (time.perf_counter() - start) / args.repeat
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                total, ids = backend.search(Venue, term, 20, 0)
+            results['index  %-12r' % term] = (time.perf_counter() - start) / args.repeat
+            results['matches %-11r' % term] = total
+
+    report('venue search over %d rows (mean per query)' % args.rows, results)
+
+
+if __name__ == '__main__':
+    main()
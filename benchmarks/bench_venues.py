@@ -0,0 +1,59 @@
+"""Compare the old per-area /venues listing with the single grouped query.
+
+    python -m benchmarks.bench_venues --venues 10000 --cities 500
+"""
+import argparse
+
+from benchmarks.common import DEFAULT_DATABASE, QueryCounter, load_app, report, seed, timed
+
+
+def legacy_venues_by_area():
+    from models import Venue
+    areas = Venue.query.with_entities(Venue.city.distinct(), Venue.state)
+    data = list()
+    for city, state in areas:
+        data.append({
+            "city": city,
+            "state": state,
+            "venues": Venue.query.filter_by(city=city, state=state)
+        })
+    return data
+
+
+def consume(areas):
+    # Mirrors what venues.html does with the data.
+    return sum(len([venue['id'] if isinstance(venue, dict) else venue.id
+                    for venue in area['venues']]) for area in areas)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--venues', type=int, default=10000)
+    parser.add_argument('--cities', type=int, default=500)
+    parser.add_argument('--shows', type=int, default=20000)
+    args = parser.parse_args()
+
+    app, db = load_app(args.database)
+    import queries
+    with app.app_context():
+        seed(db, venues=args.venues, cities=args.cities,
+             artists=args.venues // 2, shows=args.shows)
+        engine = db.get_engine()
+        results = {}
+        with QueryCounter(engine) as counter, timed(results, 'before: latency'):
+            listed = consume(legacy_venues_by_area())
+        results['before: queries'] = counter.count
+        results['before: venues listed'] = listed
+        db.session.remove()
+
+        with QueryCounter(engine) as counter, timed(results, 'after: latency'):
+            listed = consume(queries.venues_by_area())
+        results['after: queries'] = counter.count
+        results['after: venues listed'] = listed
+
+    report('/venues with %d venues in %d cities' % (args.venues, args.cities), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Fail if any read view issues more queries than its budget.
+
+    python -m benchmarks.check_query_budgets
+
+Runs every route of check_query_plans with SQL_STRICT on, against a small
+and a large dataset, and compares the query counts of the two: a count
+that grows with the data is an N+1 even while it is under budget. Exits
+with status 1 on a failure.
+"""
+import argparse
+import sys
+
+from benchmarks.check_query_plans import routes
+from benchmarks.common import DEFAULT_DATABASE, load_app, seed
+
+
+def query_counts(app, db, size):
+    import search
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(db, venues=size, cities=max(size // 20, 1), artists=size, shows=size * 10)
+        search.reset(search.Venue)
+        search.reset(search.Artist)
+    counts = {}
+    failures = []
+    client = app.test_client()
+    for index, (method, path, data) in enumerate(routes(size // 2, size // 2)):
+        try:
+            response = client.open(path, method=method, data=data)
+        except Exception as e:
+            failures.append('%s %s: %s' % (method, path, e))
+            continue
+        timing = response.headers.getlist('Server-Timing')[0]
+        counts[index] = (method, path, data, int(timing.split('desc="')[1].split()[0]))
+    return counts, failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--small', type=int, default=200)
+    parser.add_argument('--large', type=int, default=2000)
+    args = parser.parse_args()
+
+    app, db = load_app(args.database)
+    app.config['SQL_STRICT'] = True
+    app.config['TESTING'] = True
+    app.config['PAGE_CACHE_ENABLED'] = False
+
+    small, failures = query_counts(app, db, args.small)
+    large, more = query_counts(app, db, args.large)
+    failures += more
+    for index in sorted(set(small) & set(large)):
+        method, path, data, before = small[index]
+        after = large[index][3]
+        grew = after > before
+        print('%-4s %-4s %-24s %-48s %3d -> %3d queries' % (
+            'FAIL' if grew else 'ok', method, path, data or '', before, after))
+        if grew:
+            failures.append('%s %s %s: %d queries with %d rows, %d with %d' % (
+                method, path, data or '', before, args.small, after, args.large))
+
+    if failures:
+        print('\n'.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
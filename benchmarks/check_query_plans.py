@@ -0,0 +1,123 @@
+"""Fail if any view's SQL plans a full scan of a table it shouldn't.
+
+    python -m benchmarks.check_query_plans --shows 200000
+
+Every route is requested once through the test client; each statement it
+issues is re-run under EXPLAIN (EXPLAIN QUERY PLAN on SQLite) and the plan
+is searched for sequential scans. Exits with status 1 on a regression.
+"""
+import argparse
+import re
+import sys
+
+from sqlalchemy import event
+
+from benchmarks.common import DEFAULT_DATABASE, load_app, seed
+
+# Tables a route reads in full by design, e.g. the /artists listing.
+ALLOWED_SCANS = {
+    'GET /venues': {'venue'},
+    'GET /artists': {'artist'},
+}
+
+SEQUENTIAL_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'SCAN (?:TABLE )?(\w+)(?! USING)(?:$| )'),
+}
+TABLES = {'show', 'venue', 'artist', 'venue_genre', 'artist_genre'}
+
+
+def routes(venue_id, artist_id):
+    return [
+        ('GET', '/venues', None),
+        ('GET', '/artists', None),
+        ('GET', '/shows', None),
+        ('GET', '/shows?all=1', None),
+        ('GET', '/venues/%d' % venue_id, None),
+        ('GET', '/artists/%d' % artist_id, None),
+        ('POST', '/venues/search', {'search_term': 'Venue 12'}),
+        ('POST', '/artists/search', {'search_term': 'Artist 12'}),
+        ('GET', '/venues?genre=Jazz', None),
+        ('GET', '/artists?genre=Jazz', None),
+        ('POST', '/venues/search', {'search_term': 'Venue 1', 'genre': 'Jazz'}),
+    ]
+
+
+def explain(connection, dialect, statement, parameters):
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    cursor = connection.connection.cursor()
+    cursor.execute(prefix + statement, parameters)
+    lines = [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    cursor.close()
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--venues', type=int, default=20000)
+    parser.add_argument('--artists', type=int, default=20000)
+    parser.add_argument('--shows', type=int, default=200000)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    app, db = load_app(args.database)
+    app.config['PAGE_CACHE_ENABLED'] = False
+    from models import Venue, Artist
+    with app.app_context():
+        seed(db, venues=args.venues, cities=args.venues // 20,
+             artists=args.artists, shows=args.shows)
+        engine = db.get_engine()
+        dialect = engine.dialect.name
+        with engine.connect() as connection:
+            connection.execute('ANALYZE')
+
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        # The in-process search index reads each table once when it is
+        # built; that is not a per-request scan.
+        import search
+        if isinstance(search.backend(), search.NgramSearchBackend):
+            search.backend().index(Venue)
+            search.backend().index(Artist)
+
+        failures = []
+        client = app.test_client()
+        for method, path, data in routes(args.venues // 2, args.artists // 2):
+            route = '%s %s' % (method, path.split('?')[0].rstrip('0123456789').rstrip('/'))
+            del statements[:]
+            event.listen(engine, 'before_cursor_execute', capture)
+            try:
+                response = client.open(path, method=method, data=data)
+            finally:
+                event.remove(engine, 'before_cursor_execute', capture)
+            if response.status_code != 200:
+                failures.append('%s %s returned %d' % (method, path, response.status_code))
+                continue
+
+            allowed = ALLOWED_SCANS.get(route, set())
+            with engine.connect() as connection:
+                for statement, parameters in statements:
+                    plan = explain(connection, dialect, statement, parameters)
+                    scanned = {match.group(1) for line in plan
+                               for match in SEQUENTIAL_SCAN[dialect].finditer(line)}
+                    bad = (scanned & TABLES) - allowed
+                    status = 'FAIL' if bad else 'ok'
+                    print('%-4s %s %s' % (status, method, path))
+                    if args.verbose:
+                        print('     ' + '\n     '.join(plan))
+                    if bad:
+                        failures.append('%s %s scans %s:\n  %s\n  %s' % (
+                            method, path, ', '.join(sorted(bad)), statement, '\n  '.join(plan)))
+
+    if failures:
+        print('\n'.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
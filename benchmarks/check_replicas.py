@@ -0,0 +1,107 @@
+"""Exercise replica routing, read-your-writes and failover on two SQLite files.
+
+    python -m benchmarks.check_replicas
+
+The replica starts as a copy of the primary with one venue renamed, so each
+read shows which database answered it. Exits with status 1 on a failure.
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+
+from sqlalchemy import event
+
+from benchmarks.common import load_app, seed
+
+PRIMARY = '/tmp/fyyur_primary.db'
+REPLICA = '/tmp/fyyur_replica.db'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--primary', default=PRIMARY)
+    parser.add_argument('--replica', default=REPLICA)
+    args = parser.parse_args()
+
+    app, db = load_app('sqlite:///' + args.primary)
+    app.config['SQLALCHEMY_REPLICA_URIS'] = ['sqlite:///' + args.replica]
+    app.config['REPLICA_STICKY_SECONDS'] = 1
+    app.config['REPLICA_RETRY_SECONDS'] = 1
+    app.config['PAGE_CACHE_ENABLED'] = False
+    with app.app_context():
+        seed(db, venues=10, cities=2, artists=10, shows=50)
+    if os.path.isdir(args.replica):
+        os.rmdir(args.replica)
+    shutil.copy(args.primary, args.replica)
+    with app.app_context():
+        engine = db.replicas()[0]
+        engine.execute("UPDATE venue SET name = 'On replica' WHERE id = 1")
+
+    failures = []
+
+    def expect(client, name, what):
+        got = client.get('/api/v1/venues/1?fields=name').get_json()['name']
+        print('%-4s %-46s %s' % ('ok' if got == name else 'FAIL', what, got))
+        if got != name:
+            failures.append('%s: expected %r, got %r' % (what, name, got))
+
+    writer, reader = app.test_client(), app.test_client()
+    expect(reader, 'On replica', 'read goes to the replica')
+
+    # The read above probed the replica; for REPLICA_RETRY_SECONDS the next
+    # ones only open the connection they read with.
+    connects = []
+    with app.app_context():
+        engine = db.replicas()[0]
+
+    def count(connection, branch):
+        if not branch:
+            connects.append(connection)
+
+    event.listen(engine, 'engine_connect', count)
+    for _ in range(5):
+        reader.get('/api/v1/venues/1?fields=name')
+    event.remove(engine, 'engine_connect', count)
+    print('%-4s %-46s %d' % ('ok' if len(connects) == 5 else 'FAIL', 'connections for 5 reads, no probes', len(connects)))
+    if len(connects) != 5:
+        failures.append('5 reads opened %d replica connections' % len(connects))
+
+    writer.post('/venues/1/edit', data={'name': 'Edited', 'city': 'City 0', 'state': 'CA'})
+    expect(writer, 'Edited', 'writer reads its write from the primary')
+    expect(reader, 'On replica', 'other clients still read the replica')
+    time.sleep(1.1)
+    expect(writer, 'On replica', 'writer is back on the replica')
+
+    # Bulk imports write with Core statements, which never flush.
+    app.config['IMPORT_API_TOKEN'] = 'check'
+    importer = app.test_client()
+    importer.post('/api/v1/import/venues',
+                  data='name,city,state,address,phone,genres,facebook_link,website\n'
+                       'New,City 0,CA,1 Main St,123-456-7890,Jazz,https://facebook.com/new,https://new.example\n',
+                  headers={'Content-Type': 'text/csv', 'Authorization': 'Bearer check'})
+    expect(importer, 'Edited', 'importer reads from the primary')
+
+    # Take the replica away: its path stops being an openable database.
+    with app.app_context():
+        db.replicas()[0].dispose()
+    os.remove(args.replica)
+    os.mkdir(args.replica)
+    expect(reader, 'Edited', 'replica down: read fails over to the primary')
+
+    os.rmdir(args.replica)
+    shutil.copy(args.primary, args.replica)
+    with app.app_context():
+        db.replicas()[0].execute("UPDATE venue SET name = 'Back on replica' WHERE id = 1")
+    time.sleep(1.1)
+    expect(reader, 'Back on replica', 'replica back: reads return to it')
+    os.remove(args.replica)
+
+    if failures:
+        print('\n'.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+DEFAULT_DATABASE = 'sqlite:////tmp/fyyur_bench.db'
+
+
+def load_app(database=DEFAULT_DATABASE):
+    # The engine is created lazily, so the URI can still be swapped here
+    # before anything touches the database.
+    from setup import app, db
+    import pool
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool.engine_options(database, app.config.get('DB_PROFILE', 'web'))
+    import app as views
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app, db
+
+
+class QueryCounter(object):
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+@contextmanager
+def timed(results, name):
+    start = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - start
+
+
+def seed(db, venues=1000, cities=50, artists=1000, shows=5000, years=4, seed=42):
+    from models import Venue, Artist, Show, Genre, venue_genre, artist_genre
+    rnd = random.Random(seed)
+    states = ['CA', 'NY', 'TX', 'WA', 'IL', 'FL', 'MA', 'OR', 'CO', 'GA']
+    areas = [('City %d' % i, states[i % len(states)]) for i in range(cities)]
+    genres = [id for id, in db.session.query(Genre.id)]
+
+    def chunks(rows, size=5000):
+        for i in range(0, len(rows), size):
+            yield rows[i:i + size]
+
+    venue_rows = []
+    for i in range(venues):
+        city, state = areas[i % cities]
+        venue_rows.append({
+            'name': 'Venue %d' % i, 'city': city, 'state': state,
+            'address': '%d Main Street' % i, 'phone': '555-000-%04d' % (i % 10000),
+            'seeking_talent': rnd.random() < 0.3,
+        })
+    artist_rows = []
+    for i in range(artists):
+        city, state = areas[rnd.randrange(cities)]
+        artist_rows.append({
+            'name': 'Artist %d' % i, 'city': city, 'state': state,
+            'phone': '555-100-%04d' % (i % 10000),
+            'seeking_venue': rnd.random() < 0.3,
+        })
+    venue_genre_rows = [{'venue_id': i + 1, 'genre_id': genre_id}
+                        for i in range(venues) for genre_id in rnd.sample(genres, 2)]
+    artist_genre_rows = [{'artist_id': i + 1, 'genre_id': genre_id}
+                         for i in range(artists) for genre_id in rnd.sample(genres, 2)]
+    now = datetime.now()
+    span = int(timedelta(days=365 * years).total_seconds())
+    show_rows = []
+    for i in range(shows):
+        show_rows.append({
+            'venue_id': rnd.randint(1, venues), 'artist_id': rnd.randint(1, artists),
+            'start_time': now - timedelta(seconds=rnd.randrange(span)) + timedelta(days=180),
+        })
+
+    for table, rows in ((Venue.__table__, venue_rows),
+                        (Artist.__table__, artist_rows),
+                        (Show.__table__, show_rows),
+                        (venue_genre, venue_genre_rows),
+                        (artist_genre, artist_genre_rows)):
+        for chunk in chunks(rows):
+            db.session.execute(table.insert(), chunk)
+    import stats
+    for model in (Venue, Artist):
+        stats.rebuild(db.session.connection(), model)
+    db.session.commit()
+
+
+def report(title, results):
+    print(title)
+    for name, value in results.items():
+        if isinstance(value, float):
+            print('  %-32s %10.2f ms' % (name, value * 1000))
+        else:
+            print('  %-32s %10s' % (name, value))
@@ -0,0 +1,349 @@
+"""Benchmark every route, in process and over HTTP, and save the results.
+
+    python -m benchmarks.load --venues 5000 --shows 100000 --output before.json
+    python -m benchmarks.load --venues 5000 --shows 100000 --compare before.json
+
+Seeds a synthetic dataset, then requests each route --requests times
+through the Flask test client ("client") and from --concurrency threads
+over HTTP ("http"), against a local threaded server or --url. Reports
+p50/p95/p99 latency, requests per second and queries per request (from
+the Server-Timing header). --compare exits with status 1 when a route's
+p95 grows by more than --threshold percent or its queries per request
+grow at all.
+"""
+import argparse
+import http.client
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks.common import DEFAULT_DATABASE, load_app, seed
+
+
+#----------------------------------------------------------------------------#
+# Routes.
+#----------------------------------------------------------------------------#
+
+class Targets(object):
+    # Picks the ids a request works on. Reads and edits use the first ids;
+    # deletes consume the last `reserved` ids, one per request, so every
+    # delete removes a row that exists and no read hits a deleted one.
+    # Restores pick among the ids deleted so far.
+
+    def __init__(self, venues, artists, reserved, seed=42):
+        self.venues = venues
+        self.artists = artists
+        self.reserved = reserved
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.doomed = {'venue': venues, 'artist': artists}
+
+    def pick(self, kind):
+        with self.lock:
+            return self.random.randint(1, getattr(self, kind + 's') - self.reserved)
+
+    def doom(self, kind):
+        with self.lock:
+            id = self.doomed[kind]
+            self.doomed[kind] -= 1
+            return id
+
+    def deleted(self, kind):
+        with self.lock:
+            total = getattr(self, kind + 's')
+            return self.random.randint(min(self.doomed[kind] + 1, total), total)
+
+    def values(self, path):
+        # Only the ids `path` asks for, so reads do not use up doomed ids.
+        values = {}
+        for kind in ('venue', 'artist'):
+            if '{%s}' % kind in path:
+                values[kind] = self.pick(kind)
+            if '{doomed_%s}' % kind in path:
+                values['doomed_' + kind] = self.doom(kind)
+            if '{deleted_%s}' % kind in path:
+                values['deleted_' + kind] = self.deleted(kind)
+        return values
+
+
+def venue_form(targets):
+    return {
+        'name': 'Load Venue', 'city': 'City 1', 'state': 'CA', 'address': '1 Main Street',
+        'phone': '555-000-0000', 'genres': ['Jazz', 'Blues'],
+        'facebook_link': 'https://www.facebook.com/load', 'website': 'https://load.example.com',
+    }
+
+
+def artist_form(targets):
+    return {
+        'name': 'Load Artist', 'city': 'City 1', 'state': 'CA', 'phone': '555-100-0000',
+        'genres': ['Jazz'], 'facebook_link': 'https://www.facebook.com/load',
+        'website': 'https://load.example.com',
+    }
+
+
+def show_form(targets):
+    start = datetime.now() + timedelta(days=targets.random.randint(1, 365))
+    return {
+        'artist_id': targets.pick('artist'), 'venue_id': targets.pick('venue'),
+        'start_time': start.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+# (name, method, path, form data). Paths are formatted with
+# Targets.values(path). Writes come last so they do not disturb the reads.
+ROUTES = [
+    ('index', 'GET', '/', None),
+    ('venues', 'GET', '/venues', None),
+    ('venues_by_genre', 'GET', '/venues?genre=Jazz', None),
+    ('search_venues', 'POST', '/venues/search', lambda targets: {'search_term': 'Venue 1'}),
+    ('show_venue', 'GET', '/venues/{venue}', None),
+    ('artists', 'GET', '/artists', None),
+    ('artists_by_genre', 'GET', '/artists?genre=Jazz', None),
+    ('search_artists', 'POST', '/artists/search', lambda targets: {'search_term': 'Artist 1'}),
+    ('show_artist', 'GET', '/artists/{artist}', None),
+    ('shows', 'GET', '/shows', None),
+    ('all_shows', 'GET', '/shows?all=1', None),
+    ('api_venues', 'GET', '/api/v1/venues?fields=id,name,num_upcoming_shows', None),
+    ('api_venue', 'GET', '/api/v1/venues/{venue}', None),
+    ('api_shows', 'GET', '/api/v1/shows', None),
+    ('api_search_venues', 'GET', '/api/v1/search/venues?q=venue', None),
+    ('create_venue_form', 'GET', '/venues/create', None),
+    ('edit_venue_form', 'GET', '/venues/{venue}/edit', None),
+    ('create_artist_form', 'GET', '/artists/create', None),
+    ('edit_artist_form', 'GET', '/artists/{artist}/edit', None),
+    ('create_show_form', 'GET', '/shows/create', None),
+    ('create_venue', 'POST', '/venues/create', venue_form),
+    ('edit_venue', 'POST', '/venues/{venue}/edit', venue_form),
+    ('create_artist', 'POST', '/artists/create', artist_form),
+    ('edit_artist', 'POST', '/artists/{artist}/edit', artist_form),
+    ('create_show', 'POST', '/shows/create', show_form),
+    ('delete_venue', 'GET', '/venues/{doomed_venue}/delete', None),
+    ('delete_artist', 'GET', '/artists/{doomed_artist}/delete', None),
+    ('restore_venue', 'GET', '/venues/{deleted_venue}/restore', None),
+    ('restore_artist', 'GET', '/artists/{deleted_artist}/restore', None),
+]
+
+
+def resolve(route, targets):
+    name, method, path, form = route
+    return method, path.format(**targets.values(path)), form(targets) if form else None
+
+
+def uncovered(app):
+    # Endpoints of the app that no entry in ROUTES requests.
+    covered = {app.url_map.bind('').match(path.split('?')[0].format(
+        venue=1, artist=1, doomed_venue=1, doomed_artist=1, deleted_venue=1, deleted_artist=1),
+        method=method)[0]
+        for name, method, path, form in ROUTES}
+    return sorted(rule.endpoint for rule in app.url_map.iter_rules()
+                  if rule.endpoint not in covered and rule.endpoint != 'static'
+                  and not rule.endpoint.startswith('api.'))
+
+
+#----------------------------------------------------------------------------#
+# Measurements.
+#----------------------------------------------------------------------------#
+
+def percentile(values, p):
+    # Nearest-rank percentile of sorted `values`.
+    if not values:
+        return 0.0
+    rank = max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def queries(headers):
+    for value in headers:
+        if value.startswith('db;') and 'desc="' in value:
+            return int(value.split('desc="')[1].split()[0])
+    return None
+
+
+def summarize(samples, elapsed):
+    # samples: (seconds, status, queries) per request.
+    latencies = sorted(seconds * 1000 for seconds, status, count in samples)
+    counts = [count for seconds, status, count in samples if count is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for seconds, status, count in samples if status >= 400),
+        'statuses': dict(Counter(str(status) for seconds, status, count in samples)),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        'requests_per_second': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'queries_per_request': round(sum(counts) / float(len(counts)), 2) if counts else None,
+    }
+
+
+def run_client(app, targets, requests):
+    client = app.test_client()
+    results = {}
+    for route in ROUTES:
+        samples = []
+        started = time.perf_counter()
+        for _ in range(requests):
+            method, path, data = resolve(route, targets)
+            start = time.perf_counter()
+            response = client.open(path, method=method, data=data)
+            response.get_data()
+            samples.append((time.perf_counter() - start, response.status_code,
+                            queries(response.headers.getlist('Server-Timing'))))
+        results[route[0]] = summarize(samples, time.perf_counter() - started)
+    return results
+
+
+def run_http(url, targets, requests, concurrency):
+    parts = urlsplit(url)
+    local = threading.local()
+
+    def request(route):
+        if not hasattr(local, 'connection'):
+            local.connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        method, path, data = resolve(route, targets)
+        body = urlencode(data, doseq=True) if data else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if data else {}
+        start = time.perf_counter()
+        try:
+            local.connection.request(method, parts.path.rstrip('/') + path, body=body, headers=headers)
+            response = local.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            local.connection.close()
+            return time.perf_counter() - start, 599, None
+        if response.getheader('Connection', '').lower() == 'close':
+            local.connection.close()
+        return time.perf_counter() - start, response.status, queries(response.headers.get_all('Server-Timing') or [])
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for route in ROUTES:
+            started = time.perf_counter()
+            samples = list(pool.map(request, [route] * requests))
+            results[route[0]] = summarize(samples, time.perf_counter() - started)
+    return results
+
+
+def serve(app):
+    # A threaded development server on a free local port.
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+
+#----------------------------------------------------------------------------#
+# Reporting.
+#----------------------------------------------------------------------------#
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(mode, results):
+    print('\n%s' % mode)
+    print('  %-20s %8s %8s %8s %8s %9s %7s' % ('route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'errors'))
+    for name, result in results.items():
+        print('  %-20s %8.2f %8.2f %8.2f %8.1f %9s %7d' % (
+            name, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            result['requests_per_second'], result['queries_per_request'], result['errors']))
+
+
+def compare(baseline, current, threshold):
+    regressions = []
+    for mode, results in current['results'].items():
+        for name, result in results.items():
+            before = baseline.get('results', {}).get(mode, {}).get(name)
+            if before is None:
+                continue
+            if before['p95_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + threshold / 100.0):
+                regressions.append('%s %s: p95 %.2f ms -> %.2f ms' % (mode, name, before['p95_ms'], result['p95_ms']))
+            if before['queries_per_request'] is not None and result['queries_per_request'] is not None \
+                    and result['queries_per_request'] > before['queries_per_request']:
+                regressions.append('%s %s: %.2f -> %.2f queries per request' % (
+                    mode, name, before['queries_per_request'], result['queries_per_request']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--venues', type=int, default=2000)
+    parser.add_argument('--cities', type=int, default=100)
+    parser.add_argument('--artists', type=int, default=2000)
+    parser.add_argument('--shows', type=int, default=20000)
+    parser.add_argument('--years', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mode', choices=['client', 'http', 'both'], default='both')
+    parser.add_argument('--requests', type=int, default=50, help='requests per route and mode')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--url', help='benchmark a running server instead of a local one; it must '
+                                      'serve a database seeded with the same options')
+    parser.add_argument('--no-cache', action='store_true', help='disable the page cache')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=20.0, help='allowed p95 growth, in percent')
+    args = parser.parse_args()
+
+    reserved = args.requests * 2
+    if min(args.venues, args.artists) <= reserved * 2:
+        parser.error('--venues and --artists must exceed 4 x --requests')
+
+    app, db = load_app(args.database)
+    app.config['PAGE_CACHE_ENABLED'] = not args.no_cache
+    logging.getLogger('fyyur.sql').setLevel(logging.ERROR)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    for endpoint in uncovered(app):
+        print('warning: no benchmark for endpoint %s' % endpoint, file=sys.stderr)
+    with app.app_context():
+        seed(db, venues=args.venues, cities=args.cities, artists=args.artists,
+             shows=args.shows, years=args.years, seed=args.seed)
+
+    targets = Targets(args.venues, args.artists, reserved, seed=args.seed)
+    report = {
+        'commit': commit(),
+        'date': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'options': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': {},
+    }
+    if args.mode in ('client', 'both'):
+        report['results']['client'] = run_client(app, targets, args.requests)
+        print_results('client (Flask test client, sequential)', report['results']['client'])
+    if args.mode in ('http', 'both'):
+        server, url = (None, args.url) if args.url else serve(app)
+        try:
+            report['results']['http'] = run_http(url, targets, args.requests, args.concurrency)
+        finally:
+            if server is not None:
+                server.shutdown()
+        print_results('http (%d concurrent connections, %s)' % (args.concurrency, url), report['results']['http'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print('\nregressions against %s:\n  %s' % (args.compare, '\n  '.join(regressions)))
+            sys.exit(1)
+        print('\nno regressions against %s' % args.compare)
+
+
+if __name__ == '__main__':
+    main()
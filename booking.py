@@ -0,0 +1,187 @@
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, event, select
+from sqlalchemy.orm import Session
+
+from setup import db
+from models import Venue, Artist, Show, DEFAULT_SHOW_MINUTES, MAX_SHOW_MINUTES
+
+show = Show.__table__
+# Venue and artist columns of a show, per model.
+BOOKED = ((Venue, show.c.venue_id), (Artist, show.c.artist_id))
+
+
+class DoubleBooked(Exception):
+
+    def __init__(self, model, entity_id, start_time, end_time):
+        self.model = model
+        self.entity_id = entity_id
+        super(DoubleBooked, self).__init__('%s %s is already booked from %s to %s' % (
+            model.__name__, entity_id, start_time.strftime('%Y-%m-%d %H:%M'), end_time.strftime('%Y-%m-%d %H:%M')))
+
+
+def end_of(start_time, duration_minutes):
+    if duration_minutes is None:
+        duration_minutes = DEFAULT_SHOW_MINUTES
+    return start_time + timedelta(minutes=duration_minutes)
+
+
+#----------------------------------------------------------------------------#
+# Interval index.
+#----------------------------------------------------------------------------#
+
+class Timeline(object):
+    # Intervals [start, end) known in advance, sorted once by start. Adding
+    # one records its end in a Fenwick tree of the maximum end over each
+    # prefix of that order, so adding an interval and finding one that
+    # overlaps [start, end) both take O(log n), even if the added intervals
+    # overlap each other.
+
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals)
+        self.starts = [start for start, end in self.intervals]
+        self.tree = [None] * (len(self.intervals) + 1)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def overlapping(self, start, end):
+        # The (start, end) of an added interval overlapping [start, end), or
+        # None: the one ending last among those starting before `end`.
+        if end <= start:
+            return None
+        index, found = bisect_left(self.starts, end), None
+        while index:
+            node = self.tree[index]
+            if node is not None and (found is None or node > found):
+                found = node
+            index -= index & -index
+        if found is None or found[0] <= start:
+            return None
+        return found[1], found[0]
+
+    def add(self, start, end):
+        # [start, end) must be one of the intervals the timeline was made with.
+        if end <= start:
+            return
+        index = bisect_left(self.intervals, (start, end)) + 1
+        while index < len(self.tree):
+            if self.tree[index] is None or self.tree[index] < (end, start):
+                self.tree[index] = (end, start)
+            index += index & -index
+
+
+#----------------------------------------------------------------------------#
+# Checks.
+#----------------------------------------------------------------------------#
+# Shows last at most MAX_SHOW_MINUTES, so only those starting in
+# [start - MAX_SHOW_MINUTES, end) can overlap [start, end), and the
+# (venue_id, start_time) and (artist_id, start_time) indexes bound the
+# search to a few rows.
+
+def _window_start(start):
+    return start - timedelta(minutes=MAX_SHOW_MINUTES)
+
+
+def conflict(bind, fk, entity_id, start, end, exclude_id=None):
+    # (start, end) of a show on `fk` == entity_id overlapping [start, end).
+    query = select([show.c.start_time, show.c.duration_minutes]).\
+        where(and_(fk == entity_id, show.c.start_time >= _window_start(start), show.c.start_time < end))
+    if exclude_id is not None:
+        query = query.where(show.c.id != exclude_id)
+    for other_start, minutes in bind.execute(query):
+        other_end = end_of(other_start, minutes)
+        if other_end > start:
+            return other_start, other_end
+    return None
+
+
+def _conflicts(bind, rows, exclude_ids=()):
+    # (index, model, entity_id, (start, end)) for the show rows that overlap
+    # a stored show, other than those in `exclude_ids`, or an earlier row,
+    # from one query per side and a Timeline per venue and artist holding
+    # its stored shows and the rows.
+    timed = [(index, row) for index, row in enumerate(rows) if isinstance(row.get('start_time'), datetime)]
+    if not timed:
+        return
+    ends = [end_of(row['start_time'], row.get('duration_minutes')) for index, row in timed]
+    low = _window_start(min(row['start_time'] for index, row in timed))
+    shows, intervals = [], {}
+    for model, fk in BOOKED:
+        ids = {row[fk.name] for index, row in timed}
+        query = select([fk, show.c.start_time, show.c.duration_minutes]).\
+            where(and_(fk.in_(ids), show.c.start_time >= low, show.c.start_time < max(ends)))
+        if exclude_ids:
+            query = query.where(show.c.id.notin_(exclude_ids))
+        for entity_id, start, minutes in bind.execute(query):
+            shows.append(((model, entity_id), (start, end_of(start, minutes))))
+        for (index, row), end in zip(timed, ends):
+            intervals.setdefault((model, row[fk.name]), []).append((row['start_time'], end))
+    for key, interval in shows:
+        intervals[key].append(interval)
+    timelines = {key: Timeline(values) for key, values in intervals.items()}
+    for key, interval in shows:
+        timelines[key].add(*interval)
+
+    for (index, row), end in zip(timed, ends):
+        for model, fk in BOOKED:
+            other = timelines[(model, row[fk.name])].overlapping(row['start_time'], end)
+            if other is not None:
+                yield index, model, row[fk.name], other
+                break
+        else:
+            for model, fk in BOOKED:
+                timelines[(model, row[fk.name])].add(row['start_time'], end)
+
+
+def check_batch(bind, rows):
+    # {index: errors} for the show rows that overlap an existing show or an
+    # earlier row of the batch.
+    return {index: {fk.name: [str(DoubleBooked(model, entity_id, *other))]}
+            for index, model, entity_id, other in _conflicts(bind, rows)
+            for fk in [dict(BOOKED)[model]]}
+
+
+@event.listens_for(Session, 'before_flush')
+def _check_shows(session, flush_context, instances):
+    # The shows a flush writes are checked together, against each other as
+    # well as the stored ones, since the INSERTs and UPDATEs of a flush are
+    # only emitted once every object in it is prepared. Rows the flush
+    # rewrites or deletes do not count. Start times set from strings and
+    # missing ids are left to the database constraints.
+    shows, rows = [], []
+    for target in list(session.new) + list(session.dirty):
+        if not isinstance(target, Show) or not isinstance(target.start_time, datetime):
+            continue
+        try:
+            venue_id, artist_id = int(target.venue_id), int(target.artist_id)
+        except (TypeError, ValueError):
+            continue
+        shows.append(target)
+        rows.append({'venue_id': venue_id, 'artist_id': artist_id, 'start_time': target.start_time,
+                     'duration_minutes': target.duration_minutes})
+    if not shows:
+        return
+    replaced = [target.id for target in shows + [target for target in session.deleted if isinstance(target, Show)]
+                if target.id is not None]
+    for index, model, entity_id, other in _conflicts(session.connection(), rows, replaced):
+        raise DoubleBooked(model, entity_id, *other)
+
+
+#----------------------------------------------------------------------------#
+# Availability.
+#----------------------------------------------------------------------------#
+
+def free_venues(city, start, end, state=None):
+    # Venues in `city` (and `state`) with no show overlapping [start, end),
+    # ordered by name.
+    venues = db.session.query(Venue.id, Venue.name, Venue.address, Venue.state).filter(Venue.city == city)
+    if state:
+        venues = venues.filter(Venue.state == state)
+    shows = db.session.query(Show.venue_id, Show.start_time, Show.duration_minutes).\
+        filter(Show.venue_id.in_(venues.with_entities(Venue.id).subquery()),
+               Show.start_time >= _window_start(start),
+               Show.start_time < end)
+    busy = {venue_id for venue_id, other_start, minutes in shows if end_of(other_start, minutes) > start}
+    return [venue for venue in venues.order_by(Venue.name, Venue.id) if venue.id not in busy]
@@ -0,0 +1,208 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, request, session, Response
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from setup import app
+from models import Venue, Artist, Show
+
+app.config.setdefault('PAGE_CACHE_ENABLED', True)
+app.config.setdefault('PAGE_CACHE_SIZE', 1024)
+# Upper bound on how long a page is served from cache. Invalidation only
+# reaches the process that made the change (or every process sharing a
+# backend), so this also bounds staleness across gunicorn workers that each
+# keep their own LRU.
+app.config.setdefault('PAGE_CACHE_TIMEOUT', 300)
+
+
+#----------------------------------------------------------------------------#
+# Backends.
+#----------------------------------------------------------------------------#
+
+class LRUBackend(object):
+    # In-process backend. It has the same get/set/delete/get_many interface
+    # as the cachelib caches (RedisCache, MemcachedCache, ...), any of which
+    # can be passed to use_backend() to share pages between processes.
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def get_many(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return True
+
+    def delete(self, key):
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        return True
+
+
+_backend = None
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        _backend = LRUBackend(app.config['PAGE_CACHE_SIZE'])
+    return _backend
+
+
+def use_backend(new_backend):
+    global _backend
+    _backend = new_backend
+
+
+#----------------------------------------------------------------------------#
+# Tags.
+#----------------------------------------------------------------------------#
+# Every cached page records a token for each tag it depends on. Invalidating
+# a tag replaces its token, so pages stored under the old one stop matching.
+# This needs nothing beyond get/set from the backend.
+
+def _tag_key(tag):
+    return 'tag:' + tag
+
+
+def invalidate(*tags):
+    for tag in tags:
+        backend().set(_tag_key(tag), uuid.uuid4().hex, timeout=0)
+
+
+def _tokens(tags):
+    missing = []
+    tokens = {}
+    for tag, token in zip(tags, backend().get_many(*[_tag_key(tag) for tag in tags])):
+        if token is None:
+            token = uuid.uuid4().hex
+            missing.append((tag, token))
+        tokens[tag] = token
+    for tag, token in missing:
+        backend().set(_tag_key(tag), token, timeout=0)
+    return tokens
+
+
+def tag(*tags):
+    # Called from a cached view to declare what the rendered page shows.
+    g.setdefault('cache_tags', set()).update(tags)
+
+
+def expire_at(when):
+    # Called from a cached view when the page goes stale at a known time,
+    # e.g. when its next upcoming show starts and becomes a past show.
+    if when is None:
+        return
+    expires = time.mktime(when.timetuple())
+    g.cache_expires = min(g.get('cache_expires', expires), expires)
+
+
+#----------------------------------------------------------------------------#
+# Views.
+#----------------------------------------------------------------------------#
+
+def _cache_key():
+    args = sorted(request.view_args.items()) + sorted(request.args.items(multi=True))
+    return 'page:%s:%s' % (request.endpoint, '&'.join('%s=%s' % arg for arg in args))
+
+
+def cached(view):
+    # Serves GET requests from the page cache, rendering and storing the
+    # page on a miss. Pages are skipped while flashed messages are pending,
+    # since the layout would render (and consume) them.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not app.config['PAGE_CACHE_ENABLED'] or request.method != 'GET' or '_flashes' in session:
+            return view(*args, **kwargs)
+
+        key = _cache_key()
+        entry = backend().get(key)
+        if entry is not None and entry['expires'] > time.time() \
+                and _tokens(list(entry['tags'])) == entry['tags']:
+            return Response(entry['body'], status=entry['status'], mimetype=entry['mimetype'])
+
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            tags = g.pop('cache_tags', set())
+            now = time.time()
+            expires = min(g.pop('cache_expires', now + app.config['PAGE_CACHE_TIMEOUT']),
+                          now + app.config['PAGE_CACHE_TIMEOUT'])
+            if expires > now:
+                backend().set(key, {
+                    'body': response.get_data(),
+                    'status': response.status_code,
+                    'mimetype': response.mimetype,
+                    'expires': expires,
+                    'tags': _tokens(sorted(tags)),
+                }, timeout=int(expires - now) + 1)
+        return response
+    return wrapper
+
+
+#----------------------------------------------------------------------------#
+# Invalidation.
+#----------------------------------------------------------------------------#
+
+def _previous(target, attribute):
+    # Value an attribute had before this flush, for shows that moved.
+    return inspect(target).attrs[attribute].history.deleted
+
+
+def tags_for(target):
+    if isinstance(target, Venue):
+        return {'venue:%s' % target.id, 'venues', 'shows'}
+    if isinstance(target, Artist):
+        return {'artist:%s' % target.id, 'artists', 'shows'}
+    tags = {'venues', 'shows'}
+    for venue_id in [target.venue_id] + list(_previous(target, 'venue_id')):
+        tags.add('venue:%s' % venue_id)
+    for artist_id in [target.artist_id] + list(_previous(target, 'artist_id')):
+        tags.add('artist:%s' % artist_id)
+    return tags
+
+
+def _on_change(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('cache_tags', set()).update(tags_for(target))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changes(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        invalidate(*tags)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('cache_tags', None)
+
+
+for _model in (Venue, Artist, Show):
+    event.listen(_model, 'after_insert', _on_change)
+    event.listen(_model, 'after_update', _on_change)
+    event.listen(_model, 'after_delete', _on_change)
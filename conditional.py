@@ -0,0 +1,215 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from flask import request, session
+from sqlalchemy import and_, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from setup import app, db
+from models import Venue, Artist, Show, match_link, venue_stats
+
+
+#----------------------------------------------------------------------------#
+# Keeping validators current.
+#----------------------------------------------------------------------------#
+# A detail page shows the venue or artist, its shows and whom it played
+# them with. Rather than aggregating over all of those on every request,
+# changes to the shows and to the names and images of the partners touch
+# the updated_at of the venues and artists whose pages they change, and
+# the validators read that one row. Only updated_at moves: version is the
+# edit forms' optimistic lock.
+
+# Attributes of a venue or artist shown on the pages of its partners.
+SHOWN = ('name', 'image_link', 'deleted_at')
+
+
+def _other(model):
+    return Artist if model is Venue else Venue
+
+
+def _show_columns(model):
+    show = Show.__table__
+    return (show.c.venue_id, show.c.artist_id) if model is Venue else (show.c.artist_id, show.c.venue_id)
+
+
+def touch(connection, venues=(), artists=(), venue_partners=(), artist_partners=()):
+    # Marks the given venues and artists, and the partners of
+    # `venue_partners` and `artist_partners`, as modified now.
+    now = datetime.utcnow()
+    for model, ids, partners in ((Venue, venues, artist_partners), (Artist, artists, venue_partners)):
+        table = model.__table__
+        ids = sorted(set(ids))
+        for start in range(0, len(ids), 500):
+            connection.execute(table.update().where(table.c.id.in_(ids[start:start + 500])).values(updated_at=now))
+        if partners:
+            fk, other_fk = _show_columns(_other(model))
+            connection.execute(table.update().
+                               where(table.c.id.in_(select([other_fk]).where(fk.in_(sorted(set(partners)))))).
+                               values(updated_at=now))
+
+
+def _record(target, ids):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('touched', set()).update(ids)
+
+
+def _on_show_change(mapper, connection, target):
+    state = inspect(target)
+    ids = [(Venue, id, False) for id in [target.venue_id] + list(state.attrs.venue_id.history.deleted)]
+    ids += [(Artist, id, False) for id in [target.artist_id] + list(state.attrs.artist_id.history.deleted)]
+    _record(target, ids)
+
+
+def _on_entity_change(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in SHOWN):
+        _record(target, [(type(target), target.id, True)])
+
+
+event.listen(Show, 'after_insert', _on_show_change)
+event.listen(Show, 'after_update', _on_show_change)
+event.listen(Show, 'after_delete', _on_show_change)
+for _model in (Venue, Artist):
+    event.listen(_model, 'after_update', _on_entity_change)
+
+
+@event.listens_for(Session, 'after_flush')
+def _touch_changes(session, flush_context):
+    changed = session.info.pop('touched', None)
+    if not changed:
+        return
+
+    def ids(model, partners):
+        return [id for kind, id, shown in changed if kind is model and shown == partners and id is not None]
+
+    touch(session.connection(), ids(Venue, False), ids(Artist, False), ids(Venue, True), ids(Artist, True))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('touched', None)
+
+
+#----------------------------------------------------------------------------#
+# Validators.
+#----------------------------------------------------------------------------#
+# Each validator returns a tuple that changes whenever the page would, plus
+# the page's last modification time in UTC. Pages also change when a show
+# starts and moves from upcoming to past, so the start of the latest show
+# that already began counts as a modification too (start times are stored
+# in local time); the start_time indexes find it without a scan.
+
+def _latest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _utc(local, now):
+    if local is None:
+        return None
+    return local + (datetime.utcnow() - now)
+
+
+def _last_started(now):
+    return db.session.query(func.max(Show.start_time)).filter(Show.start_time < now).scalar()
+
+
+def entity(model, entity_id, now):
+    other = _other(model)
+    own_fk = _show_columns(model)[0]
+    started = select([func.max(Show.start_time)]).where(and_(own_fk == entity_id, Show.start_time < now)).as_scalar()
+    # The suggested matches: rewritten when they change, so their
+    # updated_at moves, and the matched entities' own.
+    table, owner_fk, candidate_fk = match_link(model)
+    matches = select([func.max(table.c.updated_at)]).where(owner_fk == entity_id).as_scalar()
+    matched = select([func.max(other.__table__.c.updated_at)]).\
+        select_from(table.join(other.__table__, other.__table__.c.id == candidate_fk)).\
+        where(owner_fk == entity_id).as_scalar()
+    row = db.session.query(model.updated_at, model.version, started, matches, matched).\
+        filter(model.id == entity_id).\
+        first()
+    if row is None:
+        return None, None
+    return tuple(row), _latest(row[0], _utc(row[2], now), row[3], row[4])
+
+
+def venue(venue_id, now):
+    return entity(Venue, venue_id, now)
+
+
+def artist(artist_id, now):
+    return entity(Artist, artist_id, now)
+
+
+def venues_listing(now):
+    # The listing's show counts come from venue_stats, whose rows are
+    # rewritten whenever a count changes.
+    venues = db.session.query(func.max(Venue.updated_at), func.count(Venue.id)).one()
+    stats = db.session.query(func.max(venue_stats.c.updated_at), func.count()).select_from(venue_stats).one()
+    return tuple(venues) + tuple(stats), _latest(venues[0], stats[0])
+
+
+def artists_listing(now):
+    artists = db.session.query(func.max(Artist.updated_at), func.count(Artist.id)).one()
+    return tuple(artists), artists[0]
+
+
+def shows_listing(now):
+    # Deleting a show touches its venue and artist, and deleting or
+    # restoring a venue or artist touches its row, so the latest updated_at
+    # of each table, deleted rows included, covers every change.
+    shows = db.session.query(func.max(Show.updated_at)).scalar()
+    venues = db.session.query(func.max(Venue.updated_at)).execution_options(include_deleted=True).scalar()
+    artists = db.session.query(func.max(Artist.updated_at)).execution_options(include_deleted=True).scalar()
+    started = None
+    if not request.args.get('all', 0, type=int):
+        started = _last_started(now)
+    return (shows, venues, artists, started), _latest(shows, venues, artists, _utc(started, now))
+
+
+#----------------------------------------------------------------------------#
+# Views.
+#----------------------------------------------------------------------------#
+
+def _make_etag(state):
+    key = '%s|%s|%s' % (request.endpoint, sorted(request.args.items(multi=True)), state)
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def etag(validator):
+    # Answers conditional GETs with 304 Not Modified from the validator
+    # alone, without calling the view; other responses carry ETag and
+    # Last-Modified. `validator` receives the view arguments and the time
+    # of the request.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            state, last_modified = validator(*args, now=datetime.now(), **kwargs)
+            if state is None:
+                return view(*args, **kwargs)
+            tag = _make_etag(state)
+            if _not_modified(tag, last_modified):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(tag)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
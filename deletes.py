@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import select
+
+from setup import app, db
+from models import Venue, Artist, Show, genre_link, match_references, stats_link
+import cache
+import jobs
+import search
+import stats
+
+# Days a deleted venue or artist can be restored before `flask deletes
+# purge` removes it for good.
+app.config.setdefault('DELETE_RETENTION_DAYS', 30)
+
+show = Show.__table__
+MODELS = {'venue': Venue, 'artist': Artist}
+
+
+def _sides(model):
+    # The show column pointing at `model`, and the model and column on the
+    # other side of its shows.
+    if model is Venue:
+        return show.c.venue_id, Artist, show.c.artist_id
+    return show.c.artist_id, Venue, show.c.venue_id
+
+
+def _partners(model, ids):
+    # Ids of the entities that share shows with the `model` rows in `ids`.
+    fk, other, other_fk = _sides(model)
+    return other, [id for id, in db.session.execute(select([other_fk]).where(fk.in_(ids)).distinct())]
+
+
+#----------------------------------------------------------------------------#
+# Deleting and restoring.
+#----------------------------------------------------------------------------#
+# Deleting a venue or artist sets its deleted_at: one UPDATE, however many
+# shows it has. The shows stay, hidden along with it (models._hide_deleted),
+# and come back when it is restored. The entities on the other side of
+# those shows are recounted by a job.
+
+def soft_delete(entity):
+    entity.deleted_at = datetime.utcnow()
+    jobs.enqueue('refresh_partners', model=entity.__tablename__, entity_id=entity.id)
+
+
+def restore(entity):
+    entity.deleted_at = None
+    jobs.enqueue('refresh_partners', model=entity.__tablename__, entity_id=entity.id)
+
+
+@jobs.handler('refresh_partners')
+def refresh_partners(model, entity_id):
+    model = MODELS[model]
+    other, other_ids = _partners(model, [entity_id])
+    connection = db.session.connection()
+    now = datetime.now()
+    stats.refresh(connection, model, [entity_id], now)
+    stats.refresh(connection, other, other_ids, now)
+    db.session.commit()
+    cache.invalidate('venues')
+
+
+#----------------------------------------------------------------------------#
+# Purging.
+#----------------------------------------------------------------------------#
+
+def purge(model, condition):
+    # Removes the venues or artists matching `condition` for good, with one
+    # statement: ON DELETE CASCADE takes their shows, genre links,
+    # statistics and matches along. SQLite does not enforce foreign keys, so there they
+    # are deleted first, one statement per table. Returns how many were
+    # removed.
+    ids = select([model.id]).where(condition)
+    fk = _sides(model)[0]
+    other, other_ids = _partners(model, ids)
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(show.delete().where(fk.in_(ids)))
+        for table, link_fk in [genre_link(model), stats_link(model)] + match_references(model):
+            db.session.execute(table.delete().where(link_fk.in_(ids)))
+    deleted = db.session.execute(model.__table__.delete().where(condition)).rowcount
+    stats.refresh(db.session.connection(), other, other_ids, datetime.now())
+    db.session.commit()
+
+    cache.invalidate('venues', 'artists', 'shows',
+                     *['%s:%s' % (other.__tablename__, id) for id in other_ids])
+    search.reset(model)
+    return deleted
+
+
+#----------------------------------------------------------------------------#
+# Command line.
+#----------------------------------------------------------------------------#
+
+@app.cli.group('deletes')
+def deletes_command():
+    """Manage deleted venues and artists."""
+
+
+@jobs.handler('purge_deleted')
+def purge_job(model, before):
+    # Removes the `model` rows deleted before `before`, set-based. Purging
+    # again removes nothing more, so a retry is harmless.
+    model = MODELS[model]
+    purge(model, model.deleted_at < datetime.fromisoformat(before))
+
+
+@deletes_command.command('purge')
+@click.option('--older-than', 'days', type=int, default=None,
+              help='Days since deletion (default: DELETE_RETENTION_DAYS).')
+def purge_command(days):
+    """Queue the removal of venues and artists deleted more than N days ago."""
+    days = app.config['DELETE_RETENTION_DAYS'] if days is None else days
+    before = datetime.utcnow() - timedelta(days=days)
+    with db.engine.begin() as connection:
+        for name in MODELS:
+            jobs.enqueue('purge_deleted', bind=connection, model=name, before=before.isoformat())
+    click.echo('Queued the purge of venues and artists deleted before %s' % before.strftime('%Y-%m-%d %H:%M'))
@@ -0,0 +1,146 @@
+import csv
+import io
+import json
+import sys
+from datetime import date, datetime
+
+import click
+from sqlalchemy import select
+
+from setup import app, db
+from models import Venue, Artist, Show
+import queries
+
+# Rows fetched from the server-side cursor per round trip, and rows written
+# per chunk (one columnar chunk holds this many rows).
+EXPORT_BATCH_SIZE = 5000
+
+EXPORTS = {
+    'venues': Venue,
+    'artists': Artist,
+    'shows': Show,
+}
+
+
+#----------------------------------------------------------------------------#
+# Reading.
+#----------------------------------------------------------------------------#
+
+def _columns(kind):
+    # The table's columns, plus the genres of venues and artists as one
+    # ';'-separated string (the same form `flask import` reads).
+    model = EXPORTS[kind]
+    columns = list(model.__table__.columns)
+    if model is not Show:
+        columns.append(queries.genre_names(model).label('genres'))
+    return columns
+
+
+def columns(kind):
+    return [column.name for column in _columns(kind)]
+
+
+def batches(kind, batch_size=EXPORT_BATCH_SIZE):
+    # Lists of rows in primary key order. stream_results makes psycopg2 use
+    # a named (server-side) cursor, so only one batch is ever held in
+    # memory; other drivers fall back to their own buffering.
+    table = EXPORTS[kind].__table__
+    statement = select(_columns(kind)).\
+        order_by(table.c.id).\
+        execution_options(stream_results=True)
+    result = db.session.execute(statement)
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        result.close()
+
+
+#----------------------------------------------------------------------------#
+# Writers.
+#----------------------------------------------------------------------------#
+# Each writer turns batches into text chunks ready to be written out.
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def write_csv(names, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for rows in batches:
+        for row in rows:
+            writer.writerow([_value(value) for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _records(names, rows):
+    # Rows as dicts, with genres as lists for the JSON formats.
+    for row in rows:
+        record = dict(zip(names, row))
+        if 'genres' in record:
+            record['genres'] = queries.split_genres(record['genres'])
+        yield record
+
+
+def write_ndjson(names, batches):
+    for rows in batches:
+        yield ''.join(json.dumps(record, default=_value) + '\n' for record in _records(names, rows))
+
+
+def write_columns(names, batches):
+    # One JSON object per line per batch, holding each column as an array:
+    # {"count": n, "columns": {"id": [...], "name": [...], ...}}. Readers
+    # can load a column without parsing the others, as with Parquet row
+    # groups.
+    for rows in batches:
+        records = list(_records(names, rows))
+        chunk = {'count': len(rows), 'columns': {name: [record[name] for record in records] for name in names}}
+        yield json.dumps(chunk, default=_value) + '\n'
+
+
+WRITERS = {
+    'csv': (write_csv, 'text/csv'),
+    'ndjson': (write_ndjson, 'application/x-ndjson'),
+    'columns': (write_columns, 'application/x-ndjson'),
+}
+
+
+def run(kind, format='csv', batch_size=EXPORT_BATCH_SIZE):
+    # Text chunks of the whole `kind` table in `format`.
+    writer, mimetype = WRITERS[format]
+    return writer(columns(kind), batches(kind, batch_size))
+
+
+#----------------------------------------------------------------------------#
+# Command line.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(EXPORTS)))
+@click.argument('path', default='-', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'format', type=click.Choice(sorted(WRITERS)),
+              help='Output format; guessed from the file extension by default.')
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True)
+def export_command(kind, path, format, batch_size):
+    """Stream the venues, artists or shows table to a file or stdout."""
+    if format is None:
+        format = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+    if path == '-':
+        for chunk in run(kind, format=format, batch_size=batch_size):
+            sys.stdout.write(chunk)
+    else:
+        with io.open(path, 'w', encoding='utf-8', newline='') as stream:
+            for chunk in run(kind, format=format, batch_size=batch_size):
+                stream.write(chunk)
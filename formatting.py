@@ -0,0 +1,67 @@
+from datetime import datetime
+from functools import lru_cache
+
+import babel.dates
+import dateutil.parser
+from babel import Locale
+
+from setup import app
+
+# Locale of formatted dates; None means the system time locale, as with
+# babel.dates.format_datetime.
+app.config.setdefault('DATETIME_LOCALE', None)
+
+# Named patterns of the `datetime` filter; anything else is used as a babel
+# pattern itself.
+FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+
+@lru_cache(maxsize=None)
+def _locale(name):
+    return Locale.parse(name or babel.dates.LC_TIME)
+
+
+@lru_cache(maxsize=256)
+def _pattern(format):
+    return babel.dates.parse_pattern(FORMATS.get(format, format))
+
+
+def _datetime(value):
+    # Naive datetimes are formatted as UTC, as babel does, which leaves
+    # their fields unchanged.
+    if not isinstance(value, datetime):
+        value = dateutil.parser.parse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=babel.dates.UTC)
+    return value
+
+
+def format_datetime(value, format='medium', locale=None):
+    # Same output as babel.dates.format_datetime(value, FORMATS[format]),
+    # without re-parsing the pattern and locale on every call. Strings are
+    # still accepted and parsed.
+    if value is None:
+        return ''
+    locale = _locale(locale or app.config['DATETIME_LOCALE'])
+    return _pattern(format).apply(_datetime(value), locale)
+
+
+def format_many(values, format='medium', locale=None):
+    # format_datetime() over a whole list; equal values, such as shows
+    # starting on the same hour, are formatted once.
+    locale = _locale(locale or app.config['DATETIME_LOCALE'])
+    pattern = _pattern(format)
+    formatted = {None: ''}
+    result = []
+    for value in values:
+        text = formatted.get(value)
+        if text is None:
+            text = formatted[value] = pattern.apply(_datetime(value), locale)
+        result.append(text)
+    return result
+
+
+app.jinja_env.filters['datetime'] = format_datetime
@@ -1,7 +1,14 @@
+import time
 from datetime import datetime
 from flask_wtf import FlaskForm, Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, NumberRange
+from setup import app, db
+from models import Genre, DEFAULT_SHOW_MINUTES, MAX_SHOW_MINUTES
+
+app.config.setdefault('GENRE_CHOICES_TIMEOUT', 300)
 
 
 class ShowForm(Form):
@@ -16,6 +23,11 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default=datetime.today()
     )
+    duration_minutes = IntegerField(
+        'duration_minutes',
+        validators=[NumberRange(min=1, max=MAX_SHOW_MINUTES)],
+        default=DEFAULT_SHOW_MINUTES
+    )
 
 
 state_choices = [
@@ -72,27 +84,50 @@ state_choices = [
     ('WY', 'WY'),
 ]
 
-genres_choices = [
-    ('Alternative', 'Alternative'),
-    ('Blues', 'Blues'),
-    ('Classical', 'Classical'),
-    ('Country', 'Country'),
-    ('Electronic', 'Electronic'),
-    ('Folk', 'Folk'),
-    ('Funk', 'Funk'),
-    ('Hip-Hop', 'Hip-Hop'),
-    ('Heavy Metal', 'Heavy Metal'),
-    ('Instrumental', 'Instrumental'),
-    ('Jazz', 'Jazz'),
-    ('Musical Theatre', 'Musical Theatre'),
-    ('Pop', 'Pop'),
-    ('Punk', 'Punk'),
-    ('R&B', 'R&B'),
-    ('Reggae', 'Reggae'),
-    ('Rock n Roll', 'Rock n Roll'),
-    ('Soul', 'Soul'),
-    ('Other', 'Other'),
-]
+# Genre choices are read from the genre table and kept for
+# GENRE_CHOICES_TIMEOUT seconds, or until a genre is added or removed in
+# this process.
+_genres_choices = None
+_genres_loaded = 0
+
+
+def genres_choices():
+    global _genres_choices, _genres_loaded
+    if _genres_choices is None or time.time() - _genres_loaded > app.config['GENRE_CHOICES_TIMEOUT']:
+        _genres_choices = [(name, name) for name, in db.session.query(Genre.name).order_by(Genre.name)]
+        _genres_loaded = time.time()
+    return _genres_choices
+
+
+def _on_genre_change(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info['genres_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_genres(session):
+    global _genres_choices
+    if session.info.pop('genres_changed', False):
+        _genres_choices = None
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_genre_changes(session, previous_transaction):
+    session.info.pop('genres_changed', None)
+
+
+event.listen(Genre, 'after_insert', _on_genre_change)
+event.listen(Genre, 'after_delete', _on_genre_change)
+
+
+class GenreField(SelectMultipleField):
+    # A SelectMultipleField whose choices are the current genres, looked up
+    # whenever a form is built.
+
+    def __init__(self, label=None, validators=None, **kwargs):
+        super(GenreField, self).__init__(label, validators, **kwargs)
+        self.choices = genres_choices()
 
 
 class VenueForm(Form):
@@ -115,9 +150,8 @@ class VenueForm(Form):
     image_link = StringField(
         'image_link'
     )
-    genres = SelectMultipleField(
-        # TODO implement enum restriction
-        'genres', validators=[DataRequired()], choices=genres_choices
+    genres = GenreField(
+        'genres', validators=[DataRequired()]
 
     )
     facebook_link = StringField(
@@ -152,9 +186,8 @@ class ArtistForm(Form):
     image_link = StringField(
         'image_link'
     )
-    genres = SelectMultipleField(
-        # TODO implement enum restriction
-        'genres', validators=[DataRequired()], choices=genres_choices
+    genres = GenreField(
+        'genres', validators=[DataRequired()]
     )
     facebook_link = StringField(
         # TODO implement enum restriction
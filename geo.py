@@ -0,0 +1,303 @@
+import csv
+import math
+import os
+from collections import OrderedDict
+
+import click
+from sqlalchemy import and_, event, func, inspect, or_
+
+from setup import app, db
+from models import Venue, stats_link
+import queries
+
+# Offline gazetteer read by `flask geo geocode`: a CSV with city, state,
+# latitude and longitude columns, or a GeoNames dump such as
+# cities15000.txt (tab-separated, states as admin1 codes).
+app.config.setdefault('GEO_GAZETTEER', os.path.join(app.root_path, 'gazetteer.csv'))
+# Largest radius and result count nearby searches accept.
+app.config.setdefault('GEO_MAX_RADIUS_KM', 500)
+app.config.setdefault('GEO_MAX_RESULTS', 200)
+
+# Characters of geohash stored per venue (cells of about 5 m), and the
+# most cells a searched box is split into.
+GEOHASH_PRECISION = 9
+MAX_CELLS = 16
+# Reach of the first ring a nearby search looks in; each next one doubles it.
+NEAR_FIRST_RING_KM = 1.0
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+
+
+#----------------------------------------------------------------------------#
+# Geohashes.
+#----------------------------------------------------------------------------#
+# A geohash interleaves the bits of the longitude and latitude cells, so
+# the venues of a cell share a prefix and sit next to each other in the
+# geohash index: a box is searched as a few index ranges, one per cell
+# covering it.
+
+def _bits(precision):
+    # Longitude and latitude bits of a geohash `precision` characters long.
+    bits = precision * 5
+    return (bits + 1) // 2, bits // 2
+
+
+def _cell(value, low, high, bits):
+    cells = 1 << bits
+    return min(max(int((value - low) / (high - low) * cells), 0), cells - 1)
+
+
+def _hash(x, y, precision):
+    lon_bits, lat_bits = _bits(precision)
+    code = 0
+    for i in range(lat_bits):
+        code = (code << 2) | (((x >> (lon_bits - 1 - i)) & 1) << 1) | ((y >> (lat_bits - 1 - i)) & 1)
+    if lon_bits > lat_bits:
+        code = (code << 1) | (x & 1)
+    chars = []
+    for _ in range(precision):
+        chars.append(BASE32[code & 31])
+        code >>= 5
+    return ''.join(reversed(chars))
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lon_bits, lat_bits = _bits(precision)
+    return _hash(_cell(longitude, -180.0, 180.0, lon_bits), _cell(latitude, -90.0, 90.0, lat_bits), precision)
+
+
+def _successor(prefix):
+    # The first geohash after all those starting with `prefix`, or None.
+    chars = list(prefix)
+    while chars:
+        index = BASE32.index(chars[-1])
+        if index < len(BASE32) - 1:
+            chars[-1] = BASE32[index + 1]
+            return ''.join(chars)
+        chars.pop()
+    return None
+
+
+def cover(south, west, north, east):
+    # [(low, high)] geohash ranges covering the box, west <= east, from the
+    # finest precision that needs at most MAX_CELLS cells. Adjacent cells
+    # are merged; high is None when a range runs to the end.
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lon_bits, lat_bits = _bits(precision)
+        x0, x1 = _cell(west, -180.0, 180.0, lon_bits), _cell(east, -180.0, 180.0, lon_bits)
+        y0, y1 = _cell(south, -90.0, 90.0, lat_bits), _cell(north, -90.0, 90.0, lat_bits)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= MAX_CELLS:
+            break
+    ranges = []
+    for prefix in sorted(_hash(x, y, precision) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)):
+        if ranges and ranges[-1][1] == prefix:
+            ranges[-1][1] = _successor(prefix)
+        else:
+            ranges.append([prefix, _successor(prefix)])
+    return [tuple(r) for r in ranges]
+
+
+def _sync_geohash(mapper, connection, target):
+    # Coordinates belong to the city they were looked up for: a venue that
+    # moves without new coordinates waits for the next geocoding run.
+    state = inspect(target)
+    placed = state.attrs.latitude.history.has_changes() or state.attrs.longitude.history.has_changes()
+    moved = state.attrs.city.history.has_changes() or state.attrs.state.history.has_changes()
+    if state.persistent and moved and not placed:
+        target.latitude = target.longitude = None
+    if target.latitude is None or target.longitude is None:
+        target.geohash = None
+    else:
+        target.geohash = encode(target.latitude, target.longitude)
+
+
+event.listen(Venue, 'before_insert', _sync_geohash)
+event.listen(Venue, 'before_update', _sync_geohash)
+
+
+#----------------------------------------------------------------------------#
+# Distances.
+#----------------------------------------------------------------------------#
+
+def distance(lat1, lon1, lat2, lon2):
+    # Great-circle distance in kilometres.
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(a), 1.0))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    # (south, west, north, east) around every point within radius_km; west
+    # is greater than east when the box crosses the antimeridian.
+    angle = radius_km / EARTH_RADIUS_KM
+    south, north = latitude - math.degrees(angle), latitude + math.degrees(angle)
+    if south <= -90.0 or north >= 90.0 or angle >= math.pi / 2:
+        # A pole is in reach: every longitude is.
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    spread = math.degrees(math.asin(min(math.sin(angle) / math.cos(math.radians(latitude)), 1.0)))
+    if spread >= 180.0:
+        return south, -180.0, north, 180.0
+    west, east = longitude - spread, longitude + spread
+    if west < -180.0:
+        west += 360.0
+    if east > 180.0:
+        east -= 360.0
+    return south, west, north, east
+
+
+#----------------------------------------------------------------------------#
+# Searches.
+#----------------------------------------------------------------------------#
+
+def _boxes(south, west, north, east):
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+def _in_box(south, west, north, east):
+    ranges = [and_(Venue.geohash >= low, Venue.geohash < high) if high else Venue.geohash >= low
+              for low, high in cover(south, west, north, east)]
+    return and_(or_(*ranges),
+                Venue.latitude.between(south, north),
+                Venue.longitude.between(west, east))
+
+
+def _venues(south, west, north, east):
+    # Venues inside the box with their upcoming show counts, found through
+    # the geohash index; the coordinates trim the cells to the box.
+    table, fk = stats_link(Venue)
+    return db.session.query(
+        Venue.id,
+        Venue.name,
+        Venue.city,
+        Venue.state,
+        Venue.address,
+        Venue.latitude,
+        Venue.longitude,
+        queries.upcoming_shows_count(Venue).label('num_upcoming_shows')
+    ).\
+        outerjoin(table, fk == Venue.id).\
+        filter(or_(*[_in_box(*box) for box in _boxes(south, west, north, east)]))
+
+
+def within(south, west, north, east, limit):
+    rows = _venues(south, west, north, east).order_by(Venue.name, Venue.id).limit(limit)
+    return [OrderedDict(zip(row.keys(), row)) for row in rows]
+
+
+def _outside(south, west, north, east):
+    return ~or_(*[and_(Venue.latitude.between(box_south, box_north), Venue.longitude.between(box_west, box_east))
+                  for box_south, box_west, box_north, box_east in _boxes(south, west, north, east)])
+
+
+def near(latitude, longitude, radius_km, limit):
+    # Venues within radius_km, nearest first, with their distance. The
+    # search grows outward in rings, each doubling the reach and fetching
+    # only the venues between its box and the previous one, and stops once
+    # `limit` venues lie within the reach: none further out can be nearer.
+    # The rows fetched follow `limit`, not how many venues the circle holds.
+    found, inner, reach = [], None, min(NEAR_FIRST_RING_KM, radius_km)
+    while True:
+        box = bounding_box(latitude, longitude, reach)
+        rows = _venues(*box)
+        if inner is not None:
+            rows = rows.filter(_outside(*inner))
+        for row in rows:
+            km = distance(latitude, longitude, row.latitude, row.longitude)
+            if km <= radius_km:
+                found.append((km, row))
+        if reach >= radius_km or sum(km <= reach for km, row in found) >= limit:
+            break
+        inner, reach = box, min(reach * 2, radius_km)
+    venues = []
+    for km, row in sorted(found, key=lambda item: (item[0], item[1].id))[:limit]:
+        venue = OrderedDict(zip(row.keys(), row))
+        venue['distance_km'] = round(km, 3)
+        venues.append(venue)
+    return venues
+
+
+#----------------------------------------------------------------------------#
+# Geocoding.
+#----------------------------------------------------------------------------#
+
+def _place(city, state):
+    return city.strip().lower(), (state or '').strip().upper()
+
+
+def _geonames(file):
+    # GeoNames dump: the most populous place of each name and admin1 code.
+    places = {}
+    for fields in csv.reader(file, delimiter='\t', quoting=csv.QUOTE_NONE):
+        if len(fields) < 15:
+            continue
+        population = int(fields[14] or 0)
+        for name in {fields[1], fields[2]}:
+            key = _place(name, fields[10])
+            if key not in places or places[key][0] < population:
+                places[key] = (population, float(fields[4]), float(fields[5]))
+    return {key: (latitude, longitude) for key, (population, latitude, longitude) in places.items()}
+
+
+def gazetteer(path):
+    # {(city, STATE): (latitude, longitude)} from the file at `path`.
+    with open(path, newline='', encoding='utf-8') as file:
+        if not path.endswith('.csv'):
+            return _geonames(file)
+        return {_place(row['city'], row.get('state')): (float(row['latitude']), float(row['longitude']))
+                for row in csv.DictReader(file) if row.get('city')}
+
+
+def geocode(places, everything=False):
+    # Places the venues of each city found in `places` at its coordinates,
+    # one UPDATE per city. Only venues without coordinates unless
+    # `everything`. Returns the venues placed and the [(city, state,
+    # venues)] not found.
+    venue = Venue.__table__
+    pending = db.session.query(Venue.city, Venue.state, func.count(Venue.id)).\
+        filter(Venue.city.isnot(None)).\
+        group_by(Venue.city, Venue.state)
+    if not everything:
+        pending = pending.filter(Venue.latitude.is_(None))
+    placed = 0
+    missing = []
+    for city, state, count in pending.all():
+        place = places.get(_place(city, state))
+        if place is None:
+            missing.append((city, state, count))
+            continue
+        latitude, longitude = place
+        update = venue.update().\
+            where(and_(venue.c.city == city, venue.c.state == state if state is not None else venue.c.state.is_(None))).\
+            values(latitude=latitude, longitude=longitude, geohash=encode(latitude, longitude))
+        if not everything:
+            update = update.where(venue.c.latitude.is_(None))
+        placed += db.session.execute(update).rowcount
+    db.session.commit()
+    return placed, missing
+
+
+#----------------------------------------------------------------------------#
+# Command line.
+#----------------------------------------------------------------------------#
+
+@app.cli.group('geo')
+def geo_command():
+    """Place venues on the map."""
+
+
+@geo_command.command('geocode')
+@click.option('--gazetteer', 'path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Gazetteer file (default: GEO_GAZETTEER).')
+@click.option('--all', 'everything', is_flag=True, help='Also re-place venues that have coordinates.')
+def geocode_command(path, everything):
+    """Set venue coordinates from an offline gazetteer."""
+    path = path or app.config['GEO_GAZETTEER']
+    places = gazetteer(path)
+    placed, missing = geocode(places, everything)
+    click.echo('Placed %d venues from %d places in %s' % (placed, len(places), path))
+    for city, state, count in missing[:20]:
+        click.echo('Not in gazetteer: %s, %s (%d venues)' % (city, state, count))
+    if len(missing) > 20:
+        click.echo('... and %d more places' % (len(missing) - 20))
@@ -0,0 +1,22 @@
+# Read by gunicorn from the working directory (gunicorn app:app).
+import os
+import subprocess
+import sys
+
+
+def on_starting(server):
+    # Fill the template bytecode cache once, before any worker starts, so
+    # workers load compiled templates. It runs in a separate process to keep
+    # the app out of the master.
+    status = subprocess.call([sys.executable, '-m', 'flask', 'templates', 'compile'],
+                             env=dict(os.environ, FLASK_APP='app'))
+    if status:
+        server.log.warning('Compiling templates failed with status %d', status)
+
+
+def post_worker_init(worker):
+    # Render every page once before the worker accepts connections.
+    from setup import app
+    if app.config['TEMPLATE_WARM_UP']:
+        import templating
+        worker.log.info('Warmed up in %.2fs', templating.warm_up())
@@ -0,0 +1,401 @@
+import csv
+import io
+import json
+import sys
+import time
+from itertools import islice
+
+import click
+from sqlalchemy import func, select
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from werkzeug.datastructures import MultiDict
+
+from setup import app, db
+from models import Venue, Artist, Show, Genre, genre_link
+from forms import VenueForm, ArtistForm, ShowForm
+import cache
+import conditional
+import jobs
+import search
+import stats
+import booking
+
+# The POST /api/v1/import endpoint is off unless a token is set; requests
+# must then send it as `Authorization: Bearer <token>`.
+app.config.setdefault('IMPORT_API_TOKEN', None)
+
+IMPORT_BATCH_SIZE = 1000
+# Per-row errors kept in a report; the rest are only counted.
+MAX_REPORTED_ERRORS = 1000
+
+FALSE_VALUES = ('', '0', 'false', 'f', 'no', 'n', 'off')
+
+
+#----------------------------------------------------------------------------#
+# Readers.
+#----------------------------------------------------------------------------#
+# Both yield (line number, record) pairs. In CSV, multi-valued cells such as
+# genres are separated by ';'.
+
+def read_csv(stream):
+    for line, record in enumerate(csv.DictReader(stream), start=2):
+        yield line, record
+
+
+def read_ndjson(stream):
+    for line, text in enumerate(stream, start=1):
+        if text.strip():
+            try:
+                yield line, json.loads(text)
+            except ValueError as e:
+                yield line, e
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+#----------------------------------------------------------------------------#
+# Validation.
+#----------------------------------------------------------------------------#
+
+def _formdata(record, multi_valued=('genres',), flags=()):
+    # Turns a decoded record into the form data a browser would post.
+    data = MultiDict()
+    for key, value in record.items():
+        if value is None:
+            continue
+        if key in multi_valued:
+            values = value if isinstance(value, list) else str(value).split(';')
+            for item in values:
+                if str(item).strip():
+                    data.add(key, str(item).strip())
+        elif key in flags:
+            if str(value).strip().lower() not in FALSE_VALUES:
+                data.add(key, 'y')
+        else:
+            data.add(key, str(value))
+    return data
+
+
+class Importer(object):
+    # Validates records with the same WTForms form the create pages use and
+    # turns valid ones into column dicts for one table.
+
+    model = None
+    form_class = None
+    flags = ()
+
+    def __init__(self):
+        self.form = self.form_class(formdata=None, meta={'csrf': False})
+
+    def validate(self, record):
+        self.form.process(_formdata(record, flags=self.flags))
+        if not self.form.validate():
+            return None, self.form.errors
+        row = {}
+        for name, field in self.form._fields.items():
+            row[name] = field.data
+        return self.to_row(row), None
+
+    def to_row(self, data):
+        return data
+
+    def insert(self, rows):
+        insert_batch(self.model.__table__, rows)
+
+    def check(self, rows):
+        # Cross-row checks against the database for a whole batch; returns
+        # {index: errors} for the rows that fail.
+        return {}
+
+    def affected_tags(self, rows):
+        return {self.model.__tablename__ + 's'}
+
+
+class GenreImporter(Importer):
+    # Venues and artists: genre names are validated against the genre table
+    # by the form and written to the association table next to the rows.
+
+    def insert(self, rows):
+        rows = [dict(row) for row in rows]
+        names = [row.pop('genres') for row in rows]
+        ids = insert_with_ids(self.model.__table__, rows)
+        genre_ids = dict(db.session.query(Genre.name, Genre.id).
+                         filter(Genre.name.in_({name for row in names for name in row})))
+        table, fk = genre_link(self.model)
+        links = [{fk.name: id, 'genre_id': genre_ids[name]}
+                 for id, row in zip(ids, names) for name in set(row)]
+        if links:
+            insert_batch(table, links)
+
+
+class VenueImporter(GenreImporter):
+    model = Venue
+    form_class = VenueForm
+    flags = ('seeking_talent',)
+
+
+class ArtistImporter(GenreImporter):
+    model = Artist
+    form_class = ArtistForm
+    flags = ('seeking_venue',)
+
+
+class ShowImporter(Importer):
+    model = Show
+    form_class = ShowForm
+
+    def to_row(self, data):
+        row = {'start_time': data['start_time'], 'duration_minutes': data['duration_minutes']}
+        try:
+            row['artist_id'] = int(data['artist_id'])
+            row['venue_id'] = int(data['venue_id'])
+        except (TypeError, ValueError):
+            return None
+        return row
+
+    def validate(self, record):
+        if not record.get('start_time'):
+            return None, {'start_time': ['This field is required.']}
+        row, errors = Importer.validate(self, record)
+        if errors is None and row is None:
+            errors = {'artist_id': ['artist_id and venue_id must be integers']}
+        return row, errors
+
+    def check(self, rows):
+        artists = {row['artist_id'] for row in rows}
+        venues = {row['venue_id'] for row in rows}
+        known_artists = {id for id, in db.session.query(Artist.id).filter(Artist.id.in_(artists))}
+        known_venues = {id for id, in db.session.query(Venue.id).filter(Venue.id.in_(venues))}
+        errors = {}
+        for index, row in enumerate(rows):
+            if row['artist_id'] not in known_artists:
+                errors[index] = {'artist_id': ['No artist with id %d' % row['artist_id']]}
+            elif row['venue_id'] not in known_venues:
+                errors[index] = {'venue_id': ['No venue with id %d' % row['venue_id']]}
+        booked = booking.check_batch(db.session, [row for index, row in enumerate(rows) if index not in errors])
+        valid = [index for index in range(len(rows)) if index not in errors]
+        for position, messages in booked.items():
+            errors[valid[position]] = messages
+        return errors
+
+    def insert(self, rows):
+        # Core inserts bypass the hooks in stats.py, matching.py and
+        # conditional.py, so the statistics of the venues and artists
+        # involved are recomputed in the same transaction, their pages
+        # marked modified and their matches queued for a refresh.
+        Importer.insert(self, rows)
+        connection = db.session.connection()
+        venues, artists = [row['venue_id'] for row in rows], [row['artist_id'] for row in rows]
+        conditional.touch(connection, venues, artists)
+        stats.refresh(connection, Venue, venues)
+        stats.refresh(connection, Artist, artists)
+        jobs.enqueue('refresh_matches', venue_shows=sorted(set(venues)), artist_shows=sorted(set(artists)))
+
+    def affected_tags(self, rows):
+        tags = {'venues', 'shows'}
+        for row in rows:
+            tags.add('venue:%d' % row['venue_id'])
+            tags.add('artist:%d' % row['artist_id'])
+        return tags
+
+
+IMPORTERS = {
+    'venues': VenueImporter,
+    'artists': ArtistImporter,
+    'shows': ShowImporter,
+}
+
+
+#----------------------------------------------------------------------------#
+# Loading.
+#----------------------------------------------------------------------------#
+
+def _with_defaults(table, rows):
+    # Fills in Python-side column defaults (updated_at, version, ...) so
+    # every row carries the same keys, as executemany and COPY need.
+    filled = []
+    for row in rows:
+        row = dict(row)
+        for column in table.columns:
+            if column.name in row or column.primary_key:
+                continue
+            if column.default is not None and column.default.is_callable:
+                row[column.name] = column.default.arg(None)
+            elif column.default is not None:
+                row[column.name] = column.default.arg
+        filled.append(row)
+    return filled
+
+
+def _copy(table, rows):
+    # PostgreSQL COPY ... FROM STDIN, the fastest way to load a batch.
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    buffer.seek(0)
+    statement = 'COPY %s (%s) FROM STDIN WITH CSV' % (table.name, ', '.join('"%s"' % column for column in columns))
+    # The raw cursor raises DBAPI errors, which are wrapped as SQLAlchemy
+    # would, so a rejected batch is retried row by row like any other.
+    dbapi = db.session.bind.dialect.dbapi
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    except dbapi.Error as e:
+        raise DBAPIError.instance(statement, None, e, dbapi.Error)
+    finally:
+        cursor.close()
+
+
+def insert_batch(table, rows):
+    rows = _with_defaults(table, rows)
+    if db.session.bind.dialect.name == 'postgresql':
+        _copy(table, rows)
+    else:
+        db.session.execute(table.insert(), rows)
+
+
+def insert_with_ids(table, rows):
+    # Inserts rows and returns their new primary keys, in order. On
+    # PostgreSQL the keys are drawn from the table's sequence in one query,
+    # so the rows can still go through COPY. Elsewhere they follow max(id),
+    # read with FOR UPDATE where the database supports it, and the rows go
+    # in with one executemany; a concurrent writer taking the same ids
+    # fails the batch, which _load then retries row by row.
+    if db.session.bind.dialect.name == 'postgresql':
+        ids = [id for id, in db.session.execute(
+            'SELECT nextval(pg_get_serial_sequence(:table, :column)) FROM generate_series(1, :count)',
+            {'table': table.name, 'column': 'id', 'count': len(rows)})]
+    else:
+        last = db.session.execute(select([func.coalesce(func.max(table.c.id), 0)]).with_for_update()).scalar()
+        ids = list(range(last + 1, last + 1 + len(rows)))
+    insert_batch(table, [dict(row, id=id) for id, row in zip(ids, rows)])
+    return ids
+
+
+class Report(object):
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.time()
+
+    def error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.time() - self.started
+        return self.read / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'read': self.read,
+            'imported': self.imported,
+            'failed': self.failed,
+            'rows_per_second': round(self.rows_per_second, 1),
+            'errors': self.errors,
+        }
+
+
+def _load(importer, batch, report):
+    rows, lines = [], []
+    for line, record in batch:
+        report.read += 1
+        if not isinstance(record, dict):
+            report.error(line, {'record': [str(record)]})
+            continue
+        row, errors = importer.validate(record)
+        if errors:
+            report.error(line, errors)
+            continue
+        rows.append(row)
+        lines.append(line)
+
+    rejected = importer.check(rows) if rows else {}
+    for index, errors in rejected.items():
+        report.error(lines[index], errors)
+    rows = [row for index, row in enumerate(rows) if index not in rejected]
+    lines = [line for index, line in enumerate(lines) if index not in rejected]
+    if not rows:
+        return
+
+    try:
+        importer.insert(rows)
+        db.session.commit()
+        report.imported += len(rows)
+    except SQLAlchemyError:
+        # Something in the batch broke a database constraint: retry row by
+        # row so only the offending rows are rejected.
+        db.session.rollback()
+        for line, row in zip(lines, rows):
+            try:
+                importer.insert([row])
+                db.session.commit()
+                report.imported += 1
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                report.error(line, {'database': [str(e.orig if hasattr(e, 'orig') else e)]})
+    cache.invalidate(*importer.affected_tags(rows))
+
+
+def run(kind, stream, format='csv', batch_size=IMPORT_BATCH_SIZE, progress=None):
+    # Streams records from `stream` into the `kind` table in batches of
+    # `batch_size`. Invalid rows are reported and skipped, never abort the
+    # import. Core inserts bypass the ORM events, so the search index of the
+    # model is rebuilt on next use, and new venues or artists get their
+    # matches from a rebuild job.
+    importer = IMPORTERS[kind]()
+    records = READERS[format](stream)
+    report = Report()
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        _load(importer, batch, report)
+        if progress is not None:
+            progress(report)
+    search.reset(importer.model)
+    if importer.model is not Show and report.imported:
+        jobs.enqueue('rebuild_matches')
+        db.session.commit()
+    return report
+
+
+#----------------------------------------------------------------------------#
+# Command line.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'format', type=click.Choice(sorted(READERS)),
+              help='Input format; guessed from the file extension by default.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True)
+def import_command(kind, path, format, batch_size):
+    """Bulk load venues, artists or shows from a CSV or NDJSON file."""
+    if format is None:
+        format = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+    def progress(report):
+        click.echo('%d rows read, %d imported, %d failed, %.0f rows/s' % (
+            report.read, report.imported, report.failed, report.rows_per_second), err=True)
+
+    if path == '-':
+        report = run(kind, sys.stdin, format=format, batch_size=batch_size, progress=progress)
+    else:
+        with io.open(path, encoding='utf-8', newline='') as stream:
+            report = run(kind, stream, format=format, batch_size=batch_size, progress=progress)
+    for error in report.errors:
+        click.echo('line %d: %s' % (error['line'], json.dumps(error['errors'])))
+    click.echo('Imported %d of %d %s (%d failed) at %.0f rows/s' % (
+        report.imported, report.read, kind, report.failed, report.rows_per_second))
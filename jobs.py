@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask import g, has_request_context
+from sqlalchemy import and_, func, or_, select
+
+from setup import app, db
+from models import job
+
+# Attempts before a job is marked failed, and the delay before the first
+# retry, doubled after each further failure.
+app.config.setdefault('JOB_MAX_ATTEMPTS', 5)
+app.config.setdefault('JOB_RETRY_DELAY', 10)
+# Seconds a worker may hold a job before another worker takes it over,
+# e.g. after the first one was killed.
+app.config.setdefault('JOB_LEASE', 600)
+# Seconds an idle worker waits before looking for jobs again.
+app.config.setdefault('JOB_POLL_INTERVAL', 1.0)
+# Run the jobs a request queued at the end of that request, for development
+# without a worker.
+app.config.setdefault('JOBS_EAGER', False)
+
+logger = logging.getLogger('fyyur.jobs')
+
+HANDLERS = {}
+
+
+def handler(kind):
+    # Registers the decorated function to run jobs of `kind`. It gets the
+    # job's payload as keyword arguments, runs in its own session and
+    # commits its own work. Jobs can run more than once, so handlers must
+    # be idempotent.
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+#----------------------------------------------------------------------------#
+# Queueing.
+#----------------------------------------------------------------------------#
+
+def enqueue(kind, bind=None, delay=0, coalesce=False, **payload):
+    # Queues a job in the current transaction of `bind` (the session by
+    # default), so it only runs if that transaction commits. With
+    # `coalesce`, a job of the same kind and payload that no worker has
+    # tried yet is reused instead; locking its row keeps workers from
+    # claiming it before this transaction commits.
+    if kind not in HANDLERS:
+        raise LookupError('No handler for %r jobs' % kind)
+    bind = bind if bind is not None else db.session
+    payload = json.dumps(payload, sort_keys=True)
+    id = None
+    if coalesce:
+        id = bind.execute(select([job.c.id]).
+                          where(and_(job.c.kind == kind, job.c.payload == payload,
+                                     job.c.status == 'queued', job.c.attempts == 0)).
+                          order_by(job.c.id).limit(1).with_for_update(skip_locked=True)).scalar()
+    if id is None:
+        result = bind.execute(job.insert().values(
+            kind=kind,
+            payload=payload,
+            status='queued',
+            max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+            run_at=datetime.utcnow() + timedelta(seconds=delay),
+        ))
+        id = result.inserted_primary_key[0]
+    if has_request_context():
+        g.setdefault('job_ids', []).append(id)
+    return id
+
+
+#----------------------------------------------------------------------------#
+# Running.
+#----------------------------------------------------------------------------#
+
+def _due(now):
+    expired = now - timedelta(seconds=app.config['JOB_LEASE'])
+    return and_(job.c.attempts < job.c.max_attempts,
+                or_(and_(job.c.status == 'queued', job.c.run_at <= now),
+                    and_(job.c.status == 'running', job.c.locked_at < expired)))
+
+
+def claim(worker, id=None):
+    # Marks the next due job (or job `id`, if due) as running for `worker`
+    # and returns it, or None. SKIP LOCKED keeps PostgreSQL workers off
+    # each other's rows; elsewhere the guarded UPDATE decides who wins.
+    now = datetime.utcnow()
+    query = select([job]).where(_due(now))
+    if id is not None:
+        query = query.where(job.c.id == id)
+    query = query.order_by(job.c.run_at, job.c.id).limit(1).with_for_update(skip_locked=True)
+    with db.engine.begin() as connection:
+        row = connection.execute(query).first()
+        if row is None:
+            return None
+        claimed = connection.execute(job.update().
+                                     where(and_(job.c.id == row.id,
+                                                job.c.status == row.status,
+                                                job.c.attempts == row.attempts)).
+                                     values(status='running', locked_by=worker, locked_at=now,
+                                            attempts=row.attempts + 1)).rowcount
+    if not claimed:
+        return None
+    row = dict(row)
+    row['attempts'] += 1
+    return row
+
+
+def _retry_at(attempts):
+    return datetime.utcnow() + timedelta(seconds=app.config['JOB_RETRY_DELAY'] * 2 ** (attempts - 1))
+
+
+def run(row):
+    # Runs a claimed job. Finished jobs are deleted; failed ones are queued
+    # again after a backoff until they run out of attempts.
+    try:
+        if row['kind'] not in HANDLERS:
+            raise LookupError('No handler for %r jobs' % row['kind'])
+        HANDLERS[row['kind']](**json.loads(row['payload']))
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc()
+        failed = row['attempts'] >= row['max_attempts']
+        logger.warning('Job %d (%s) failed, attempt %d of %d%s', row['id'], row['kind'], row['attempts'],
+                       row['max_attempts'], '' if failed else ', will retry', exc_info=True)
+        with db.engine.begin() as connection:
+            connection.execute(job.update().where(job.c.id == row['id']).values(
+                status='failed' if failed else 'queued',
+                run_at=row['run_at'] if failed else _retry_at(row['attempts']),
+                locked_by=None,
+                locked_at=None,
+                last_error=error,
+            ))
+        return False
+    finally:
+        db.session.remove()
+    with db.engine.begin() as connection:
+        connection.execute(job.delete().where(job.c.id == row['id']))
+    return True
+
+
+def _expire():
+    # Running jobs whose worker died on their last attempt.
+    expired = datetime.utcnow() - timedelta(seconds=app.config['JOB_LEASE'])
+    with db.engine.begin() as connection:
+        connection.execute(job.update().
+                           where(and_(job.c.status == 'running', job.c.locked_at < expired,
+                                      job.c.attempts >= job.c.max_attempts)).
+                           values(status='failed', last_error='Lease expired'))
+
+
+def work(worker=None, once=False):
+    # Runs jobs as they come due. With `once`, returns when none are left.
+    # Returns the number of jobs run.
+    worker = worker or '%s:%d' % (socket.gethostname(), os.getpid())
+    done = 0
+    while True:
+        row = claim(worker)
+        if row is None:
+            _expire()
+            if once:
+                return done
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
+            continue
+        run(row)
+        done += 1
+
+
+@app.after_request
+def _run_eager(response):
+    ids = g.pop('job_ids', None)
+    if ids and app.config['JOBS_EAGER']:
+        db.session.remove()
+        for id in ids:
+            row = claim('eager:%d' % os.getpid(), id=id)
+            if row is not None:
+                run(row)
+    return response
+
+
+#----------------------------------------------------------------------------#
+# Command line.
+#----------------------------------------------------------------------------#
+
+@app.cli.group('jobs')
+def jobs_command():
+    """Run and inspect background jobs."""
+
+
+@jobs_command.command('work')
+@click.option('--once', is_flag=True, help='Exit when no jobs are due.')
+def work_command(once):
+    """Run queued jobs."""
+    logging.basicConfig(level=logging.INFO)
+    done = work(once=once)
+    click.echo('Ran %d jobs' % done)
+
+
+@jobs_command.command('status')
+def status_command():
+    """Count jobs by kind and status."""
+    rows = db.session.query(job.c.kind, job.c.status, func.count()).\
+        group_by(job.c.kind, job.c.status).\
+        order_by(job.c.kind, job.c.status)
+    for kind, status, count in rows:
+        click.echo('%-20s %-8s %d' % (kind, status, count))
+
+
+@jobs_command.command('retry')
+@click.option('--kind', default=None, help='Only jobs of this kind.')
+def retry_command(kind):
+    """Queue failed jobs again."""
+    update = job.update().where(job.c.status == 'failed')
+    if kind:
+        update = update.where(job.c.kind == kind)
+    with db.engine.begin() as connection:
+        count = connection.execute(update.values(status='queued', attempts=0, run_at=datetime.utcnow(),
+                                                 locked_by=None, locked_at=None)).rowcount
+    click.echo('Queued %d failed jobs again' % count)
@@ -0,0 +1,533 @@
+from datetime import datetime
+
+import click
+import numpy as np
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from setup import app, db
+from models import Venue, Artist, Show, Genre, genre_link, match_link
+import cache
+import jobs
+
+# Matches kept per venue and per artist.
+app.config.setdefault('MATCH_TOP_K', 10)
+
+# Weights of the parts of a match score, each part between 0 and 1: genres
+# the pair shares, how well the candidate's genres fit the acts or venues
+# the owner played with before, shows the pair already played together,
+# and the same city (half for the same state only).
+WEIGHTS = {'genres': 0.5, 'history': 0.2, 'together': 0.1, 'place': 0.2}
+# Shows together that earn the whole 'together' weight.
+TOGETHER_CAP = 3
+# Scores computed at once (owners x candidates), bounding memory.
+CHUNK_CELLS = 1 << 22
+
+SEEKING = {Venue: 'seeking_talent', Artist: 'seeking_venue'}
+# Attributes that change scores; the names shown next to a match do not.
+SCORED = ('city', 'state', 'seeking_talent', 'seeking_venue', 'deleted_at')
+
+
+def _other(model):
+    return Artist if model is Venue else Venue
+
+
+#----------------------------------------------------------------------------#
+# Features.
+#----------------------------------------------------------------------------#
+# Every venue and artist becomes a row of a few arrays: its genres as a
+# unit vector, the genres of whom it played with as another, and codes for
+# its city and state. Genre links are sparse (id, genre) pairs, scattered
+# into dense rows; there are few genres, so one matrix product then scores
+# a block of owners against every candidate. A rebuild loads every row; a
+# refresh only the candidates and the owners it scores.
+
+def _positions(ids, values):
+    # Positions of `values` in the sorted array `ids`, and which are there.
+    if not len(ids):
+        return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(ids, values), len(ids) - 1)
+    return positions, ids[positions] == values
+
+
+def _normalized(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+class Side(object):
+    # The features of some venues or artists: `rows` are their (id, city,
+    # state, seeking) ordered by id, `links` their (id, genre id) pairs.
+    # `history` is only filled in for the rows marked `prepared`.
+
+    def __init__(self, model, rows, links, genre_ids, places):
+        self.model = model
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.seeking = np.array([bool(row[3]) for row in rows], dtype=bool)
+        self.city = np.array([places.setdefault(_place(row[2], row[1]), len(places)) if row[1] else -1
+                              for row in rows], dtype=np.int64)
+        self.state = np.array([places.setdefault(_place(row[2]), len(places)) if row[2] else -1
+                               for row in rows], dtype=np.int64)
+
+        positions, found = _positions(self.ids, links[:, 0])
+        genres = np.zeros((len(self.ids), len(genre_ids)), dtype=np.float32)
+        genres[positions[found], np.searchsorted(genre_ids, links[found, 1])] = 1
+        self.genres = _normalized(genres)
+        self.history = np.zeros_like(genres)
+        self.prepared = np.zeros(len(self.ids), dtype=bool)
+
+    def merge(self, other):
+        # Adds the rows of `other`, of the same model, that are not here yet.
+        new = ~np.isin(other.ids, self.ids)
+        order = np.argsort(np.concatenate([self.ids, other.ids[new]]), kind='stable')
+        for name in ('ids', 'seeking', 'city', 'state', 'genres', 'history', 'prepared'):
+            setattr(self, name, np.concatenate([getattr(self, name), getattr(other, name)[new]])[order])
+
+    def rows(self, ids):
+        # Sorted positions of the seeking entities among `ids`.
+        positions, found = _positions(self.ids, np.array(sorted(set(ids)), dtype=np.int64))
+        positions = positions[found]
+        return positions[self.seeking[positions]]
+
+
+def _side(model, genre_ids, places, condition=None):
+    # The Side of the `model` entities that are not deleted, all of them
+    # or those matching `condition`.
+    query = db.session.query(model.id, model.city, model.state, getattr(model, SEEKING[model]))
+    table, fk = genre_link(model)
+    links = select([fk, table.c.genre_id])
+    if condition is not None:
+        query = query.filter(condition)
+        links = links.where(fk.in_(select([model.id]).where(condition)))
+    links = np.array([tuple(row) for row in db.session.execute(links)], dtype=np.int64).reshape(-1, 2)
+    return Side(model, query.order_by(model.id).all(), links, genre_ids, places)
+
+
+def _place(state, city=None):
+    return ((state or '').strip().lower(), (city or '').strip().lower())
+
+
+def _show_columns(model):
+    show = Show.__table__
+    return (show.c.venue_id, show.c.artist_id) if model is Venue else (show.c.artist_id, show.c.venue_id)
+
+
+def _batches(ids, size=500):
+    ids = sorted(set(int(id) for id in ids))
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+class Features(object):
+    # Both sides, and the shows each venue and artist played together, for
+    # everything at once (a rebuild) or, with `everything=False`, loaded
+    # as a refresh needs them: the seeking candidates of a side once its
+    # lists are scored, and the owners being scored with whom they played.
+
+    def __init__(self, everything=True):
+        self.everything = everything
+        self.genre_ids = np.array([id for id, in db.session.query(Genre.id).order_by(Genre.id)], dtype=np.int64)
+        self.places = {}
+        # Per model, (owner ids, candidate ids, 'together' part) sorted by owner.
+        empty = np.zeros(0, dtype=np.int64)
+        self.together = {model: (empty, empty, np.zeros(0, dtype=np.float32)) for model in (Venue, Artist)}
+        if not everything:
+            links = np.zeros((0, 2), dtype=np.int64)
+            self.sides = {model: Side(model, [], links, self.genre_ids, self.places) for model in (Venue, Artist)}
+            self.requested = {Venue: set(), Artist: set()}
+            self.seeking_loaded = set()
+            return
+        self.sides = {model: _side(model, self.genre_ids, self.places) for model in (Venue, Artist)}
+        show = Show.__table__
+        pairs = np.array([tuple(row) for row in db.session.execute(
+            select([show.c.venue_id, show.c.artist_id, func.count()]).
+            group_by(show.c.venue_id, show.c.artist_id))], dtype=np.int64).reshape(-1, 3)
+        self._add_pairs(Venue, pairs)
+        self._add_pairs(Artist, pairs[:, [1, 0, 2]])
+        for side in self.sides.values():
+            side.prepared[:] = True
+
+    def load(self, model, ids=None):
+        # Loads the `model` entities in `ids`, or all that are seeking,
+        # unless they are already.
+        if self.everything:
+            return
+        side = self.sides[model]
+        if ids is None:
+            if model not in self.seeking_loaded:
+                self.seeking_loaded.add(model)
+                side.merge(_side(model, self.genre_ids, self.places, getattr(model, SEEKING[model]).is_(True)))
+            return
+        # Deleted entities are not loaded, so remember what was asked for.
+        missing = {int(id) for id in ids} - self.requested[model]
+        self.requested[model] |= missing
+        missing.difference_update(side.ids.tolist())
+        for batch in _batches(missing):
+            side.merge(_side(model, self.genre_ids, self.places, model.id.in_(batch)))
+
+    def prepare(self, model, ids):
+        # Loads the `model` entities in `ids` and the shows they played, so
+        # they can be scored as owners: their history, and their shows
+        # with each candidate.
+        self.load(model, ids)
+        side = self.sides[model]
+        positions, found = _positions(side.ids, np.array(sorted(set(ids)), dtype=np.int64))
+        positions = positions[found]
+        todo = side.ids[positions[~side.prepared[positions]]]
+        if not len(todo):
+            return
+        fk, other_fk = _show_columns(model)
+        pairs = []
+        for batch in _batches(todo):
+            pairs.extend(tuple(row) for row in db.session.execute(
+                select([fk, other_fk, func.count()]).where(fk.in_(batch)).group_by(fk, other_fk)))
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 3)
+        self.load(_other(model), pairs[:, 1])
+        self._add_pairs(model, pairs)
+        side.prepared[np.searchsorted(side.ids, todo)] = True
+
+    def _add_pairs(self, model, pairs):
+        # `pairs` holds (owner id, candidate id, shows) for every show of
+        # its owners, which are `model` entities.
+        owner, other = self.sides[model], self.sides[_other(model)]
+        owner_rows, owner_found = _positions(owner.ids, pairs[:, 0])
+        other_rows, other_found = _positions(other.ids, pairs[:, 1])
+        found = owner_found & other_found
+        pairs, owner_rows, other_rows = pairs[found], owner_rows[found], other_rows[found]
+
+        # What each owner played with, weighted by the number of shows,
+        # summed in double precision so the order of the pairs is moot.
+        rows, index = np.unique(owner_rows, return_inverse=True)
+        history = np.zeros((len(rows), len(self.genre_ids)), dtype=np.float64)
+        weights = pairs[:, 2].astype(np.float64)[:, None]
+        for start in range(0, len(pairs), 100000):
+            part = slice(start, start + 100000)
+            np.add.at(history, index[part], weights[part] * other.genres[other_rows[part]])
+        owner.history[rows] = _normalized(history)
+
+        # The pairs, by owner, so a block of owners finds its own quickly.
+        owners, candidates, together = self.together[model]
+        owners = np.concatenate([owners, pairs[:, 0]])
+        candidates = np.concatenate([candidates, pairs[:, 1]])
+        together = np.concatenate([together, np.minimum(pairs[:, 2], TOGETHER_CAP).astype(np.float32) / TOGETHER_CAP])
+        order = np.argsort(owners, kind='stable')
+        self.together[model] = owners[order], candidates[order], together[order]
+
+    def candidates(self, model):
+        # Positions of the seeking entities on the other side of `model`.
+        self.load(_other(model))
+        return np.flatnonzero(self.sides[_other(model)].seeking)
+
+    def _places(self, model, rows, columns):
+        owner, other = self.sides[model], self.sides[_other(model)]
+        city, state = owner.city[rows][:, None], owner.state[rows][:, None]
+        same_city = (city == other.city[columns]) & (city >= 0)
+        same_state = (state == other.state[columns]) & (state >= 0)
+        return WEIGHTS['place'] * np.where(same_city, 1.0, np.where(same_state, 0.5, 0.0)).astype(np.float32)
+
+    def scores(self, model, rows, columns):
+        # Scores of the prepared `model` entities at sorted positions
+        # `rows` against the candidates at sorted positions `columns`, as a
+        # len(rows) x len(columns) array.
+        owner, other = self.sides[model], self.sides[_other(model)]
+        profile = WEIGHTS['genres'] * owner.genres[rows] + WEIGHTS['history'] * owner.history[rows]
+        scores = profile @ other.genres[columns].T
+        scores += self._places(model, rows, columns)
+
+        owners, candidates, together = self.together[model]
+        owner_ids, candidate_ids = owner.ids[rows], other.ids[columns]
+        if len(rows):
+            span = slice(np.searchsorted(owners, owner_ids[0]), np.searchsorted(owners, owner_ids[-1], 'right'))
+            owners, candidates, together = owners[span], candidates[span], together[span]
+        hit = np.isin(owners, owner_ids) & np.isin(candidates, candidate_ids)
+        scores[np.searchsorted(owner_ids, owners[hit]), np.searchsorted(candidate_ids, candidates[hit])] += \
+            WEIGHTS['together'] * together[hit]
+        return scores
+
+    def bounds(self, model, rows, columns):
+        # Upper bounds of scores() that need no history: the history part
+        # at its most wherever the candidate has genres, both vectors
+        # being non-negative unit vectors. Shows together are left out.
+        owner, other = self.sides[model], self.sides[_other(model)]
+        scores = (WEIGHTS['genres'] * owner.genres[rows]) @ other.genres[columns].T
+        scores += WEIGHTS['history'] * other.genres[columns].any(axis=1).astype(np.float32)
+        scores += self._places(model, rows, columns)
+        return scores
+
+    def chunks(self, model, rows, columns, score=None):
+        # (rows, scores) for consecutive blocks of `rows`, by `score`
+        # (scores() by default).
+        score = score or self.scores
+        size = max(1, CHUNK_CELLS // max(1, len(columns)))
+        for start in range(0, len(rows), size):
+            block = rows[start:start + size]
+            yield block, score(model, block, columns)
+
+
+#----------------------------------------------------------------------------#
+# Top matches.
+#----------------------------------------------------------------------------#
+
+def _top(scores, k):
+    # Columns and scores of the k best scores of each row, best first. Of
+    # equal scores the lower columns, i.e. ids, win. Scores are rounded
+    # first: the last bits of a matrix product depend on the block shape,
+    # and the same list must come out of a rebuild and of a refresh.
+    k = min(k, scores.shape[1])
+    if not k:
+        empty = np.zeros((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    scores = np.round(scores.astype(np.float64), 6)
+    # Below the rounding, so ties break by column without reordering the rest.
+    keys = scores - np.arange(scores.shape[1]) * (1e-7 / scores.shape[1])
+    best = np.argpartition(-keys, k - 1, axis=1)[:, :k]
+    best = np.take_along_axis(best, np.argsort(-np.take_along_axis(keys, best, axis=1), axis=1), axis=1)
+    return best, np.take_along_axis(scores, best, axis=1)
+
+
+def _lists(features, model, rows, now):
+    # Match table rows for the `model` entities at positions `rows`.
+    owner, other = features.sides[model], features.sides[_other(model)]
+    _, owner_fk, candidate_fk = match_link(model)
+    columns = features.candidates(model)
+    for block, scores in features.chunks(model, rows, columns):
+        best, best_scores = _top(scores, app.config['MATCH_TOP_K'])
+        for row, picks, values in zip(block, best, best_scores):
+            for rank, (pick, score) in enumerate(zip(picks, values), 1):
+                if score <= 0:
+                    break
+                yield {owner_fk.name: int(owner.ids[row]), 'rank': rank,
+                       candidate_fk.name: int(other.ids[columns[pick]]), 'score': float(score), 'updated_at': now}
+
+
+def _store(connection, features, model, ids):
+    # Replaces the lists of the `model` entities in `ids`; those that are
+    # deleted or not seeking are left without one.
+    table, owner_fk, _ = match_link(model)
+    now = datetime.utcnow()
+    for batch in _batches(ids):
+        connection.execute(table.delete().where(owner_fk.in_(batch)))
+        features.prepare(model, batch)
+        rows = list(_lists(features, model, features.sides[model].rows(batch), now))
+        if rows:
+            connection.execute(table.insert(), rows)
+
+
+def _displaced(connection, features, model, ids):
+    # Entities on the other side whose lists may change with the `model`
+    # entities in `ids`: those listing one of them, and those where one of
+    # them now scores at least as high as the last match (lower ids win
+    # ties), or positive in a list that is not full. Upper bounds rule out
+    # most owners first, so only the rest need their history loaded.
+    other = _other(model)
+    table, owner_fk, candidate_fk = match_link(other)
+    owners = {id for id, in connection.execute(select([owner_fk]).where(candidate_fk.in_(ids)).distinct())}
+
+    features.prepare(model, ids)
+    rows = features.candidates(model)
+    columns = features.sides[model].rows(ids)
+    side = features.sides[other]
+    if not len(columns) or not len(rows):
+        return owners
+    # Scores are stored rounded to 6 digits.
+    threshold = np.full(len(side.ids), 1e-6, dtype=np.float32)
+    full = connection.execute(select([owner_fk, func.min(table.c.score)]).
+                              group_by(owner_fk).
+                              having(func.count() >= app.config['MATCH_TOP_K'])).fetchall()
+    if full:
+        positions, found = _positions(side.ids, np.array([row[0] for row in full], dtype=np.int64))
+        threshold[positions[found]] = np.array([row[1] for row in full], dtype=np.float32)[found] - 1e-6
+
+    # The bounds leave out shows together, which the `model` entities,
+    # prepared above, know from their side.
+    column_ids = features.sides[model].ids[columns]
+    players, partners, together = features.together[model]
+    played = np.isin(players, column_ids) & np.isin(partners, side.ids[rows])
+    players, partners, together = players[played], partners[played], together[played]
+    maybe = []
+    for block, bounds in features.chunks(other, rows, columns, score=features.bounds):
+        hit = np.isin(partners, side.ids[block])
+        bounds[np.searchsorted(side.ids[block], partners[hit]), np.searchsorted(column_ids, players[hit])] += \
+            WEIGHTS['together'] * together[hit]
+        maybe.append(block[(bounds + 1e-6 >= threshold[block][:, None]).any(axis=1)])
+    maybe = np.concatenate(maybe)
+
+    # Preparing them loads only `model` entities, so `rows` and
+    # `threshold` keep their positions.
+    features.prepare(other, side.ids[maybe])
+    columns = features.sides[model].rows(ids)
+    for block, scores in features.chunks(other, maybe, columns):
+        entered = (scores >= threshold[block][:, None]).any(axis=1)
+        owners.update(int(id) for id in side.ids[block[entered]])
+    return owners
+
+
+def _partners(connection, model, ids):
+    # Ids of the entities that share shows with the `model` entities in `ids`.
+    fk, other_fk = _show_columns(model)
+    return {id for id, in connection.execute(select([other_fk]).where(fk.in_(ids)).distinct())}
+
+
+def refresh(connection, venues=(), artists=(), venue_partners=(), artist_partners=(),
+            venue_shows=(), artist_shows=()):
+    # Recomputes the lists of the given venues and artists, and of the
+    # entities whose lists they join or leave. The partners of
+    # `venue_partners` and `artist_partners`, whose history changed with
+    # them, are recomputed too, and so are `venue_shows` and
+    # `artist_shows`, whose own shows changed: that only moves their
+    # history and shows together, which count in no one else's list.
+    # Returns the recomputed ids per model.
+    changed = {Venue: sorted(set(venues)), Artist: sorted(set(artists))}
+    partners = {Venue: sorted(set(venue_partners)), Artist: sorted(set(artist_partners))}
+    features = Features(everything=False)
+    recomputed = {Venue: set(venues) | set(venue_shows), Artist: set(artists) | set(artist_shows)}
+    for model, ids in changed.items():
+        if ids:
+            recomputed[_other(model)] |= _displaced(connection, features, model, ids)
+    for model, ids in partners.items():
+        if ids:
+            recomputed[_other(model)] |= _partners(connection, model, ids)
+    for model, ids in recomputed.items():
+        _store(connection, features, model, ids)
+    return recomputed
+
+
+def rebuild(connection):
+    # Recomputes every list, e.g. after a bulk load.
+    features = Features()
+    now = datetime.utcnow()
+    for model in (Venue, Artist):
+        table = match_link(model)[0]
+        connection.execute(table.delete())
+        side = features.sides[model]
+        rows = []
+        for row in _lists(features, model, np.flatnonzero(side.seeking), now):
+            rows.append(row)
+            if len(rows) == 10000:
+                connection.execute(table.insert(), rows)
+                rows = []
+        if rows:
+            connection.execute(table.insert(), rows)
+
+
+def suggestions(model, entity_id):
+    # The artists matched to a venue, or the venues matched to an artist,
+    # best first.
+    table, owner_fk, candidate_fk = match_link(model)
+    other = _other(model)
+    prefix = other.__tablename__
+    rows = db.session.query(other.id, other.name, other.image_link, other.city, other.state).\
+        join(table, candidate_fk == other.id).\
+        filter(owner_fk == entity_id).\
+        order_by(table.c.rank)
+    return [{
+        prefix + "_id": row.id,
+        prefix + "_name": row.name,
+        prefix + "_image_link": row.image_link,
+        "city": row.city,
+        "state": row.state,
+    } for row in rows]
+
+
+#----------------------------------------------------------------------------#
+# Keeping up with changes.
+#----------------------------------------------------------------------------#
+# Venues and artists whose scores may have changed are recorded during the
+# flush and recomputed by a job queued once per flush. Changing the genres
+# of an entity, or deleting it, also changes the history of whom it played
+# with, seeking or not, so their lists are recomputed as well. A show only
+# changes the lists of its own venue and artist, and the job for it is
+# shared with any other still waiting to run for the same pair.
+
+def _record(target, ids):
+    # `ids` holds (model, id, what changed): 'entity' what it scores as a
+    # candidate, 'genres' that and the history of whom it played with,
+    # 'shows' only its own history and shows together.
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('match_changes', set()).update(ids)
+
+
+def _on_entity_change(mapper, connection, target):
+    model = type(target)
+    state = inspect(target)
+    if state.attrs.genre_objects.history.has_changes() or state.attrs.deleted_at.history.has_changes():
+        _record(target, [(model, target.id, 'genres')])
+    elif getattr(target, SEEKING[model]) or any(state.attrs[SEEKING[model]].history.deleted):
+        if any(state.attrs[name].history.has_changes() for name in SCORED if name in state.attrs):
+            _record(target, [(model, target.id, 'entity')])
+
+
+def _on_show_change(mapper, connection, target):
+    state = inspect(target)
+    ids = [(Venue, id, 'shows') for id in [target.venue_id] + list(state.attrs.venue_id.history.deleted)]
+    ids += [(Artist, id, 'shows') for id in [target.artist_id] + list(state.attrs.artist_id.history.deleted)]
+    _record(target, ids)
+
+
+def _on_show_update(mapper, connection, target):
+    # Moving a show in time scores the same.
+    state = inspect(target)
+    if state.attrs.venue_id.history.has_changes() or state.attrs.artist_id.history.has_changes():
+        _on_show_change(mapper, connection, target)
+
+
+for _model in (Venue, Artist):
+    event.listen(_model, 'after_insert', _on_entity_change)
+    event.listen(_model, 'after_update', _on_entity_change)
+event.listen(Show, 'after_insert', _on_show_change)
+event.listen(Show, 'after_update', _on_show_update)
+event.listen(Show, 'after_delete', _on_show_change)
+
+
+@jobs.handler('refresh_matches')
+def refresh_job(venues=(), artists=(), venue_partners=(), artist_partners=(), venue_shows=(), artist_shows=()):
+    recomputed = refresh(db.session.connection(), venues, artists, venue_partners, artist_partners,
+                         venue_shows, artist_shows)
+    db.session.commit()
+    cache.invalidate(*['%s:%d' % (model.__tablename__, id) for model, ids in recomputed.items() for id in ids])
+
+
+@jobs.handler('rebuild_matches')
+def rebuild_job():
+    rebuild(db.session.connection())
+    db.session.commit()
+    cache.invalidate('matches')
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_changes(session, flush_context):
+    changed = session.info.pop('match_changes', None)
+    if not changed:
+        return
+
+    def ids(model, *kinds):
+        return sorted({id for owner, id, kind in changed if owner is model and kind in kinds and id is not None})
+
+    jobs.enqueue('refresh_matches', bind=session.connection(), coalesce=True,
+                 venues=ids(Venue, 'entity', 'genres'), artists=ids(Artist, 'entity', 'genres'),
+                 venue_partners=ids(Venue, 'genres'), artist_partners=ids(Artist, 'genres'),
+                 venue_shows=ids(Venue, 'shows'), artist_shows=ids(Artist, 'shows'))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('match_changes', None)
+
+
+#----------------------------------------------------------------------------#
+# Command line.
+#----------------------------------------------------------------------------#
+
+@app.cli.group('matches')
+def matches_command():
+    """Maintain the suggested venues and artists."""
+
+
+@matches_command.command('rebuild')
+def rebuild_command():
+    """Recompute every venue's and artist's matches."""
+    with db.engine.begin() as connection:
+        rebuild(connection)
+    cache.invalidate('matches')
+    click.echo('Rebuilt venue and artist matches')
@@ -0,0 +1,58 @@
+"""per-venue and per-artist show statistics
+
+Revision ID: 3b9f6d2a8c41
+Revises: e4b8a1f05c37
+Create Date: 2026-10-18 21:05:12.448203
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9f6d2a8c41'
+down_revision = 'e4b8a1f05c37'
+branch_labels = None
+depends_on = None
+
+show = sa.table('show', sa.column('id', sa.Integer), sa.column('start_time', sa.DateTime),
+                sa.column('venue_id', sa.Integer), sa.column('artist_id', sa.Integer))
+
+
+def upgrade():
+    # Start times are stored in local time, like datetime.now().
+    now = datetime.now()
+    for entity in ('venue', 'artist'):
+        table = op.create_table(
+            '%s_stats' % entity,
+            sa.Column('%s_id' % entity, sa.Integer(), nullable=False),
+            sa.Column('upcoming_shows_count', sa.Integer(), nullable=False),
+            sa.Column('past_shows_count', sa.Integer(), nullable=False),
+            sa.Column('next_show_time', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['%s_id' % entity], ['%s.id' % entity], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('%s_id' % entity)
+        )
+        op.create_index(op.f('ix_%s_stats_next_show_time' % entity), '%s_stats' % entity,
+                        ['next_show_time'], unique=False)
+        op.create_index(op.f('ix_%s_stats_updated_at' % entity), '%s_stats' % entity,
+                        ['updated_at'], unique=False)
+
+        fk = show.c['%s_id' % entity]
+        upcoming = show.c.start_time >= now
+        op.execute(table.insert().from_select([column.name for column in table.columns], sa.select([
+            fk,
+            sa.func.count(sa.case([(upcoming, show.c.id)])),
+            sa.func.count(sa.case([(show.c.start_time < now, show.c.id)])),
+            sa.func.min(sa.case([(upcoming, show.c.start_time)])),
+            sa.literal(datetime.utcnow(), sa.DateTime),
+        ]).group_by(fk)))
+
+
+def downgrade():
+    for entity in ('artist', 'venue'):
+        op.drop_index(op.f('ix_%s_stats_updated_at' % entity), table_name='%s_stats' % entity)
+        op.drop_index(op.f('ix_%s_stats_next_show_time' % entity), table_name='%s_stats' % entity)
+        op.drop_table('%s_stats' % entity)
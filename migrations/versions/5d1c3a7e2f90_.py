@@ -0,0 +1,49 @@
+"""full-text and trigram search indexes
+
+Revision ID: 5d1c3a7e2f90
+Revises: 2b33dd16db78
+Create Date: 2026-10-18 18:20:11.204517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1c3a7e2f90'
+down_revision = '2b33dd16db78'
+branch_labels = None
+depends_on = None
+
+# Only PostgreSQL gets the indexed search; other databases use the
+# in-process n-gram index in search.py and need no schema changes.
+SEARCH_COLUMNS = {
+    'venue': ('name', 'city', 'state', 'genres'),
+    'artist': ('name', 'city', 'state', 'genres'),
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, columns in SEARCH_COLUMNS.items():
+        document = " || ' ' || ".join("coalesce(%s, '')" % column for column in columns)
+        op.execute('ALTER TABLE %s ADD COLUMN search_vector tsvector' % table)
+        op.execute("UPDATE %s SET search_vector = to_tsvector('simple', %s)" % (table, document))
+        op.execute(
+            'CREATE TRIGGER {0}_search_vector_update BEFORE INSERT OR UPDATE ON {0} '
+            "FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(search_vector, 'pg_catalog.simple', {1})"
+            .format(table, ', '.join(columns)))
+        op.execute('CREATE INDEX ix_{0}_search_vector ON {0} USING gin (search_vector)'.format(table))
+        op.execute('CREATE INDEX ix_{0}_name_trgm ON {0} USING gin (name gin_trgm_ops)'.format(table))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in SEARCH_COLUMNS:
+        op.execute('DROP INDEX IF EXISTS ix_%s_name_trgm' % table)
+        op.execute('DROP INDEX IF EXISTS ix_%s_search_vector' % table)
+        op.execute('DROP TRIGGER IF EXISTS {0}_search_vector_update ON {0}'.format(table))
+        op.drop_column(table, 'search_vector')
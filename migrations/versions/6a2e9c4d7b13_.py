@@ -0,0 +1,70 @@
+"""show durations and overlap constraints
+
+Revision ID: 6a2e9c4d7b13
+Revises: 3b9f6d2a8c41
+Create Date: 2026-10-18 22:10:41.902118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a2e9c4d7b13'
+down_revision = '3b9f6d2a8c41'
+branch_labels = None
+depends_on = None
+
+DEFAULT_SHOW_MINUTES = 120
+
+OVERLAP_CONSTRAINTS = {
+    'show_venue_id_no_overlap': 'venue_id',
+    'show_artist_id_no_overlap': 'artist_id',
+}
+
+# Whole minutes from start_time to next_start, floored.
+MINUTES_BETWEEN = {
+    'postgresql': 'floor(extract(epoch FROM next_start - start_time) / 60)',
+    'sqlite': "(strftime('%s', next_start) - strftime('%s', start_time)) / 60",
+}
+
+# Existing shows had no length. Each gets DEFAULT_SHOW_MINUTES, cut short
+# where the next show of its venue or artist starts earlier, so the old data
+# satisfies the overlap constraints. Shows starting at the same time as
+# another get 0 minutes, an empty booking. One statement per side.
+CLIP_DURATIONS = """
+UPDATE show SET duration_minutes = clipped.minutes
+FROM (SELECT id, {minutes} AS minutes
+      FROM (SELECT id, start_time,
+                   lead(start_time) OVER (PARTITION BY {column} ORDER BY start_time, id) AS next_start
+            FROM show WHERE start_time IS NOT NULL) AS ordered
+      WHERE next_start IS NOT NULL) AS clipped
+WHERE show.id = clipped.id AND clipped.minutes < show.duration_minutes
+"""
+
+
+def upgrade():
+    op.add_column('show', sa.Column('duration_minutes', sa.Integer(), nullable=False,
+                                    server_default=str(DEFAULT_SHOW_MINUTES)))
+
+    connection = op.get_bind()
+    minutes = MINUTES_BETWEEN.get(connection.dialect.name, MINUTES_BETWEEN['postgresql'])
+    for column in OVERLAP_CONSTRAINTS.values():
+        connection.execute(sa.text(CLIP_DURATIONS.format(minutes=minutes, column=column)))
+
+    if connection.dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        # Shows without a start time would book their venue and artist
+        # forever.
+        for name, column in OVERLAP_CONSTRAINTS.items():
+            op.execute('ALTER TABLE show ADD CONSTRAINT %s EXCLUDE USING gist '
+                       "(%s WITH =, tsrange(start_time, start_time + duration_minutes * interval '1 minute') WITH &&) "
+                       'WHERE (start_time IS NOT NULL)' % (name, column))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name in OVERLAP_CONSTRAINTS:
+            op.execute('ALTER TABLE show DROP CONSTRAINT %s' % name)
+    with op.batch_alter_table('show') as batch_op:
+        batch_op.drop_column('duration_minutes')
@@ -0,0 +1,35 @@
+"""venue coordinates and geohash index
+
+Revision ID: 8c5e1f3b9a27
+Revises: 6a2e9c4d7b13
+Create Date: 2026-10-18 23:02:17.531884
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c5e1f3b9a27'
+down_revision = '6a2e9c4d7b13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Venues are placed afterwards by `flask geo geocode`.
+    op.add_column('venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index(op.f('ix_venue_geohash'), 'venue', ['geohash'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_venue_geohash'), table_name='venue')
+    with op.batch_alter_table('venue') as batch_op:
+        batch_op.drop_column('geohash')
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
+    if op.get_bind().dialect.name == 'sqlite':
+        # Rebuilding the table lost its expression index.
+        op.create_index('ix_venue_lower_name', 'venue', [sa.text('lower(name)')], unique=False)
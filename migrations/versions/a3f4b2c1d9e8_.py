@@ -0,0 +1,34 @@
+"""indexes for the show, venue and artist lookups
+
+Revision ID: a3f4b2c1d9e8
+Revises: 5d1c3a7e2f90
+Create Date: 2026-10-18 18:41:37.918260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f4b2c1d9e8'
+down_revision = '5d1c3a7e2f90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_show_venue_id_start_time', 'show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_show_artist_id_start_time', 'show', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_show_start_time_id', 'show', ['start_time', 'id'], unique=False)
+    op.create_index('ix_venue_city_state_name', 'venue', ['city', 'state', 'name'], unique=False)
+    op.create_index('ix_venue_lower_name', 'venue', [sa.text('lower(name)')], unique=False)
+    op.create_index('ix_artist_lower_name', 'artist', [sa.text('lower(name)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artist_lower_name', table_name='artist')
+    op.drop_index('ix_venue_lower_name', table_name='venue')
+    op.drop_index('ix_venue_city_state_name', table_name='venue')
+    op.drop_index('ix_show_start_time_id', table_name='show')
+    op.drop_index('ix_show_artist_id_start_time', table_name='show')
+    op.drop_index('ix_show_venue_id_start_time', table_name='show')
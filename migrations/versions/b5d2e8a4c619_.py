@@ -0,0 +1,49 @@
+"""soft deletes and cascading show foreign keys
+
+Revision ID: b5d2e8a4c619
+Revises: d7a3c5e8f214
+Create Date: 2026-10-19 01:37:08.415296
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d2e8a4c619'
+down_revision = 'd7a3c5e8f214'
+branch_labels = None
+depends_on = None
+
+
+def _show_foreign_keys(ondelete):
+    # PostgreSQL named the constraints after the original, unnamed ones.
+    # SQLite does not enforce them, so it keeps its own.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in ('venue', 'artist'):
+        name = 'show_%s_id_fkey' % table
+        op.drop_constraint(name, 'show', type_='foreignkey')
+        op.create_foreign_key(name, 'show', table, ['%s_id' % table], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    for table in ('venue', 'artist'):
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        # Partial, over the deleted rows purges look for.
+        op.create_index(op.f('ix_%s_deleted_at' % table), table, ['deleted_at'], unique=False,
+                        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+                        sqlite_where=sa.text('deleted_at IS NOT NULL'))
+    _show_foreign_keys('CASCADE')
+
+
+def downgrade():
+    # Venues and artists that were only marked deleted come back.
+    _show_foreign_keys(None)
+    for table in ('artist', 'venue'):
+        op.drop_index(op.f('ix_%s_deleted_at' % table), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('deleted_at')
+        if op.get_bind().dialect.name == 'sqlite':
+            # Rebuilding the table lost its expression index.
+            op.create_index('ix_%s_lower_name' % table, table, [sa.text('lower(name)')], unique=False)
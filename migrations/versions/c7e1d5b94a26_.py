@@ -0,0 +1,42 @@
+"""modification timestamps and version counters
+
+Revision ID: c7e1d5b94a26
+Revises: a3f4b2c1d9e8
+Create Date: 2026-10-18 19:02:54.310774
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e1d5b94a26'
+down_revision = 'a3f4b2c1d9e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows get the migration time in UTC, as the models write it,
+    # and the column keeps no server default afterwards.
+    now = datetime.utcnow()
+    for table in ('venue', 'artist', 'show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False,
+                                       server_default='1'))
+        op.execute(sa.table(table, sa.column('updated_at', sa.DateTime)).update().values(updated_at=now))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+        if table != 'show' and op.get_bind().dialect.name == 'sqlite':
+            # Rebuilding the table lost its expression index.
+            op.create_index('ix_%s_lower_name' % table, table, [sa.text('lower(name)')], unique=False)
+        op.create_index(op.f('ix_%s_updated_at' % table), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('show', 'artist', 'venue'):
+        op.drop_index(op.f('ix_%s_updated_at' % table), table_name=table)
+        op.drop_column(table, 'version')
+        op.drop_column(table, 'updated_at')
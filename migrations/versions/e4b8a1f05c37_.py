@@ -0,0 +1,177 @@
+"""genre table with venue and artist association tables
+
+Revision ID: e4b8a1f05c37
+Revises: c7e1d5b94a26
+Create Date: 2026-10-18 20:14:37.582011
+
+"""
+import csv
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8a1f05c37'
+down_revision = 'c7e1d5b94a26'
+branch_labels = None
+depends_on = None
+
+DEFAULT_GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk',
+    'Funk', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz',
+    'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul',
+    'Other',
+]
+
+# The old columns were String(120).
+OLD_LENGTH = 120
+
+genre = sa.table('genre', sa.column('id', sa.Integer), sa.column('name', sa.String))
+
+
+def parse_genres(value):
+    # Reads what the forms used to store: a list written to a text column,
+    # which PostgreSQL keeps as an array literal ('{Jazz,"Rock n Roll"}'),
+    # or a plain comma separated string. A value cut off at the column
+    # length loses its last, truncated, element.
+    if not value:
+        return []
+    value = value.strip()
+    truncated = False
+    if value.startswith('{'):
+        truncated = not value.endswith('}') and len(value) >= OLD_LENGTH
+        value = value[1:-1] if value.endswith('}') else value[1:]
+    names = next(csv.reader([value], quotechar='"', escapechar='\\', skipinitialspace=True), [])
+    if truncated:
+        names = names[:-1]
+    return [name.strip() for name in names if name.strip()]
+
+
+def genres_literal(names):
+    def quote(name):
+        if any(c in name for c in ' ,"{}\\'):
+            return '"%s"' % name.replace('\\', '\\\\').replace('"', '\\"')
+        return name
+    return '{%s}' % ','.join(quote(name) for name in names)
+
+
+def _search_vector_functions(table):
+    # The search vector now takes the genres from the association table,
+    # and changes to that table refresh the vector of the row they touch.
+    return [
+        """
+        CREATE FUNCTION {0}_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := to_tsvector('simple',
+                coalesce(NEW.name, '') || ' ' || coalesce(NEW.city, '') || ' ' ||
+                coalesce(NEW.state, '') || ' ' || coalesce((
+                    SELECT string_agg(genre.name, ' ')
+                    FROM {0}_genre JOIN genre ON genre.id = {0}_genre.genre_id
+                    WHERE {0}_genre.{0}_id = NEW.id), ''));
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """.format(table),
+        """
+        CREATE FUNCTION {0}_genre_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                UPDATE {0} SET search_vector = NULL WHERE id = OLD.{0}_id;
+            ELSE
+                UPDATE {0} SET search_vector = NULL WHERE id = NEW.{0}_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """.format(table),
+        'DROP TRIGGER IF EXISTS {0}_search_vector_update ON {0}'.format(table),
+        'CREATE TRIGGER {0}_search_vector_update BEFORE INSERT OR UPDATE ON {0} '
+        'FOR EACH ROW EXECUTE PROCEDURE {0}_search_vector_update()'.format(table),
+        'CREATE TRIGGER {0}_genre_search_vector_update AFTER INSERT OR DELETE ON {0}_genre '
+        'FOR EACH ROW EXECUTE PROCEDURE {0}_genre_search_vector_update()'.format(table),
+    ]
+
+
+def _has_search_vector(table):
+    # Only PostgreSQL databases got the search_vector column (5d1c3a7e2f90).
+    bind = op.get_bind()
+    return bind.dialect.name == 'postgresql' and \
+        'search_vector' in [column['name'] for column in sa.inspect(bind).get_columns(table)]
+
+
+def upgrade():
+    op.create_table('genre',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('name', sa.String(length=120), nullable=False),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('name')
+                    )
+    for table in ('venue', 'artist'):
+        op.create_table('%s_genre' % table,
+                        sa.Column('%s_id' % table, sa.Integer(), nullable=False),
+                        sa.Column('genre_id', sa.Integer(), nullable=False),
+                        sa.ForeignKeyConstraint(['%s_id' % table], ['%s.id' % table], ondelete='CASCADE'),
+                        sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ondelete='CASCADE'),
+                        sa.PrimaryKeyConstraint('%s_id' % table, 'genre_id')
+                        )
+        op.create_index('ix_%s_genre_genre_id_%s_id' % (table, table), '%s_genre' % table,
+                        ['genre_id', '%s_id' % table], unique=False)
+
+    bind = op.get_bind()
+    op.bulk_insert(genre, [{'name': name} for name in DEFAULT_GENRES])
+    genre_ids = {name.lower(): id for id, name in bind.execute(sa.select([genre.c.id, genre.c.name]))}
+
+    for table in ('venue', 'artist'):
+        links = set()
+        for id, value in bind.execute(sa.text('SELECT id, genres FROM %s' % table)).fetchall():
+            for name in parse_genres(value):
+                if name.lower() not in genre_ids:
+                    bind.execute(genre.insert().values(name=name))
+                    genre_ids[name.lower()] = bind.execute(
+                        sa.select([genre.c.id]).where(genre.c.name == name)).scalar()
+                links.add((id, genre_ids[name.lower()]))
+        if links:
+            link = sa.table('%s_genre' % table, sa.column('%s_id' % table), sa.column('genre_id'))
+            op.bulk_insert(link, [{'%s_id' % table: id, 'genre_id': genre_id}
+                                  for id, genre_id in sorted(links)])
+
+        if _has_search_vector(table):
+            for statement in _search_vector_functions(table):
+                op.execute(statement)
+            op.execute('UPDATE %s SET search_vector = NULL' % table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('genres')
+        if bind.dialect.name == 'sqlite':
+            # Rebuilding the table lost its expression index.
+            op.create_index('ix_%s_lower_name' % table, table, [sa.text('lower(name)')], unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table in ('artist', 'venue'):
+        op.add_column(table, sa.Column('genres', sa.String(length=120), nullable=True))
+        rows = bind.execute(sa.text(
+            'SELECT l.{0}_id, g.name FROM {0}_genre l JOIN genre g ON g.id = l.genre_id '
+            'ORDER BY l.{0}_id, g.name'.format(table)))
+        names = {}
+        for id, name in rows:
+            names.setdefault(id, []).append(name)
+        for id, genres in names.items():
+            bind.execute(sa.text('UPDATE %s SET genres = :genres WHERE id = :id' % table),
+                         genres=genres_literal(genres)[:OLD_LENGTH], id=id)
+
+        if _has_search_vector(table):
+            op.execute('DROP TRIGGER IF EXISTS {0}_genre_search_vector_update ON {0}_genre'.format(table))
+            op.execute('DROP TRIGGER IF EXISTS {0}_search_vector_update ON {0}'.format(table))
+            op.execute('DROP FUNCTION IF EXISTS {0}_genre_search_vector_update()'.format(table))
+            op.execute('DROP FUNCTION IF EXISTS {0}_search_vector_update()'.format(table))
+            op.execute(
+                'CREATE TRIGGER {0}_search_vector_update BEFORE INSERT OR UPDATE ON {0} '
+                "FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(search_vector, 'pg_catalog.simple', "
+                'name, city, state, genres)'.format(table))
+            op.execute('UPDATE %s SET search_vector = NULL' % table)
+
+        op.drop_index('ix_%s_genre_genre_id_%s_id' % (table, table), table_name='%s_genre' % table)
+        op.drop_table('%s_genre' % table)
+    op.drop_table('genre')
@@ -0,0 +1,40 @@
+"""precomputed venue and artist matches
+
+Revision ID: f3a9c7d2e5b8
+Revises: b5d2e8a4c619
+Create Date: 2026-10-19 03:12:44.906517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c7d2e5b8'
+down_revision = 'b5d2e8a4c619'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled afterwards by `flask matches rebuild`.
+    for owner, candidate in (('venue', 'artist'), ('artist', 'venue')):
+        op.create_table(
+            '%s_matches' % owner,
+            sa.Column('%s_id' % owner, sa.Integer(), nullable=False),
+            sa.Column('rank', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('%s_id' % candidate, sa.Integer(), nullable=False),
+            sa.Column('score', sa.Float(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['%s_id' % owner], ['%s.id' % owner], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['%s_id' % candidate], ['%s.id' % candidate], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('%s_id' % owner, 'rank'),
+        )
+        op.create_index(op.f('ix_%s_matches_%s_id' % (owner, candidate)), '%s_matches' % owner,
+                        ['%s_id' % candidate], unique=False)
+
+
+def downgrade():
+    for owner, candidate in (('artist', 'venue'), ('venue', 'artist')):
+        op.drop_index(op.f('ix_%s_matches_%s_id' % (owner, candidate)), table_name='%s_matches' % owner)
+        op.drop_table('%s_matches' % owner)
@@ -1,25 +1,108 @@
+from datetime import datetime
+
+from sqlalchemy import DDL, and_, event
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.orm import Query
+from sqlalchemy.sql.util import surface_selectables
+
 from setup import db
 
+# Genres a new database starts with; the genre table is the source of truth
+# from then on.
+DEFAULT_GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk',
+    'Funk', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz',
+    'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul',
+    'Other',
+]
+
+# Length of a show when none is given, and the longest allowed.
+DEFAULT_SHOW_MINUTES = 120
+MAX_SHOW_MINUTES = 24 * 60
+
+
+class Genre(db.Model):
+    __tablename__ = 'genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    @classmethod
+    def named(cls, name):
+        # The genre called `name`, created if it is new. Used when a list of
+        # names is assigned to Venue.genres or Artist.genres.
+        with db.session.no_autoflush:
+            genre = cls.query.filter_by(name=name).first()
+        return genre if genre is not None else cls(name=name)
+
+    def __repr__(self):
+        return f'<Genre [{ self.id }]: { self.name }>'
+
+
+@event.listens_for(Genre.__table__, 'after_create')
+def _seed_genres(target, connection, **kw):
+    connection.execute(target.insert(), [{'name': name} for name in DEFAULT_GENRES])
+
+
+# The primary keys serve lookups of an entity's genres; the second index
+# serves "venues/artists by genre".
+venue_genre = db.Table(
+    'venue_genre',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_venue_genre_genre_id_venue_id', 'genre_id', 'venue_id'),
+)
+
+artist_genre = db.Table(
+    'artist_genre',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_artist_genre_genre_id_artist_id', 'genre_id', 'artist_id'),
+)
+
 
 class Venue(db.Model):
     __tablename__ = 'venue'
+    __table_args__ = (
+        db.Index('ix_venue_city_state_name', 'city', 'state', 'name'),
+        db.Index('ix_venue_lower_name', db.func.lower(db.column('name'))),
+        db.Index('ix_venue_deleted_at', 'deleted_at', postgresql_where=db.text('deleted_at IS NOT NULL'),
+                 sqlite_where=db.text('deleted_at IS NOT NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
+    # Filled in by `flask geo geocode`; geohash is kept in step by geo.py
+    # and indexed for nearby searches.
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12), index=True)
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean(), default=False)
     seeking_description = db.Column(db.String)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Set when the venue is deleted; see deletes.py. Only deleted rows are
+    # indexed: an index mostly of NULLs would tempt the planner into
+    # reading every live venue through it.
+    deleted_at = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    __mapper_args__ = {'version_id_col': version}
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
     shows = db.relationship('Show', backref=db.backref(
-        'venue', lazy='select'), cascade="all, delete", lazy='dynamic')
+        'venue', lazy='select'), cascade="all, delete", passive_deletes=True, lazy='dynamic')
+    genre_objects = db.relationship('Genre', secondary=venue_genre, order_by='Genre.name')
+    # The genre names as a list; assigning a list of names links the
+    # matching Genre rows.
+    genres = association_proxy('genre_objects', 'name', creator=Genre.named)
 
     def __repr__(self):
         return f'<Venue [{ self.id }]: { self.name }, { self.city }, { self.state }, { self.address }, { self.phone }, { self.facebook_link }>'
@@ -27,22 +110,37 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'artist'
+    __table_args__ = (
+        db.Index('ix_artist_lower_name', db.func.lower(db.column('name'))),
+        db.Index('ix_artist_deleted_at', 'deleted_at', postgresql_where=db.text('deleted_at IS NOT NULL'),
+                 sqlite_where=db.text('deleted_at IS NOT NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Set when the artist is deleted; see deletes.py.
+    deleted_at = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    __mapper_args__ = {'version_id_col': version}
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
     shows = db.relationship('Show', backref=db.backref(
-        'artist', lazy='select'), cascade="all, delete", lazy='dynamic')
+        'artist', lazy='select'), cascade="all, delete", passive_deletes=True, lazy='dynamic')
+    genre_objects = db.relationship('Genre', secondary=artist_genre, order_by='Genre.name')
+    # The genre names as a list; assigning a list of names links the
+    # matching Genre rows.
+    genres = association_proxy('genre_objects', 'name', creator=Genre.named)
 
     def __repr__(self):
         return f'<Artist [{ self.id }]: { self.name }, { self.city }, { self.state }, { self.phone }, { self.facebook_link }>'
@@ -52,12 +150,187 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'show'
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime())
+    # A show books its venue and artist from start_time for this long;
+    # booking.py keeps bookings from overlapping.
+    duration_minutes = db.Column(db.Integer, nullable=False, default=DEFAULT_SHOW_MINUTES,
+                                 server_default=str(DEFAULT_SHOW_MINUTES))
     artist_id = db.Column(db.Integer, db.ForeignKey(
-        'artist.id'), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('venue.id'), nullable=False)
+        'artist.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f'<Show of the Artist that his ID: { self.artist_id } , and the venue ID: { self.venue_id }>'
+
+
+# Show counts per venue and artist, kept up to date by stats.py so listings
+# and search read one row instead of counting shows. An entity without a row
+# has no shows.
+venue_stats = db.Table(
+    'venue_stats',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('upcoming_shows_count', db.Integer, nullable=False, default=0),
+    db.Column('past_shows_count', db.Integer, nullable=False, default=0),
+    db.Column('next_show_time', db.DateTime, index=True),
+    db.Column('updated_at', db.DateTime, nullable=False, index=True),
+)
+
+artist_stats = db.Table(
+    'artist_stats',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('upcoming_shows_count', db.Integer, nullable=False, default=0),
+    db.Column('past_shows_count', db.Integer, nullable=False, default=0),
+    db.Column('next_show_time', db.DateTime, index=True),
+    db.Column('updated_at', db.DateTime, nullable=False, index=True),
+)
+
+
+# The best matches of each seeking venue among seeking artists and the other
+# way round, `rank` 1 first, precomputed by matching.py so the detail pages
+# read a few rows instead of scoring every candidate.
+venue_matches = db.Table(
+    'venue_matches',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('rank', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('artist_id', db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), nullable=False, index=True),
+    db.Column('score', db.Float, nullable=False),
+    db.Column('updated_at', db.DateTime, nullable=False),
+)
+
+artist_matches = db.Table(
+    'artist_matches',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('rank', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('venue_id', db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), nullable=False, index=True),
+    db.Column('score', db.Float, nullable=False),
+    db.Column('updated_at', db.DateTime, nullable=False),
+)
+
+
+# Background work queued by jobs.py and run by `flask jobs work`. Queued
+# jobs are found through (status, run_at); finished jobs are deleted, failed
+# ones stay for inspection.
+job = db.Table(
+    'job',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('kind', db.String(60), nullable=False),
+    db.Column('payload', db.Text, nullable=False),
+    db.Column('status', db.String(20), nullable=False, default='queued'),
+    db.Column('attempts', db.Integer, nullable=False, default=0),
+    db.Column('max_attempts', db.Integer, nullable=False),
+    db.Column('run_at', db.DateTime, nullable=False),
+    db.Column('locked_by', db.String(120)),
+    db.Column('locked_at', db.DateTime),
+    db.Column('last_error', db.Text),
+    db.Column('created_at', db.DateTime, nullable=False, default=datetime.utcnow),
+    db.Index('ix_job_status_run_at', 'status', 'run_at'),
+)
+
+# On PostgreSQL, exclusion constraints reject overlapping shows of a venue or
+# an artist, even from concurrent transactions, and their GiST indexes find
+# overlaps in O(log n). Other databases rely on the checks in booking.py.
+# Shows without a start time would give an unbounded range, booking their
+# venue and artist forever, so they are left out.
+SHOW_OVERLAP_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS btree_gist',
+    'ALTER TABLE show ADD CONSTRAINT show_venue_id_no_overlap EXCLUDE USING gist '
+    "(venue_id WITH =, tsrange(start_time, start_time + duration_minutes * interval '1 minute') WITH &&) "
+    'WHERE (start_time IS NOT NULL)',
+    'ALTER TABLE show ADD CONSTRAINT show_artist_id_no_overlap EXCLUDE USING gist '
+    "(artist_id WITH =, tsrange(start_time, start_time + duration_minutes * interval '1 minute') WITH &&) "
+    'WHERE (start_time IS NOT NULL)',
+]
+
+for _statement in SHOW_OVERLAP_DDL:
+    event.listen(Show.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+
+
+def _touch(target, value, initiator):
+    # Genre links live in another table, so changing them would leave the
+    # row itself untouched. Bumping updated_at makes the flush update it,
+    # which advances the version and fires the update events the page
+    # cache and search index listen for.
+    target.updated_at = datetime.utcnow()
+
+
+for _model in (Venue, Artist):
+    event.listen(_model.genre_objects, 'append', _touch)
+    event.listen(_model.genre_objects, 'remove', _touch)
+
+
+# Deleted venues and artists stay in their tables, with deleted_at set,
+# until they are purged. ORM queries reading their tables leave them out, so
+# a show of a deleted venue disappears wherever the venue's name is shown
+# next to it, and counts skip them. Queries run with
+# .execution_options(include_deleted=True) see them.
+SOFT_DELETED = (Venue, Artist)
+
+
+@event.listens_for(Query, 'before_compile', retval=True, bake_ok=True)
+def _hide_deleted(query):
+    if query._execution_options.get('include_deleted'):
+        return query
+    # The entities selected, and the tables read by the selected columns,
+    # by select_from() and by the joins; subqueries filter their own.
+    found = set()
+    for description in query.column_descriptions:
+        found.add(description['entity'])
+        found.update(getattr(description['expr'], '_from_objects', ()))
+    for from_obj in query._from_obj:
+        found.update(surface_selectables(from_obj))
+    for model in SOFT_DELETED:
+        if model in found or model.__table__ in found:
+            query = query.enable_assertions(False).filter(model.deleted_at.is_(None))
+    return query
+
+
+def genre_link(model):
+    # The association table linking `model` to Genre, and its column
+    # pointing back at `model`.
+    if model is Venue:
+        return venue_genre, venue_genre.c.venue_id
+    return artist_genre, artist_genre.c.artist_id
+
+
+def genre_members(model, name):
+    # Ids of the venues or artists tagged with the genre called `name`,
+    # deleted ones left out, for use with in_(); served by the
+    # (genre_id, ...) index.
+    table, fk = genre_link(model)
+    return db.select([fk]).\
+        select_from(table.join(Genre, Genre.id == table.c.genre_id).join(model, model.id == fk)).\
+        where(and_(Genre.name == name, model.deleted_at.is_(None)))
+
+
+def stats_link(model):
+    # The statistics table of `model`, and its column pointing back at it.
+    if model is Venue:
+        return venue_stats, venue_stats.c.venue_id
+    return artist_stats, artist_stats.c.artist_id
+
+
+def match_link(model):
+    # The match table of `model`, its column pointing back at `model` and
+    # its column pointing at the matched entity.
+    if model is Venue:
+        return venue_matches, venue_matches.c.venue_id, venue_matches.c.artist_id
+    return artist_matches, artist_matches.c.artist_id, artist_matches.c.venue_id
+
+
+def match_references(model):
+    # Each match table with its column pointing at `model`: the lists of
+    # `model` and the places of `model` in the other side's lists.
+    return [(venue_matches, venue_matches.c[model.__tablename__ + '_id']),
+            (artist_matches, artist_matches.c[model.__tablename__ + '_id'])]
@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# Engine settings per process type. Every process holds up to
+# pool_size + max_overflow connections, so PostgreSQL's max_connections has
+# to cover that times the number of processes (gunicorn workers, job
+# workers, one-off commands).
+PROFILES = {
+    # Request handlers: a small pool that fails fast when saturated, and
+    # statements cut off before they hold a worker for long.
+    'web': {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_timeout': 5,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'statement_timeout': 10000,
+    },
+    # Background jobs: few connections, patient checkouts, long statements.
+    'worker': {
+        'pool_size': 2,
+        'max_overflow': 2,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'statement_timeout': 300000,
+    },
+    # Imports, exports and other one-off commands: one connection, no
+    # statement timeout.
+    'batch': {
+        'pool_size': 1,
+        'max_overflow': 0,
+        'pool_timeout': 60,
+        'pool_recycle': -1,
+        'pool_pre_ping': True,
+        'statement_timeout': 0,
+    },
+}
+
+
+def _flag(value):
+    return value.strip().lower() not in ('', '0', 'false', 'no', 'off')
+
+
+# Environment variables overriding single settings of the chosen profile.
+ENVIRONMENT = {
+    'pool_size': ('DB_POOL_SIZE', int),
+    'max_overflow': ('DB_MAX_OVERFLOW', int),
+    'pool_timeout': ('DB_POOL_TIMEOUT', float),
+    'pool_recycle': ('DB_POOL_RECYCLE', int),
+    'pool_pre_ping': ('DB_POOL_PRE_PING', _flag),
+    'statement_timeout': ('DB_STATEMENT_TIMEOUT', int),
+}
+
+
+#----------------------------------------------------------------------------#
+# Configuration.
+#----------------------------------------------------------------------------#
+
+def database_url(default, environ=os.environ):
+    # DATABASE_URL as set by Heroku and most hosts; their postgres://
+    # scheme is the deprecated alias of postgresql://.
+    url = environ.get('DATABASE_URL', default)
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def settings(profile, environ=os.environ):
+    if profile not in PROFILES:
+        raise ValueError('Unknown DB_PROFILE %r, expected one of %s' % (profile, ', '.join(sorted(PROFILES))))
+    values = dict(PROFILES[profile])
+    for key, (name, cast) in ENVIRONMENT.items():
+        if environ.get(name):
+            values[key] = cast(environ[name])
+    return values
+
+
+def engine_options(url, profile, environ=os.environ):
+    # SQLALCHEMY_ENGINE_OPTIONS for `url`. SQLite keeps the pool Flask-
+    # SQLAlchemy picks for it; everything else gets an instrumented
+    # QueuePool sized by the profile.
+    if url.startswith('sqlite'):
+        return {}
+    values = settings(profile, environ)
+    statement_timeout = values.pop('statement_timeout')
+    options = dict(values, poolclass=InstrumentedQueuePool)
+    if url.startswith('postgresql') and statement_timeout:
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % statement_timeout}
+    return options
+
+
+#----------------------------------------------------------------------------#
+# Instrumentation.
+#----------------------------------------------------------------------------#
+
+class InstrumentedQueuePool(QueuePool):
+    # A QueuePool that also counts checkouts, the time spent waiting for a
+    # connection, checkout timeouts, new connections and invalidations.
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        event.listen(self, 'connect', self._on_connect)
+        event.listen(self, 'invalidate', self._on_invalidate)
+        event.listen(self, 'soft_invalidate', self._on_invalidate)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self.lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connects += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidations += 1
+
+
+def status(pool):
+    # A snapshot of `pool` for the metrics endpoint. Counters are per
+    # process and start over when the pool is disposed.
+    data = {
+        'pool': type(pool).__name__,
+        'pid': os.getpid(),
+    }
+    if isinstance(pool, QueuePool):
+        data.update({
+            'size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+            'capacity': pool.size() + max(pool._max_overflow, 0),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool.lock:
+            data.update({
+                'checkouts': pool.checkouts,
+                'wait_seconds_total': round(pool.wait_total, 6),
+                'wait_seconds_max': round(pool.wait_max, 6),
+                'wait_seconds_mean': round(pool.wait_total / pool.checkouts, 6) if pool.checkouts else 0.0,
+                'timeouts': pool.timeouts,
+                'connects': pool.connects,
+                'invalidations': pool.invalidations,
+            })
+    return data
@@ -0,0 +1,235 @@
+from bisect import bisect_left
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+
+from sqlalchemy import String, and_, case, func, or_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from setup import db
+from models import Venue, Artist, Show, Genre, genre_link, genre_members, stats_link
+from search import backend as search_backend
+
+SEARCH_PAGE_SIZE = 20
+# Past shows listed on a venue/artist page; the count still covers all of them.
+RECENT_PAST_SHOWS = 50
+SHOWS_PAGE_SIZE = 60
+
+
+#----------------------------------------------------------------------------#
+# Aggregates.
+#----------------------------------------------------------------------------#
+
+def upcoming_shows_count(model):
+    # From the statistics table kept by stats.py; use with an outer join on
+    # stats_link(model), since entities without shows have no row there.
+    table, fk = stats_link(model)
+    return func.coalesce(table.c.upcoming_shows_count, 0)
+
+
+class joined(FunctionElement):
+    # Aggregates strings into one ';'-separated string.
+    type = String()
+    name = 'joined'
+
+
+@compiles(joined)
+def _joined(element, compiler, **kw):
+    return "group_concat(%s, ';')" % compiler.process(element.clauses, **kw)
+
+
+@compiles(joined, 'postgresql')
+def _joined_postgresql(element, compiler, **kw):
+    return "string_agg(%s, ';')" % compiler.process(element.clauses, **kw)
+
+
+def genre_names(model):
+    # Correlated subquery with the genres of each venue or artist, in the
+    # form split_genres() reads, so listings get them without a query per
+    # row.
+    table, fk = genre_link(model)
+    return db.session.query(joined(Genre.name)).\
+        select_from(table).\
+        join(Genre, Genre.id == table.c.genre_id).\
+        filter(fk == model.id).\
+        correlate(model).\
+        as_scalar()
+
+
+def split_genres(value):
+    return sorted(value.split(';')) if value else []
+
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+def search(model, term, page=1, per_page=SEARCH_PAGE_SIZE, genre=None):
+    # One page of ranked matches from the search backend, optionally only
+    # among those tagged with `genre`, then their upcoming show counts from
+    # the statistics table.
+    page = max(page, 1)
+    total, ids = search_backend().search(model, term, per_page, (page - 1) * per_page, genre=genre)
+    rows = {}
+    if ids:
+        table, fk = stats_link(model)
+        rows = {row.id: row for row in db.session.query(
+            model.id,
+            model.name,
+            upcoming_shows_count(model).label('num_upcoming_shows')
+        ).
+            outerjoin(table, fk == model.id).
+            filter(model.id.in_(ids))}
+
+    return {
+        "count": total,
+        "page": page,
+        "pages": (total + per_page - 1) // per_page,
+        "data": [{
+            "id": rows[id].id,
+            "name": rows[id].name,
+            "num_upcoming_shows": rows[id].num_upcoming_shows,
+        } for id in ids if id in rows]
+    }
+
+
+def next_show_time(now=None):
+    # Start of the next show anywhere; upcoming counts change at that point.
+    now = now or datetime.now()
+    return db.session.query(func.min(Show.start_time)).filter(Show.start_time >= now).scalar()
+
+
+#----------------------------------------------------------------------------#
+# Venues.
+#----------------------------------------------------------------------------#
+
+def venues_by_area(genre=None):
+    # All venues (or those tagged with `genre`) with their upcoming show
+    # counts in a single ordered query, grouped by (city, state) while the
+    # rows stream in.
+    table, fk = stats_link(Venue)
+    rows = db.session.query(
+        Venue.id,
+        Venue.name,
+        Venue.city,
+        Venue.state,
+        upcoming_shows_count(Venue).label('num_upcoming_shows')
+    ).\
+        outerjoin(table, fk == Venue.id)
+    if genre is not None:
+        rows = rows.filter(Venue.id.in_(genre_members(Venue, genre)))
+    rows = rows.order_by(Venue.city, Venue.state, Venue.name, Venue.id)
+
+    for (city, state), venues in groupby(rows, key=itemgetter(2, 3)):
+        yield {
+            "city": city,
+            "state": state,
+            "venues": [{
+                "id": venue.id,
+                "name": venue.name,
+                "num_upcoming_shows": venue.num_upcoming_shows
+            } for venue in venues]
+        }
+
+
+#----------------------------------------------------------------------------#
+# Detail pages.
+#----------------------------------------------------------------------------#
+
+def show_timeline(model, entity_id, now=None, past_limit=RECENT_PAST_SHOWS, time_format="%m/%d/%Y, %H:%M"):
+    # Past and upcoming shows of a venue (with their artists) or of an artist
+    # (with their venues) from one query, split at a single timestamp. Only
+    # the most recent `past_limit` past shows are fetched; the per-side
+    # totals come from window counts, so they stay exact. Start times are
+    # formatted with `time_format`, or left as datetimes when it is None.
+    now = now or datetime.now()
+    if model is Venue:
+        other, own_fk, other_fk, prefix = Artist, Show.venue_id, Show.artist_id, 'artist'
+    else:
+        other, own_fk, other_fk, prefix = Venue, Show.artist_id, Show.venue_id, 'venue'
+
+    is_past = case([(Show.start_time < now, 1)], else_=0)
+    shows = db.session.query(
+        Show.start_time,
+        other.id.label('id'),
+        other.name.label('name'),
+        other.image_link.label('image_link'),
+        is_past.label('is_past'),
+        func.row_number().over(partition_by=is_past, order_by=Show.start_time.desc()).label('recency'),
+        func.count().over(partition_by=is_past).label('total')
+    ).\
+        join(other, other.id == other_fk).\
+        filter(own_fk == entity_id, Show.start_time.isnot(None)).\
+        subquery()
+    rows = db.session.query(shows).\
+        filter(or_(shows.c.is_past == 0, shows.c.recency <= past_limit)).\
+        order_by(shows.c.start_time).\
+        all()
+
+    split = bisect_left([row.start_time for row in rows], now)
+    past, upcoming = rows[:split], rows[split:]
+
+    def serialize(row):
+        return {
+            prefix + "_id": row.id,
+            prefix + "_name": row.name,
+            prefix + "_image_link": row.image_link,
+            "start_time": row.start_time.strftime(time_format) if time_format else row.start_time
+        }
+
+    return {
+        "past_shows": [serialize(row) for row in past],
+        "upcoming_shows": [serialize(row) for row in upcoming],
+        "past_shows_count": past[0].total if past else 0,
+        "upcoming_shows_count": len(upcoming),
+        "next_show_time": upcoming[0].start_time if upcoming else None
+    }
+
+
+#----------------------------------------------------------------------------#
+# Shows.
+#----------------------------------------------------------------------------#
+
+def encode_cursor(start_time, show_id):
+    return '%s,%d' % (start_time.isoformat(), show_id)
+
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything encode_cursor() did not produce.
+    start_time, show_id = cursor.rsplit(',', 1)
+    return datetime.fromisoformat(start_time), int(show_id)
+
+
+def shows_feed(after=None, limit=SHOWS_PAGE_SIZE, upcoming_only=True, now=None):
+    # One page of shows ordered by (start_time, id), with the artist and
+    # venue columns the tiles need joined in. Paging is keyset based: pass
+    # the `next` cursor of the previous page as `after`.
+    now = now or datetime.now()
+    query = db.session.query(
+        Show.id,
+        Show.start_time,
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Show.venue_id,
+        Venue.name.label('venue_name')
+    ).\
+        join(Artist, Artist.id == Show.artist_id).\
+        join(Venue, Venue.id == Show.venue_id).\
+        filter(Show.start_time.isnot(None))
+    if upcoming_only:
+        query = query.filter(Show.start_time >= now)
+    if after is not None:
+        start_time, show_id = after
+        query = query.filter(or_(
+            Show.start_time > start_time,
+            and_(Show.start_time == start_time, Show.id > show_id)
+        ))
+    rows = query.order_by(Show.start_time, Show.id).limit(limit + 1).all()
+
+    last = rows[limit - 1] if len(rows) > limit else None
+    return {
+        "shows": rows[:limit],
+        "next": encode_cursor(last.start_time, last.id) if last else None
+    }
@@ -0,0 +1,159 @@
+import itertools
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker
+
+import pool
+
+# Flask session key holding the time until which the client reads from the
+# primary, so it sees its own writes even though replicas lag behind.
+STICKY_KEY = 'db_primary_until'
+
+
+class RoutingSession(SignallingSession):
+    # Sends the statements of a request marked with replica() to the
+    # replica chosen for it. Flushes always go to the primary.
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_app_context():
+            replica = g.get('db_replica')
+            if replica is not None:
+                return replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    # SQLAlchemy with replica engines from SQLALCHEMY_REPLICA_URIS. A
+    # replica is probed with a connection at most once per
+    # REPLICA_RETRY_SECONDS; one that fails to connect, or drops a
+    # connection in between, is skipped for as long. With no healthy
+    # replica left, reads fall back to the primary.
+
+    def __init__(self, *args, **kwargs):
+        self._replicas = {}
+        self._down = {}
+        self._up = {}
+        self._next = itertools.count()
+        self._replica_lock = threading.Lock()
+        super(RoutingSQLAlchemy, self).__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+        app.config.setdefault('REPLICA_RETRY_SECONDS', 30)
+        super(RoutingSQLAlchemy, self).init_app(app)
+        app.after_request(self._stick_to_primary)
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    #------------------------------------------------------------------------#
+    # Replicas.
+    #------------------------------------------------------------------------#
+
+    def replicas(self, app=None):
+        app = self.get_app(app)
+        with self._replica_lock:
+            if app not in self._replicas:
+                engines = []
+                for url in app.config['SQLALCHEMY_REPLICA_URIS']:
+                    engine = create_engine(url, **pool.engine_options(url, app.config.get('DB_PROFILE', 'web')))
+                    event.listen(engine, 'handle_error', self._on_error)
+                    engines.append(engine)
+                self._replicas[app] = engines
+            return self._replicas[app]
+
+    def mark_down(self, engine, app=None):
+        self._up.pop(engine, None)
+        self._down[engine] = time.time() + self.get_app(app).config['REPLICA_RETRY_SECONDS']
+
+    def probe(self, engine, app=None):
+        # Whether `engine` accepts connections, trusted for
+        # REPLICA_RETRY_SECONDS after it last did.
+        if self._up.get(engine, 0) > time.time():
+            return True
+        try:
+            engine.connect().close()
+        except SQLAlchemyError:
+            self.mark_down(engine, app)
+            return False
+        self._up[engine] = time.time() + self.get_app(app).config['REPLICA_RETRY_SECONDS']
+        return True
+
+    def healthy(self, engine):
+        return self._down.get(engine, 0) <= time.time()
+
+    def choose_replica(self):
+        # The next healthy replica, round robin, or None for the primary.
+        engines = self.replicas()
+        if not engines:
+            return None
+        start = next(self._next) % len(engines)
+        for engine in engines[start:] + engines[:start]:
+            if self.healthy(engine) and self.probe(engine):
+                return engine
+        return None
+
+    def _on_error(self, context):
+        # A replica that drops connections mid-request fails that request;
+        # later ones skip it until it is retried.
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    #------------------------------------------------------------------------#
+    # Read-your-writes.
+    #------------------------------------------------------------------------#
+
+    def _stick_to_primary(self, response):
+        if g.pop('db_wrote', False) and self.replicas():
+            session[STICKY_KEY] = time.time() + self.get_app().config['REPLICA_STICKY_SECONDS']
+        return response
+
+
+# A transaction committed on the primary counts as a write, so Core
+# statements and COPY, which never flush, make the client sticky too.
+
+@event.listens_for(RoutingSession, 'after_begin')
+def _record_primary(db_session, transaction, connection):
+    if connection.engine is db_session.bind:
+        db_session.info['db_primary'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _record_write(db_session):
+    if db_session.info.pop('db_primary', False) and has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _forget_primary(db_session, previous_transaction):
+    db_session.info.pop('db_primary', None)
+
+
+def replica(view):
+    # Marks a read-only view: its queries go to a replica unless this client
+    # wrote recently. Apply it outermost, below the route, so conditional
+    # GET validators read from the same database as the view.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        db = current_app.extensions['sqlalchemy'].db
+        if session.get(STICKY_KEY, 0) < time.time():
+            g.db_replica = db.choose_replica()
+        try:
+            return view(*args, **kwargs)
+        except SQLAlchemyError:
+            replica = g.get('db_replica')
+            if replica is None or db.healthy(replica):
+                raise
+            # The replica went away since it was last probed. The view only
+            # reads, so it runs again on the primary.
+            db.session.rollback()
+            g.db_replica = None
+            return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,338 @@
+import heapq
+import re
+import threading
+import time
+from datetime import timedelta
+from collections import defaultdict
+
+from sqlalchemy import event, func, literal_column, or_
+from sqlalchemy.orm import Session
+
+from setup import app, db
+from models import Venue, Artist, Genre, genre_link, genre_members
+
+# Minimum trigram similarity for fuzzy matches, same default as pg_trgm.
+SIMILARITY_THRESHOLD = 0.3
+
+# Seconds the in-process n-gram index is trusted before it checks the
+# database for changes made by other processes.
+app.config.setdefault('SEARCH_INDEX_CHECK_SECONDS', 5)
+
+_word = re.compile(r'\w+', re.UNICODE)
+
+
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + escaped + '%'
+
+
+def _trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def _similarity(a, b):
+    # Trigram similarity of two words, padded the way pg_trgm pads them.
+    a, b = _trigrams('  ' + a + ' '), _trigrams('  ' + b + ' ')
+    return len(a & b) / float(len(a | b))
+
+
+def document(obj, genres=None):
+    # The searchable text of a venue or artist; `genres` defaults to the
+    # object's own genre names.
+    if genres is None:
+        genres = obj.genres
+    return ' '.join(value for value in [obj.name, obj.city, obj.state] + list(genres) if value)
+
+
+#----------------------------------------------------------------------------#
+# PostgreSQL.
+#----------------------------------------------------------------------------#
+
+class PostgresSearchBackend(object):
+    # Relies on the search_vector column, its triggers and the pg_trgm/GIN
+    # indexes created by migrations 5d1c3a7e2f90 and e4b8a1f05c37.
+
+    def search(self, model, term, limit, offset, genre=None):
+        vector = literal_column(model.__tablename__ + '.search_vector')
+        query = func.plainto_tsquery('simple', term)
+        rank = func.ts_rank(vector, query) + func.similarity(model.name, term)
+        rows = db.session.query(model.id, func.count().over().label('total')).\
+            filter(or_(
+                vector.op('@@')(query),
+                model.name.ilike(_like_pattern(term), escape='\\')
+            ))
+        if genre is not None:
+            rows = rows.filter(model.id.in_(genre_members(model, genre)))
+        page = rows.\
+            order_by(rank.desc(), model.name, model.id).\
+            limit(limit).\
+            offset(offset).\
+            all()
+        if page:
+            return page[0].total, [row.id for row in page]
+        # Past the last page no row carries the total.
+        total = rows.with_entities(func.count(model.id)).scalar() if offset else 0
+        return total, []
+
+
+#----------------------------------------------------------------------------#
+# In-process n-gram index.
+#----------------------------------------------------------------------------#
+
+class NgramIndex(object):
+    # Inverted index over the distinct words of all documents: trigrams
+    # point at words, words point at document ids. The word vocabulary is
+    # far smaller than the documents (cities, states and genres repeat), so
+    # substring lookups only scan postings of the words that can match.
+
+    def __init__(self):
+        self.names = {}
+        self.words = {}
+        self.postings = defaultdict(set)
+        self.grams = defaultdict(set)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, id, name, text):
+        self.remove(id)
+        words = frozenset(_word.findall(text.lower()))
+        self.names[id] = (name or '').lower()
+        self.words[id] = words
+        for word in words:
+            if not self.postings[word]:
+                for gram in _trigrams(word):
+                    self.grams[gram].add(word)
+            self.postings[word].add(id)
+
+    def remove(self, id):
+        if id not in self.names:
+            return
+        del self.names[id]
+        for word in self.words.pop(id):
+            ids = self.postings[word]
+            ids.discard(id)
+            if not ids:
+                del self.postings[word]
+                for gram in _trigrams(word):
+                    self.grams[gram].discard(word)
+                    if not self.grams[gram]:
+                        del self.grams[gram]
+
+    def _words_containing(self, fragment):
+        grams = _trigrams(fragment)
+        if not grams:
+            return [word for word in self.postings if fragment in word]
+        candidates = set.intersection(*(self.grams.get(gram, set()) for gram in grams))
+        return [word for word in candidates if fragment in word]
+
+    def _similar_words(self, fragment):
+        candidates = {word for gram in _trigrams(fragment) for word in self.grams.get(gram, ())}
+        return [word for word in candidates if _similarity(fragment, word) >= SIMILARITY_THRESHOLD]
+
+    def _matching(self, fragment, fuzzy):
+        words = self._words_containing(fragment)
+        if not words and fuzzy:
+            words = self._similar_words(fragment)
+        ids = set()
+        for word in words:
+            ids |= self.postings[word]
+        return ids
+
+    def search(self, term, limit, offset, within=None):
+        # `within` restricts matches to a set of ids.
+        term = term.lower().strip()
+        fragments = _word.findall(term)
+        if not fragments:
+            matches = set(self.names)
+        else:
+            matches = self._matching(fragments[0], fuzzy=len(fragments) == 1)
+            for fragment in fragments[1:]:
+                matches &= self._matching(fragment, fuzzy=False)
+        if within is not None:
+            matches &= within
+
+        def rank(id):
+            name = self.names[id]
+            if name.startswith(term):
+                tier = 0
+            elif term in name:
+                tier = 1
+            else:
+                tier = 2
+            return tier, name, id
+
+        page = heapq.nsmallest(offset + limit, matches, key=rank)[offset:]
+        return len(matches), page
+
+
+class NgramSearchBackend(object):
+    # Keeps one NgramIndex per model in process memory. An index is built
+    # from the database on first use and then kept current by the model
+    # events below, applied once the surrounding transaction commits.
+    # Other processes (web workers, `flask import`, the job worker) change
+    # rows without those events, so every SEARCH_INDEX_CHECK_SECONDS the
+    # index compares the table's max(updated_at), row count and sum of
+    # row versions with the ones it last saw. When they differ, it re-reads
+    # the rows updated since shortly before its last check. Updated_at is
+    # stamped before commit, so a slow transaction can land behind that
+    # window. Every write bumps a row's version, though, and the index
+    # keeps the version of each row it read. Counts or version sums that
+    # still disagree after the re-read mean rows were missed or purged, and
+    # the index is rebuilt.
+
+    def __init__(self):
+        self.indexes = {}
+        self.ids = {}
+        self.versions = {}
+        self.checked = {}
+        self.lock = threading.Lock()
+
+    def _version(self, model):
+        return tuple(db.session.query(func.max(model.updated_at), func.count(model.id), func.sum(model.version)).
+                     execution_options(include_deleted=True).one())
+
+    def _load(self, model, index, ids, since=None):
+        # Adds the rows updated at or after `since` (all of them by
+        # default) to `index`, removing the deleted ones, and records the
+        # version of every row seen in `ids`.
+        table, fk = genre_link(model)
+        genres = defaultdict(list)
+        rows = db.session.query(fk, Genre.name).join(Genre, Genre.id == table.c.genre_id)
+        if since is not None:
+            rows = rows.join(model, model.id == fk).filter(model.updated_at >= since)
+        for id, name in rows.execution_options(include_deleted=True):
+            genres[id].append(name)
+        rows = db.session.query(model.id, model.name, model.city, model.state, model.deleted_at, model.version).\
+            execution_options(include_deleted=True)
+        if since is not None:
+            rows = rows.filter(model.updated_at >= since)
+        for row in rows.yield_per(10000):
+            ids[row.id] = row.version
+            if row.deleted_at is None:
+                index.add(row.id, row.name, document(row, genres.get(row.id, ())))
+            else:
+                index.remove(row.id)
+
+    def _build(self, model):
+        version = self._version(model)
+        index, ids = NgramIndex(), {}
+        self._load(model, index, ids)
+        self.indexes[model], self.ids[model] = index, ids
+        self.versions[model], self.checked[model] = version, time.time()
+        return index
+
+    def _refresh(self, model):
+        version = self._version(model)
+        self.checked[model] = time.time()
+        last = self.versions[model]
+        if version == last:
+            return self.indexes[model]
+        if last[0] is not None:
+            since = last[0] - timedelta(seconds=app.config['SEARCH_INDEX_CHECK_SECONDS'])
+            ids = self.ids[model]
+            self._load(model, self.indexes[model], ids, since=since)
+            if (len(ids), sum(ids.values())) == version[1:]:
+                self.versions[model] = version
+                return self.indexes[model]
+        return self._build(model)
+
+    def index(self, model):
+        with self.lock:
+            if model not in self.indexes:
+                return self._build(model)
+            if time.time() - self.checked[model] >= app.config['SEARCH_INDEX_CHECK_SECONDS']:
+                return self._refresh(model)
+            return self.indexes[model]
+
+    def apply(self, changes):
+        with self.lock:
+            for model, id, name, text, version, deleted in changes:
+                index = self.indexes.get(model)
+                if index is None:
+                    continue
+                if deleted:
+                    self.ids[model].pop(id, None)
+                else:
+                    self.ids[model][id] = version
+                if text is None:
+                    index.remove(id)
+                else:
+                    index.add(id, name, text)
+
+    def reset(self, model):
+        with self.lock:
+            self.indexes.pop(model, None)
+
+    def search(self, model, term, limit, offset, genre=None):
+        within = None
+        if genre is not None:
+            within = {id for id, in db.session.execute(genre_members(model, genre))}
+        return self.index(model).search(term, limit, offset, within)
+
+
+def reset(model):
+    # Forgets what the active backend indexed for `model`, after changes
+    # that bypassed the ORM events (bulk loads, set-based deletes).
+    if isinstance(_backend, NgramSearchBackend):
+        _backend.reset(model)
+
+
+_backends = {
+    'postgres': PostgresSearchBackend,
+    'ngram': NgramSearchBackend,
+}
+_backend = None
+
+
+def backend():
+    # SEARCH_BACKEND picks the implementation explicitly; by default
+    # PostgreSQL databases use the indexed backend and anything else the
+    # in-process n-gram index.
+    global _backend
+    if _backend is None:
+        name = app.config.get('SEARCH_BACKEND')
+        if name is None:
+            name = 'postgres' if db.engine.dialect.name == 'postgresql' else 'ngram'
+        _backend = _backends[name]()
+    return _backend
+
+
+#----------------------------------------------------------------------------#
+# Index maintenance.
+#----------------------------------------------------------------------------#
+
+def _record(session, model, target, text, deleted=False):
+    session.info.setdefault('search_changes', []).append(
+        (model, target.id, target.name, text, target.version, deleted))
+
+
+def _on_change(mapper, connection, target):
+    # Deleting a venue or artist only sets deleted_at, so it arrives here.
+    session = Session.object_session(target)
+    if session is not None:
+        _record(session, type(target), target, None if target.deleted_at else document(target))
+
+
+def _on_delete(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        _record(session, type(target), target, None, deleted=True)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop('search_changes', None)
+    if changes and isinstance(_backend, NgramSearchBackend):
+        _backend.apply(changes)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('search_changes', None)
+
+
+for _model in (Venue, Artist):
+    event.listen(_model, 'after_insert', _on_change)
+    event.listen(_model, 'after_update', _on_change)
+    event.listen(_model, 'after_delete', _on_delete)
@@ -0,0 +1,138 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from functools import wraps
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from setup import app
+
+app.config.setdefault('SQL_INSTRUMENTATION', True)
+# Queries a request may issue before it is reported (or, in strict mode,
+# failed). Views can set their own with @budget(n); None means no limit.
+app.config.setdefault('SQL_QUERY_BUDGET', None)
+# Raise QueryBudgetExceeded at the first query over budget instead of only
+# logging it. Meant for tests and development.
+app.config.setdefault('SQL_STRICT', False)
+# Executions of one statement shape in a request that count as an N+1.
+app.config.setdefault('SQL_REPEAT_THRESHOLD', 5)
+
+logger = logging.getLogger('fyyur.sql')
+
+_whitespace = re.compile(r'\s+')
+_placeholders = re.compile(r'\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))*\s*\)')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def shape(statement):
+    # The statement with whitespace and IN-lists collapsed, so executions
+    # that differ only in parameters count as the same shape.
+    return _placeholders.sub('(?)', _whitespace.sub(' ', statement).strip())
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def repeated(self, threshold):
+        return [(statement, count) for statement, count in self.shapes.most_common() if count >= threshold]
+
+
+def _stats():
+    if not has_request_context() or not app.config['SQL_INSTRUMENTATION']:
+        return None
+    return g.get('sql_stats')
+
+
+def budget(queries):
+    # Caps the queries of one view, overriding SQL_QUERY_BUDGET.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.sql_budget = queries
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _budget():
+    return g.get('sql_budget', app.config['SQL_QUERY_BUDGET'])
+
+
+#----------------------------------------------------------------------------#
+# Engine hooks.
+#----------------------------------------------------------------------------#
+# Listening on Engine covers the primary and every replica engine.
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _stats()
+    if stats is None:
+        return
+    limit = _budget()
+    if app.config['SQL_STRICT'] and limit is not None and stats.queries >= limit:
+        raise QueryBudgetExceeded('%s %s issued more than %d queries; next: %s' % (
+            request.method, request.path, limit, shape(statement)))
+    conn.info.setdefault('sql_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _stats()
+    started = conn.info.get('sql_started')
+    if stats is None or not started:
+        return
+    stats.seconds += time.perf_counter() - started.pop()
+    stats.queries += 1
+    stats.shapes[shape(statement)] += 1
+
+
+#----------------------------------------------------------------------------#
+# Requests.
+#----------------------------------------------------------------------------#
+
+@app.before_request
+def _start():
+    if app.config['SQL_INSTRUMENTATION']:
+        g.sql_stats = RequestStats()
+
+
+@app.after_request
+def _report(response):
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+    total = time.perf_counter() - stats.started
+    response.headers.add('Server-Timing', 'db;dur=%.2f;desc="%d queries"' % (stats.seconds * 1000, stats.queries))
+    response.headers.add('Server-Timing', 'app;dur=%.2f' % (total * 1000))
+
+    limit = _budget()
+    repeated = stats.repeated(app.config['SQL_REPEAT_THRESHOLD'])
+    over_budget = limit is not None and stats.queries > limit
+    record = {
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'queries': stats.queries,
+        'db_ms': round(stats.seconds * 1000, 2),
+        'total_ms': round(total * 1000, 2),
+    }
+    if limit is not None:
+        record['budget'] = limit
+    if repeated:
+        record['repeated'] = [{'statement': statement, 'count': count} for statement, count in repeated]
+    level = logging.WARNING if repeated or over_budget else logging.INFO
+    logger.log(level, json.dumps(record))
+    return response
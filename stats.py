@@ -0,0 +1,203 @@
+import time
+from datetime import datetime
+
+import click
+from sqlalchemy import DateTime, and_, case, event, func, inspect, literal, or_, select
+from sqlalchemy.orm import Session
+
+from setup import app, db
+from models import Venue, Artist, Show, stats_link
+import cache
+import jobs
+
+# Entities recomputed per statement.
+REFRESH_BATCH_SIZE = 500
+# Seconds between roll-overs with `flask stats rollover --every`.
+ROLLOVER_INTERVAL = 60
+
+
+#----------------------------------------------------------------------------#
+# Recomputing.
+#----------------------------------------------------------------------------#
+# Counts are split at the time they are computed. When the next upcoming
+# show of an entity starts, its row goes stale; rollover() recomputes the
+# rows whose next_show_time has passed.
+
+def _show_fk(model):
+    return Show.__table__.c.venue_id if model is Venue else Show.__table__.c.artist_id
+
+
+def _computed(model, now):
+    # One statistics row per entity that has shows, straight from the show
+    # table, in the column order of the statistics table. Shows of deleted
+    # venues and artists are not counted.
+    show, venue, artist = Show.__table__, Venue.__table__, Artist.__table__
+    fk = _show_fk(model)
+    upcoming = show.c.start_time >= now
+    return select([
+        fk,
+        func.count(case([(upcoming, show.c.id)])),
+        func.count(case([(show.c.start_time < now, show.c.id)])),
+        func.min(case([(upcoming, show.c.start_time)])),
+        literal(datetime.utcnow(), DateTime),
+    ]).\
+        select_from(show.
+                    join(venue, and_(venue.c.id == show.c.venue_id, venue.c.deleted_at.is_(None))).
+                    join(artist, and_(artist.c.id == show.c.artist_id, artist.c.deleted_at.is_(None)))).\
+        group_by(fk)
+
+
+def refresh(connection, model, ids, now=None):
+    # Recomputes the statistics of the given venues or artists.
+    now = now or datetime.now()
+    table, fk = stats_link(model)
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), REFRESH_BATCH_SIZE):
+        batch = ids[start:start + REFRESH_BATCH_SIZE]
+        connection.execute(table.delete().where(fk.in_(batch)))
+        connection.execute(table.insert().from_select(
+            [column.name for column in table.columns],
+            _computed(model, now).where(_show_fk(model).in_(batch))))
+
+
+def rebuild(connection, model, now=None):
+    # Recomputes every row of `model`, e.g. after a bulk load.
+    table, fk = stats_link(model)
+    connection.execute(table.delete())
+    connection.execute(table.insert().from_select(
+        [column.name for column in table.columns], _computed(model, now or datetime.now())))
+
+
+def rollover(connection, now=None):
+    # Recomputes the entities whose next upcoming show has started since
+    # their row was written. Returns how many were refreshed per model.
+    now = now or datetime.now()
+    refreshed = {}
+    for model in (Venue, Artist):
+        table, fk = stats_link(model)
+        ids = [id for id, in connection.execute(select([fk]).where(table.c.next_show_time < now))]
+        refresh(connection, model, ids, now)
+        refreshed[model] = len(ids)
+    if refreshed[Venue]:
+        cache.invalidate('venues')
+    return refreshed
+
+
+#----------------------------------------------------------------------------#
+# Keeping up with shows.
+#----------------------------------------------------------------------------#
+# A new show bumps two counters in the flush that inserts it. Deleted and
+# moved shows are rare, so their entities are recomputed by a job queued
+# once per flush.
+
+def _count_new_show(connection, model, entity_id, start_time, now):
+    table, fk = stats_link(model)
+    if start_time >= now:
+        values = {
+            'upcoming_shows_count': table.c.upcoming_shows_count + 1,
+            'next_show_time': case([(or_(table.c.next_show_time.is_(None), table.c.next_show_time > start_time),
+                                     start_time)], else_=table.c.next_show_time),
+        }
+    else:
+        values = {'past_shows_count': table.c.past_shows_count + 1}
+    values['updated_at'] = datetime.utcnow()
+    return connection.execute(table.update().where(fk == entity_id).values(**values)).rowcount > 0
+
+
+def _record(target, ids):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('show_stats', set()).update(ids)
+
+
+def _on_insert(mapper, connection, target):
+    if not isinstance(target.start_time, datetime):
+        # Set from a string the database parsed; recount after the flush.
+        _record(target, [(Venue, target.venue_id), (Artist, target.artist_id)])
+        return
+    # An entity without a statistics row is recounted by the refresh job: the
+    # other shows of the flush are already in the table by now, so counting
+    # them here would count them twice.
+    now = datetime.now()
+    _record(target, [(model, entity_id) for model, entity_id in
+                     ((Venue, target.venue_id), (Artist, target.artist_id))
+                     if not _count_new_show(connection, model, entity_id, target.start_time, now)])
+
+
+def _on_change(mapper, connection, target):
+    state = inspect(target)
+    ids = [(Venue, id) for id in [target.venue_id] + list(state.attrs.venue_id.history.deleted)]
+    ids += [(Artist, id) for id in [target.artist_id] + list(state.attrs.artist_id.history.deleted)]
+    _record(target, ids)
+
+
+def _on_entity_delete(mapper, connection, target):
+    # PostgreSQL cascades this itself; SQLite does not enforce foreign keys.
+    table, fk = stats_link(type(target))
+    connection.execute(table.delete().where(fk == target.id))
+
+
+event.listen(Show, 'after_insert', _on_insert)
+event.listen(Show, 'after_update', _on_change)
+event.listen(Show, 'after_delete', _on_change)
+event.listen(Venue, 'after_delete', _on_entity_delete)
+event.listen(Artist, 'after_delete', _on_entity_delete)
+
+
+@jobs.handler('refresh_stats')
+def refresh_job(venues=(), artists=()):
+    connection = db.session.connection()
+    now = datetime.now()
+    refresh(connection, Venue, venues, now)
+    refresh(connection, Artist, artists, now)
+    db.session.commit()
+    cache.invalidate('venues')
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_changes(session, flush_context):
+    # Recounted by a job, off the request path; the job is queued in the
+    # flushed transaction, so it only runs if the changes commit.
+    changed = session.info.pop('show_stats', None)
+    if not changed:
+        return
+    ids = {model: sorted({id for kind, id in changed if kind is model and id is not None}) for model in (Venue, Artist)}
+    jobs.enqueue('refresh_stats', bind=session.connection(), venues=ids[Venue], artists=ids[Artist])
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('show_stats', None)
+
+
+#----------------------------------------------------------------------------#
+# Command line.
+#----------------------------------------------------------------------------#
+
+@app.cli.group('stats')
+def stats_command():
+    """Maintain the per-venue and per-artist show statistics."""
+
+
+@stats_command.command('rebuild')
+def rebuild_command():
+    """Recompute all statistics from the show table."""
+    with db.engine.begin() as connection:
+        for model in (Venue, Artist):
+            rebuild(connection, model)
+    cache.invalidate('venues')
+    click.echo('Rebuilt venue and artist statistics')
+
+
+@stats_command.command('rollover')
+@click.option('--every', type=int, default=None,
+              help='Keep running, rolling over every N seconds (e.g. %d).' % ROLLOVER_INTERVAL)
+def rollover_command(every):
+    """Move shows that have started from upcoming to past."""
+    while True:
+        with db.engine.begin() as connection:
+            refreshed = rollover(connection)
+        click.echo('Rolled over %d venues and %d artists' % (refreshed[Venue], refreshed[Artist]))
+        if not every:
+            break
+        time.sleep(every)
@@ -0,0 +1,96 @@
+import logging
+import os
+import time
+
+import click
+from jinja2 import FileSystemBytecodeCache
+
+from setup import app, db
+from models import Venue, Artist
+
+# Compiled templates are stored here and shared by every process on the
+# host, so a new worker loads bytecode instead of parsing the templates.
+app.config.setdefault('TEMPLATE_CACHE_DIR', os.path.join(app.root_path, '.jinja_cache'))
+app.config.setdefault('TEMPLATE_BYTECODE_CACHE', True)
+# Render every page once when a worker starts, before it takes requests.
+app.config.setdefault('TEMPLATE_WARM_UP', True)
+
+logger = logging.getLogger('fyyur.templates')
+
+
+def use_bytecode_cache(directory=None):
+    directory = directory or app.config['TEMPLATE_CACHE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def templates():
+    return [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+
+
+def compile_templates():
+    # Compiles every template, writing the bytecode cache when it is on.
+    # Returns the names compiled.
+    names = templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+def warm_up_requests():
+    # (method, path, form data) reaching every page template, using the
+    # first venue and artist for the detail pages.
+    requests = [('GET', path, None) for path in
+                ('/', '/venues', '/artists', '/shows', '/venues/create', '/artists/create', '/shows/create')]
+    requests += [('POST', '/venues/search', {'search_term': ''}),
+                 ('POST', '/artists/search', {'search_term': ''})]
+    with app.app_context():
+        for model, path in ((Venue, '/venues/%d'), (Artist, '/artists/%d')):
+            entity_id = db.session.query(db.func.min(model.id)).scalar()
+            if entity_id is not None:
+                requests += [('GET', path % entity_id, None), ('GET', (path + '/edit') % entity_id, None)]
+    return requests
+
+
+def warm_up():
+    # Renders each page once, so templates, SQL compilation caches and the
+    # connection pool are ready for the first real request. Failures are
+    # logged, never raised: a worker should still start.
+    started = time.perf_counter()
+    client = app.test_client()
+    try:
+        for method, path, data in warm_up_requests():
+            response = client.open(path, method=method, data=data)
+            if response.status_code >= 500:
+                logger.warning('warm-up %s %s returned %d', method, path, response.status_code)
+    except Exception:
+        logger.exception('warm-up failed')
+    return time.perf_counter() - started
+
+
+if app.config['TEMPLATE_BYTECODE_CACHE']:
+    use_bytecode_cache()
+
+
+#----------------------------------------------------------------------------#
+# Command line.
+#----------------------------------------------------------------------------#
+
+@app.cli.group('templates')
+def templates_command():
+    """Precompile templates and warm up workers."""
+
+
+@templates_command.command('compile')
+def compile_command():
+    """Compile every template into the bytecode cache."""
+    if app.jinja_env.bytecode_cache is None:
+        use_bytecode_cache()
+    names = compile_templates()
+    click.echo('Compiled %d templates into %s' % (len(names), app.config['TEMPLATE_CACHE_DIR']))
+
+
+@templates_command.command('warm-up')
+def warm_up_command():
+    """Render every page once and report how long it took."""
+    click.echo('Warmed up in %.2fs' % warm_up())